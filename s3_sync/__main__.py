@@ -16,6 +16,8 @@ limitations under the License.
 
 import logging
 import os
+import signal
+import sys
 import traceback
 
 from container_crawler import ContainerCrawler
@@ -31,9 +33,11 @@ def main():
     setup_logger(logger_name, conf)
     load_swift(logger_name, args.once)
 
-    from .sync_container import SyncContainer
+    from .sync_container import flush_status, SyncContainer
     logger = logging.getLogger(logger_name)
     logger.debug('Starting S3Sync')
+    # Exit through the finally clause below, so that the status is saved
+    signal.signal(signal.SIGTERM, lambda *args: sys.exit(0))
 
     if 'http_proxy' in conf:
         logger.debug('Using HTTP proxy %r', conf['http_proxy'])
@@ -52,6 +56,8 @@ def main():
         logger.error("S3Sync failed: %s" % repr(e))
         logger.error(traceback.format_exc(e))
         exit(1)
+    finally:
+        flush_status()
 
 
 if __name__ == '__main__':
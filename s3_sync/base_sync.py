@@ -14,10 +14,14 @@ See the License for the specific language governing permissions and
 limitations under the License.
 """
 
+from collections import OrderedDict
 import eventlet
 import logging
+import re
+import time
 
-from s3_sync.utils import filter_hop_by_hop_headers
+from s3_sync.utils import (
+    filter_hop_by_hop_headers, ParallelRangeIterable, RemoteHTTPError)
 
 from swift.common import swob
 
@@ -59,6 +63,12 @@ class ProviderResponse(object):
         raise ValueError('reraise had no prior exception for %s' % me_as_a_str)
 
 
+class ClientPoolTimeout(Exception):
+    """Raised when no client in the pool frees up within the acquire timeout.
+    """
+    pass
+
+
 class BaseSync(object):
     """Generic base class that each provider must implement.
 
@@ -67,6 +77,8 @@ class BaseSync(object):
        propagate Swift objects and metadata to a remote endpoint.
     """
 
+    # Number of concurrent requests that can share a client. Providers whose
+    # clients maintain their own pool of HTTP connections raise this.
     HTTP_CONN_POOL_SIZE = 1
     SLO_WORKERS = 10
     SLO_QUEUE_SIZE = 100
@@ -74,9 +86,9 @@ class BaseSync(object):
     GB = 1024 * MB
 
     class HttpClientPoolEntry(object):
-        def __init__(self, client, pool):
-            self.semaphore = eventlet.semaphore.Semaphore(
-                BaseSync.HTTP_CONN_POOL_SIZE)
+        def __init__(self, client, pool, conns=1):
+            self.conns = conns
+            self.semaphore = eventlet.semaphore.Semaphore(conns)
             self.client = client
             self.pool = pool
 
@@ -84,7 +96,7 @@ class BaseSync(object):
             return self.semaphore.acquire(blocking=False)
 
         def close(self):
-            if self.semaphore.balance > BaseSync.HTTP_CONN_POOL_SIZE - 1:
+            if self.semaphore.balance > self.conns - 1:
                 logging.getLogger('s3-sync').error(
                     'Detected double release of the semaphore')
                 raise RuntimeError('Detected double release of the semaphore!')
@@ -98,13 +110,45 @@ class BaseSync(object):
             self.close()
 
     class HttpClientPool(object):
-        def __init__(self, client_factory, max_conns):
+        """Pool of clients shared by the greenthreads of a provider.
+
+        Each client can serve up to conns_per_client concurrent requests (for
+        clients that maintain a pool of HTTP connections themselves), so the
+        pool holds as few clients as are needed for max_conns requests. The
+        pool keeps the following counters in its stats dictionary:
+            hits -- requests served by an existing client
+            creations -- number of clients created
+            closes -- number of clients closed
+            waits -- requests that had to wait for a free connection
+            wait_time -- total time spent waiting (in seconds)
+            wait_histogram -- number of requests by their wait time, bucketed
+                              by the upper bounds in WAIT_BUCKETS
+            timeouts -- requests that gave up waiting for a connection
+            ops -- per-operation count, errors, and total time (in seconds)
+
+        If acquire_timeout is set, get_client() raises ClientPoolTimeout when
+        no connection frees up within that many seconds, rather than blocking
+        indefinitely. If the logger is a Swift LogAdapter, the counters and
+        timings are also sent to statsd.
+        """
+        WAIT_BUCKETS = (0.001, 0.01, 0.1, 1.0, 10.0, float('inf'))
+
+        def __init__(self, client_factory, max_conns, conns_per_client=1,
+                     acquire_timeout=None, logger=None):
             self.get_semaphore = eventlet.semaphore.Semaphore(max_conns)
+            self.max_conns = max_conns
+            self.conns_per_client = conns_per_client
+            self.acquire_timeout = acquire_timeout
+            self.logger = logger
+            self.stats = dict(
+                hits=0, creations=0, closes=0, waits=0, wait_time=0.0,
+                wait_histogram=[0] * len(self.WAIT_BUCKETS), timeouts=0,
+                ops={})
             self.client_pool = self._create_pool(client_factory, max_conns)
 
         def _create_pool(self, client_factory, max_conns):
-            clients = max_conns / BaseSync.HTTP_CONN_POOL_SIZE
-            if max_conns % BaseSync.HTTP_CONN_POOL_SIZE:
+            clients = max_conns / self.conns_per_client
+            if max_conns % self.conns_per_client:
                 clients += 1
             self.pool_size = clients
             self.client_factory = client_factory
@@ -112,21 +156,62 @@ class BaseSync(object):
             # calculated pool_size
             return []
 
+        def _statsd(self, method, *args):
+            # Only Swift's LogAdapter has the statsd methods
+            func = getattr(self.logger, method, None)
+            if func is not None:
+                func(*args)
+
+        def _increment(self, stat):
+            self.stats[stat] += 1
+            self._statsd('increment', 'client_pool.%s' % stat)
+
+        def _record_wait(self, wait_time):
+            for i, bound in enumerate(self.WAIT_BUCKETS):
+                if wait_time <= bound:
+                    self.stats['wait_histogram'][i] += 1
+                    break
+            self._statsd('timing', 'client_pool.acquire_wait',
+                         wait_time * 1000)
+
         def get_client(self):
             # SLO uploads may exhaust the client pool and we will need to wait
             # for connections
-            self.get_semaphore.acquire()
+            if self.get_semaphore.acquire(blocking=False):
+                self._record_wait(0.0)
+            else:
+                start = time.time()
+                acquired = self.get_semaphore.acquire(
+                    timeout=self.acquire_timeout)
+                wait_time = time.time() - start
+                self.stats['waits'] += 1
+                self.stats['wait_time'] += wait_time
+                self._record_wait(wait_time)
+                if not acquired:
+                    self._increment('timeouts')
+                    raise ClientPoolTimeout(
+                        'Timed out after %.3fs waiting for one of %d '
+                        'connections' % (wait_time, self.max_conns))
             # we are guaranteed that there is an open connection we can use
             # or we should create one
             for client in self.client_pool:
                 if client.acquire():
+                    self._increment('hits')
                     return client
             if len(self.client_pool) < self.pool_size:
+                try:
+                    client = self.client_factory()
+                except Exception:
+                    # The connection is not handed out: give it back
+                    self.release()
+                    raise
                 new_entry = BaseSync.HttpClientPoolEntry(
-                    self.client_factory(), self)
+                    client, self, self.conns_per_client)
                 new_entry.acquire()
                 self.client_pool.append(new_entry)
+                self._increment('creations')
                 return new_entry
+            self.release()
             raise RuntimeError('Pool was exhausted')  # should never happen
 
         def release(self):
@@ -135,6 +220,19 @@ class BaseSync(object):
         def free_count(self):
             return self.get_semaphore.balance
 
+        def in_use_count(self):
+            return self.max_conns - self.free_count()
+
+        def record_op(self, op, elapsed, success=True):
+            op_stats = self.stats['ops'].setdefault(
+                op, dict(count=0, errors=0, time=0.0))
+            op_stats['count'] += 1
+            op_stats['time'] += elapsed
+            if not success:
+                op_stats['errors'] += 1
+                self._statsd('increment', 'ops.%s.errors' % op)
+            self._statsd('timing', 'ops.%s.timing' % op, elapsed * 1000)
+
     def __init__(self, settings, max_conns=10, per_account=False, logger=None,
                  extra_headers=None):
         """Base class that every Cloud Sync provider implementation should
@@ -180,8 +278,14 @@ class BaseSync(object):
         else:
             self.use_custom_prefix = True
             self.custom_prefix = self.custom_prefix.strip('/')
+        # Number of concurrent requests a single client is used for
+        self.conns_per_client = min(self.HTTP_CONN_POOL_SIZE, max_conns)
+        acquire_timeout = settings.get('pool_acquire_timeout')
         self.client_pool = self.HttpClientPool(
-            self._get_client_factory(), max_conns)
+            self._get_client_factory(), max_conns, self.conns_per_client,
+            acquire_timeout=float(acquire_timeout) if acquire_timeout
+            else None,
+            logger=self.logger)
 
     def __repr__(self):
         return '<%s: %s/%s>' % (
@@ -222,6 +326,24 @@ class BaseSync(object):
     def delete_object(self, swift_key):
         raise NotImplementedError()
 
+    def delete_objects(self, swift_keys):
+        """Delete several objects from the remote store.
+
+        Providers that support batched deletes override this. By default, the
+        objects are removed one at a time.
+
+        :returns: list with an entry for each of the keys (in order): None if
+                  the object was removed, or the exception that occurred.
+        """
+        results = []
+        for swift_key in swift_keys:
+            try:
+                self.delete_object(swift_key)
+                results.append(None)
+            except Exception as e:
+                results.append(e)
+        return results
+
     def shunt_object(self, request, swift_key):
         raise NotImplementedError()
 
@@ -237,6 +359,69 @@ class BaseSync(object):
     def get_object(self, swift_key, bucket=None, **options):
         raise NotImplementedError()
 
+    def get_object_range(self, swift_key, start, end, bucket=None,
+                         if_match=None, **options):
+        raise NotImplementedError()
+
+    def get_object_parallel(self, swift_key, part_size, concurrency,
+                            bucket=None, **options):
+        """
+        GETs an object using concurrent ranged requests, returning a response
+        that looks like a regular (200) GET of the whole object.
+
+        The first request fetches the first `part_size` bytes and the headers
+        of the object. If the object is larger than that, the remaining parts
+        are fetched in the background (at most `concurrency` at a time) as the
+        body is consumed. Every part is requested with If-Match set to the ETag
+        of the first response, so that an object that changes mid-download
+        results in an error, rather than a corrupted copy.
+
+        Any other response (including errors) is returned unchanged.
+        """
+        resp = self.get_object_range(
+            swift_key, 0, part_size - 1, bucket=bucket, **options)
+        if resp.status == 416:
+            # Zero-byte objects cannot satisfy any range
+            resp.body.close()
+            return self.get_object(swift_key, bucket=bucket, **options)
+        if resp.status != 206:
+            return resp
+        headers = dict(resp.headers)
+        content_range = headers.pop('content-range', '')
+        try:
+            length = int(content_range.split('/', 1)[1])
+        except (IndexError, ValueError):
+            resp.body.close()
+            raise ValueError('Invalid Content-Range for %s: %r' % (
+                swift_key, content_range))
+        headers['Content-Length'] = str(length)
+        resp.status = 200
+        resp.headers = headers
+        if length <= part_size:
+            return resp
+
+        etag = headers.get('etag')
+
+        def _get_part(start, end):
+            part = self.get_object_range(
+                swift_key, start, end, bucket=bucket, if_match=etag,
+                **options)
+            try:
+                if part.status != 206:
+                    raise RemoteHTTPError(part, 'Failed to GET %s: %d' % (
+                        swift_key, part.status))
+                data = ''.join(part.body)
+            finally:
+                part.body.close()
+            if len(data) != end - start + 1:
+                raise ValueError('Short read of %s (bytes %d-%d): %d' % (
+                    swift_key, start, end, len(data)))
+            return data
+
+        resp.body = ParallelRangeIterable(
+            resp.body, _get_part, length, part_size, concurrency)
+        return resp
+
     def head_bucket(self, bucket, **options):
         raise NotImplementedError()
 
@@ -247,10 +432,15 @@ class BaseSync(object):
         raise NotImplementedError()
 
     def close(self):
-        for client in self.client_pool.client_pool:
-            client.acquire()
-            self._close_conn(client.client)
-            client.close()
+        # Closing the clients does not take any connections from the pool, so
+        # none are released either
+        for entry in self.client_pool.client_pool:
+            self._close_conn(entry.client)
+            self.client_pool._increment('closes')
+
+    def _record_op(self, op, start, resp):
+        self.client_pool.record_op(op, time.time() - start, resp.success)
+        return resp
 
     def _get_client_factory(self):
         raise NotImplementedError()
@@ -259,3 +449,81 @@ class BaseSync(object):
         return u'%s/%s/%s' % (self.account, self.container,
                               key if isinstance(key, unicode)
                               else key.decode('utf-8'))
+
+
+def _prometheus_labels(labels):
+    return '{%s}' % ','.join(
+        '%s="%s"' % (k, str(v).replace('\\', '\\\\').replace('"', '\\"'))
+        for k, v in labels)
+
+
+def format_pool_metrics(providers):
+    """Render the client pool statistics of the providers in the Prometheus
+    text exposition format.
+    """
+    # metric name -> (type, help, [(labels, value)])
+    metrics = OrderedDict()
+
+    def add(name, metric_type, help_text, labels, value):
+        metrics.setdefault(
+            'cloud_sync_' + name, (metric_type, help_text, []))[2].append(
+                (labels, value))
+
+    for provider in providers:
+        pool = provider.client_pool
+        stats = pool.stats
+        labels = [('provider', provider.__class__.__name__),
+                  ('endpoint', provider.endpoint or 's3:/'),
+                  ('bucket', provider.aws_bucket)]
+        add('client_pool_size', 'gauge', 'Maximum number of connections.',
+            labels, pool.max_conns)
+        add('client_pool_in_use', 'gauge', 'Connections in use.',
+            labels, pool.in_use_count())
+        add('client_pool_free', 'gauge', 'Connections available.',
+            labels, pool.free_count())
+        add('client_pool_clients_created_total', 'counter',
+            'Clients created.', labels, stats['creations'])
+        add('client_pool_clients_closed_total', 'counter',
+            'Clients closed.', labels, stats['closes'])
+        add('client_pool_client_reuses_total', 'counter',
+            'Requests served by an existing client.', labels, stats['hits'])
+        add('client_pool_acquire_timeouts_total', 'counter',
+            'Requests that timed out waiting for a connection.',
+            labels, stats['timeouts'])
+        wait_help = 'Time spent waiting for a connection.'
+        total = 0
+        for bound, count in zip(pool.WAIT_BUCKETS, stats['wait_histogram']):
+            total += count
+            add('client_pool_acquire_wait_seconds_bucket', 'histogram',
+                wait_help, labels + [('le', '+Inf' if bound == float('inf')
+                                      else repr(bound))], total)
+        add('client_pool_acquire_wait_seconds_sum', 'histogram', wait_help,
+            labels, stats['wait_time'])
+        add('client_pool_acquire_wait_seconds_count', 'histogram', wait_help,
+            labels, total)
+        for op in sorted(stats['ops']):
+            op_stats = stats['ops'][op]
+            op_labels = labels + [('op', op)]
+            add('request_duration_seconds_sum', 'summary',
+                'Time spent in requests to the remote store.',
+                op_labels, op_stats['time'])
+            add('request_duration_seconds_count', 'summary',
+                'Time spent in requests to the remote store.',
+                op_labels, op_stats['count'])
+            add('request_errors_total', 'counter',
+                'Failed requests to the remote store.',
+                op_labels, op_stats['errors'])
+
+    lines = []
+    families = set()
+    for name, (metric_type, help_text, samples) in metrics.items():
+        family = re.sub('_(bucket|sum|count)$', '', name) \
+            if metric_type in ('histogram', 'summary') else name
+        if family not in families:
+            families.add(family)
+            lines.append('# HELP %s %s' % (family, help_text))
+            lines.append('# TYPE %s %s' % (family, metric_type))
+        for labels, value in samples:
+            lines.append('%s%s %s' % (name, _prometheus_labels(labels),
+                                      repr(value)))
+    return '\n'.join(lines) + '\n'
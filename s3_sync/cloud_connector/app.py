@@ -33,12 +33,12 @@ from swift.proxy.server import Application as ProxyApplication
 from s3_sync.cloud_connector.auth import S3_IDENTITY_ENV_KEY
 from s3_sync.cloud_connector.util import (
     get_and_write_conf_file_from_s3, get_env_options, ConfigReloaderMixin)
-from s3_sync.provider_factory import create_provider
+from s3_sync.provider_factory import ProviderCache
 from s3_sync.shunt import maybe_munge_profile_for_all_containers
 from s3_sync.utils import (
-    get_list_params, filter_hop_by_hop_headers, iter_listing, splice_listing,
-    format_listing_response, SHUNT_BYPASS_HEADER, get_listing_content_type,
-    SeekableFileLikeIter)
+    get_list_params, filter_hop_by_hop_headers, iter_listing,
+    iter_splice_listing, iter_listing_response, SHUNT_BYPASS_HEADER,
+    get_listing_content_type, SeekableFileLikeIter)
 
 
 CLOUD_CONNECTOR_CONF_PATH = os.path.sep + os.path.join(
@@ -68,16 +68,16 @@ class CloudConnectorController(Controller):
         self.local_to_me_profile, per_account = \
             maybe_munge_profile_for_all_containers(local_to_me_profile,
                                                    container_name)
-        self.local_to_me_provider = create_provider(
-            self.local_to_me_profile, max_conns=1, per_account=per_account,
-            logger=self.app.logger)
+        self.local_to_me_provider = self.app.provider_cache.get_provider(
+            self.local_to_me_profile, per_account=per_account)
 
         self.remote_to_me_profile, per_account = \
             maybe_munge_profile_for_all_containers(remote_to_me_profile,
                                                    container_name)
-        self.remote_to_me_provider = create_provider(
-            self.remote_to_me_profile, max_conns=1, per_account=per_account,
-            logger=self.app.logger,
+        # The remote-to-me profile includes the S3 identity of the requester,
+        # so each identity ends up with its own provider.
+        self.remote_to_me_provider = self.app.provider_cache.get_provider(
+            self.remote_to_me_profile, per_account=per_account,
             extra_headers={SHUNT_BYPASS_HEADER: 'true'})
 
         self.aco_str = urllib.quote('/'.join(filter(None, (
@@ -139,7 +139,7 @@ class CloudConnectorController(Controller):
                                       'for %s got %d', self.aco_str,
                                       local_resp.status)
                 return local_resp.to_swob_response(req=req)
-            # This is ok because splice_listing() only iterates over the
+            # This is ok because iter_splice_listing() only iterates over the
             # local_iter--it doesn't try to call next() or anything if it's
             # empty.
             local_iter = []
@@ -168,21 +168,19 @@ class CloudConnectorController(Controller):
         self.app.logger.debug('handle_object_listing: final_status/headers: '
                               '%r %r', final_status, final_headers)
 
-        spliced = splice_listing(local_iter, remote_iter, limit)
-        self.app.logger.debug('handle_object_listing: spliced: %r', spliced)
-
-        response_body = format_listing_response(spliced, resp_type,
-                                                self.container_name)
-        self.app.logger.debug('handle_object_listing: response_body: %r',
-                              response_body)
+        # The listing is spliced and serialized as the client reads it, so
+        # that remote pages are only requested as they are needed
+        spliced = iter_splice_listing(local_iter, remote_iter, limit)
+        response_iter = iter_listing_response(spliced, resp_type,
+                                              self.container_name)
         encoded_headers = {
             k.encode('utf8'): v.encode('utf8')
             for k, v in final_headers.items()
-            if k.lower not in ('content-type', 'content-length')}
+            if k.lower() not in ('content-type', 'content-length')}
 
         no_hop_headers = dict(
             filter_hop_by_hop_headers(encoded_headers.items()))
-        return swob.Response(body=response_body,
+        return swob.Response(app_iter=response_iter,
                              status=final_status,
                              headers=no_hop_headers, request=req,
                              content_type=resp_type)
@@ -474,6 +472,7 @@ class CloudConnectorApplication(ConfigReloaderMixin, ProxyApplication):
     # pipeline.
     modify_wsgi_pipeline = None
     CHECK_PERIOD = 30  # seconds
+    PROVIDER_CACHE_TTL = 300  # seconds
     CONF_FILES = None  # can't be known until __init__ runs
 
     def __init__(self, conf, logger=None):
@@ -492,6 +491,15 @@ class CloudConnectorApplication(ConfigReloaderMixin, ProxyApplication):
         self.memcache = 'look but dont touch'
 
         self.swift_baseurl = conf.get('swift_baseurl')
+        # Providers (and their connections) are reused across requests
+        self.provider_cache = ProviderCache(
+            max_size=int(conf.get('provider_cache_size',
+                                  ProviderCache.DEFAULT_SIZE)),
+            max_conns=int(conf.get('provider_max_conns',
+                                   ProviderCache.DEFAULT_MAX_CONNS)),
+            ttl=float(conf.get('provider_cache_ttl',
+                               self.PROVIDER_CACHE_TTL)),
+            logger=self.logger)
         sync_conf_obj_name = conf.get(
             'conf_file', '/etc/swift-s3-sync/sync.json').lstrip('/')
 
@@ -510,6 +518,7 @@ class CloudConnectorApplication(ConfigReloaderMixin, ProxyApplication):
 
     def load_sync_config(self, sync_conf_contents):
         self.sync_conf = json.loads(sync_conf_contents)
+        self.provider_cache.clear()
 
         self.sync_profiles = {}
         for cont in self.sync_conf['containers']:
@@ -33,8 +33,8 @@ from container_crawler.utils import create_internal_client
 from .daemon_utils import load_swift, setup_context, setup_logger
 from .provider_factory import create_provider
 from .utils import (convert_to_local_headers, convert_to_swift_headers,
-                    get_container_headers, iter_listing, RemoteHTTPError,
-                    SWIFT_TIME_FMT, diff_container_headers,
+                    get_container_headers, iter_listing, iter_listing_pages,
+                    RemoteHTTPError, SWIFT_TIME_FMT, diff_container_headers,
                     get_sys_migrator_header, MigrationContainerStates,
                     diff_account_headers)
 from swift.common.http import HTTP_NOT_FOUND, HTTP_CONFLICT
@@ -50,7 +50,22 @@ LAST_MODIFIED_FMT = '%a, %d %b %Y %H:%M:%S %Z'
 EPOCH = datetime.datetime.utcfromtimestamp(0)
 LOGGER_NAME = 'swift-s3-migrator'
 
-IGNORE_KEYS = set(('status', 'aws_secret', 'all_buckets', 'custom_prefix'))
+# Objects are fetched in parts of this size when download_concurrency > 1
+DEFAULT_DOWNLOAD_PART_SIZE = 8 * 1024 * 1024
+# The boundaries of the listing ranges are picked from about this many samples
+# of the key space per range, using up to this many listing requests
+RANGE_SAMPLES = 4
+MAX_RANGE_SAMPLE_REQUESTS = 1000
+# Sorts after any character that may follow a key prefix
+MAX_KEY_CHAR = u'\U0010ffff'
+# The boundaries of the listing ranges of a sharded migration are kept on the
+# migrated container, so that all of the processes use the same ones
+RANGES_HEADER = get_sys_migrator_header('container') + '-ranges'
+
+IGNORE_KEYS = set(('status', 'aws_secret', 'all_buckets', 'custom_prefix',
+                   'download_part_size', 'download_concurrency',
+                   'listing_prefetch', 'listing_ranges', 'shard_keys',
+                   'pool_acquire_timeout'))
 
 MigrateObjectWork = namedtuple('MigrateObjectWork', 'aws_bucket container key')
 UploadObjectWork = namedtuple('UploadObjectWork', 'container key object '
@@ -61,6 +76,17 @@ class MigrationError(Exception):
     pass
 
 
+class ContainerNotReady(Exception):
+    def __init__(self, account, container, *args, **kwargs):
+        self.account = account
+        self.container = container
+        super(ContainerNotReady, self).__init__(*args, **kwargs)
+
+    def __unicode__(self):
+        return u'Waiting for the owner of %s/%s to set it up' % (
+            self.account, self.container)
+
+
 class ContainerNotFound(Exception):
     def __init__(self, account, container, *args, **kwargs):
         self.account = account
@@ -152,6 +178,15 @@ def _create_x_timestamp_from_hdrs(hdrs):
     return None
 
 
+def _iter_until(listing_iter, end_marker):
+    """Cut the listing (terminated by None) off after end_marker."""
+    for entry in listing_iter:
+        if entry is None or entry['name'] > end_marker:
+            break
+        yield entry
+    yield None
+
+
 class Status(object):
     def __init__(self, status_location):
         self.status_location = status_location
@@ -192,7 +227,7 @@ class Status(object):
                 raise
 
     def save_migration(self, migration, marker, moved_count, scanned_count,
-                       stats_reset=False):
+                       stats_reset=False, ranges=None):
         for entry in self.status_list:
             if equal_migration(entry, migration):
                 if 'status' not in entry:
@@ -209,6 +244,10 @@ class Status(object):
             status = entry['status']
 
         status['marker'] = marker
+        if ranges:
+            status['ranges'] = ranges
+        else:
+            status.pop('ranges', None)
         _update_status_counts(status, moved_count, scanned_count, stats_reset)
         self.save_status_list()
 
@@ -249,18 +288,41 @@ class Migrator(object):
         self.node_id = node_id
         self.nodes = nodes
         self.provider = None
+        self.download_part_size = int(self.config.get(
+            'download_part_size', DEFAULT_DOWNLOAD_PART_SIZE))
+        self.download_concurrency = int(self.config.get(
+            'download_concurrency', 1))
+        # Each worker streams the first part of an object while fetching up
+        # to download_concurrency more: the provider needs that many
+        # connections per worker, or the parts queue behind other workers
+        self.provider_conns = self.max_conns
+        if self.download_concurrency > 1:
+            self.provider_conns *= self.download_concurrency + 1
+        # Number of listing pages of the source to request ahead of the one
+        # being processed
+        self.listing_prefetch = int(self.config.get('listing_prefetch', 0))
+        # Either the number of key ranges of the source container to scan in
+        # parallel, or a list of the keys that delimit the ranges
+        self.listing_ranges = self.config.get('listing_ranges', 1)
+        if not isinstance(self.listing_ranges, list):
+            self.listing_ranges = int(self.listing_ranges)
+        # Whether the objects (rather than the containers) of the migration
+        # are split between the migrator processes. The listing ranges are
+        # then assigned to the processes.
+        self.shard_keys = bool(self.config.get('shard_keys', False)) and \
+            self.nodes > 1
 
     def next_pass(self):
         if self.config['aws_bucket'] != '/*':
             self.provider = create_provider(
-                self.config, self.max_conns, False)
+                self.config, self.provider_conns, False)
             self._next_pass()
             return [dict(self.config)]
 
         self.config['all_buckets'] = True
         self.config['container'] = '.'
         self.provider = create_provider(
-            self.config, self.max_conns, False)
+            self.config, self.provider_conns, False)
         try:
             return self._reconcile_containers()
         except Exception:
@@ -276,7 +338,7 @@ class Migrator(object):
     def _reconcile_containers(self):
         resp, iterator = iter_listing(
             self.provider.list_buckets,
-            self.logger, None, 10000, None)
+            self.logger, None, 10000, None, prefetch=self.listing_prefetch)
 
         if not resp.success:
             self.logger.error(
@@ -299,10 +361,12 @@ class Migrator(object):
 
             while local_container and\
                     local_container['name'] < remote_container:
-                self._maybe_delete_internal_container(local_container['name'])
+                if self._owns_container(local_container['name']):
+                    self._maybe_delete_internal_container(
+                        local_container['name'])
                 local_container = next(local_iterator)
 
-            if index % self.nodes == self.node_id:
+            if self.shard_keys or index % self.nodes == self.node_id:
                 # NOTE: we cannot remap container names when migrating the
                 # entire account
                 self.config['aws_bucket'] = remote_container
@@ -314,7 +378,8 @@ class Migrator(object):
                 local_container = next(local_iterator)
 
         while local_container:
-            self._maybe_delete_internal_container(local_container['name'])
+            if self._owns_container(local_container['name']):
+                self._maybe_delete_internal_container(local_container['name'])
             local_container = next(local_iterator)
         return handled_containers
 
@@ -351,16 +416,26 @@ class Migrator(object):
         self._manifests = set()
         scanned = 0
         copied = 0
-        marker = self.status.get_migration(self.config).get('marker', '')
+        state = self.status.get_migration(self.config)
+        marker = state.get('marker', '')
+        ranges = None
         try:
-            marker, scanned, copied = self._process_container(marker=marker)
-            if scanned == 0:
-                is_reset = True
-                if marker:
-                    marker, scanned, copied = self._process_container(
-                        marker='')
+            if self._use_listing_ranges():
+                ranges = state.get('ranges')
+                ranges, scanned, copied, is_reset = self._process_container(
+                    ranges=ranges or {}, shard=self.shard_keys)
+            else:
+                marker, scanned, copied = self._process_container(
+                    marker=marker)
+                if scanned == 0:
+                    is_reset = True
+                    if marker:
+                        marker, scanned, copied = self._process_container(
+                            marker='')
         except ContainerNotFound as e:
             self.logger.error(unicode(e))
+        except ContainerNotReady as e:
+            self.logger.info(unicode(e))
         except Exception:
             # We must catch any errors to make sure we stop our workers. This
             # might be better with a context manager.
@@ -405,7 +480,7 @@ class Migrator(object):
         copied -= self.errors.qsize()
         # TODO: record the number of errors, as well
         self.status.save_migration(
-            self.config, marker, copied, scanned, is_reset)
+            self.config, marker, copied, scanned, is_reset, ranges=ranges)
 
     def check_errors(self):
         while not self.errors.empty():
@@ -610,11 +685,17 @@ class Migrator(object):
 
     def _iter_source_container(
             self, container, marker, prefix, list_all):
-        next_marker = marker
-
-        while True:
-            resp = self.provider.list_objects(
-                next_marker, self.work_chunk, prefix, bucket=container)
+        def _next_page(entries):
+            return self.provider.list_objects(
+                entries[-1]['name'], self.work_chunk, prefix, bucket=container)
+
+        resp = self.provider.list_objects(
+            marker, self.work_chunk, prefix, bucket=container)
+        if list_all:
+            pages = iter_listing_pages(resp, _next_page, self.listing_prefetch)
+        else:
+            pages = iter([resp])
+        for index, resp in enumerate(pages):
             if resp.status == 404:
                 raise ContainerNotFound(
                     self.config['aws_identity'], container)
@@ -622,13 +703,10 @@ class Migrator(object):
                 raise MigrationError(
                     'Failed to list source bucket/container "%s"' %
                     self.config['aws_bucket'])
-            if not resp.body and marker and marker == next_marker:
+            if not resp.body and marker and index == 0:
                 yield None
             for entry in resp.body:
                 yield entry
-            if not list_all or not resp.body:
-                break
-            next_marker = resp.body[-1]['name']
         yield None
 
     def _check_large_objects(self, aws_bucket, container, key, client):
@@ -670,7 +748,16 @@ class Migrator(object):
 
     def _process_container(
             self, container=None, aws_bucket=None, marker=None, prefix=None,
-            list_all=False):
+            list_all=False, ranges=None, shard=False):
+        '''Migrate the missing objects of a container.
+
+        Returns the last processed key and the number of scanned and copied
+        objects. If the (saved) key ranges to scan are given, returns the
+        updated ranges, the counts, and whether the ranges started over,
+        instead. If shard is set, the container is set up only by the process
+        that owns it (see _owns_container()) and only the ranges assigned to
+        this process are scanned.
+        '''
         if aws_bucket is None:
             aws_bucket = self.config['aws_bucket']
         if container is None:
@@ -683,7 +770,13 @@ class Migrator(object):
         # If a container has versioning enabled (either x-versions-location or
         # x-history-location is configured), we should migrate the versions
         # before migrating the container itself.
-        if self.config.get('protocol') == 'swift':
+        if shard and not self._owns_container(container):
+            # The owner creates the container and keeps its metadata (and
+            # versions) in sync
+            with self.ic_pool.item() as ic:
+                if not ic.container_exists(self.config['account'], container):
+                    raise ContainerNotReady(self.config['account'], container)
+        elif self.config.get('protocol') == 'swift':
             resp = self.provider.head_bucket(aws_bucket)
             if resp.status == 404:
                 raise ContainerNotFound(
@@ -703,7 +796,8 @@ class Migrator(object):
                     # the work, but we cannot migrate the main container
                     # until the versions container is migrated.
                     # NOTE: currently, this container's statistics are rolled
-                    # into the parent container.
+                    # into the parent container. When the container is
+                    # sharded, its owner migrates all of the versions.
                     self._process_container(
                         container=versioned_container,
                         aws_bucket=versioned_container, marker='',
@@ -746,9 +840,218 @@ class Migrator(object):
                 if not ic.container_exists(self.config['account'], container):
                     self._create_container(container, ic, aws_bucket)
 
+        if ranges is not None:
+            return self._find_missing_in_ranges(
+                container, aws_bucket, prefix, ranges, shard)
         return self._find_missing_objects(container, aws_bucket, marker,
                                           prefix, list_all)
 
+    def _owns_container(self, container):
+        '''Whether the container is set up (and removed) by this process, when
+        every process handles it.
+
+        The names are hashed, so that every process can decide on its own and
+        the work is rebalanced as soon as the number of processes changes.
+        '''
+        if self.nodes <= 1:
+            return True
+        if isinstance(container, unicode):
+            container = container.encode('utf-8')
+        return int(hashlib.md5(container).hexdigest(), 16) % self.nodes ==\
+            self.node_id
+
+    def _use_listing_ranges(self):
+        if self.shard_keys:
+            return True
+        if isinstance(self.listing_ranges, list):
+            return bool(self.listing_ranges)
+        return self.listing_ranges > 1
+
+    def _get_listing_ranges_config(self):
+        # A sharded migration has at least one range per process
+        if self.shard_keys and not isinstance(self.listing_ranges, list):
+            return max(self.listing_ranges, self.nodes)
+        return self.listing_ranges
+
+    def _get_listing_ranges(self, container, saved, shard=False):
+        '''Returns the key ranges of the source container.
+
+        Each range covers the keys after its start, up to and including its
+        end (None for the last range), and has its own marker. The ranges in
+        the status are reused as long as they were created from the same
+        configuration (and boundaries), so that each one resumes where it left
+        off.
+        '''
+        config = self._get_listing_ranges_config()
+        if isinstance(config, list):
+            boundaries = sorted(set(config))
+        elif shard:
+            boundaries = self._get_shared_range_boundaries(container, config)
+        elif saved.get('config') == config:
+            return saved['ranges']
+        else:
+            boundaries = self._discover_range_boundaries(config)
+        if saved.get('config') == config and \
+                [r['end'] for r in saved['ranges'][:-1]] == boundaries:
+            return saved['ranges']
+        starts = [''] + boundaries
+        ends = boundaries + [None]
+        return [{'start': start, 'end': end, 'marker': start}
+                for start, end in zip(starts, ends)]
+
+    def _get_shared_range_boundaries(self, container, count):
+        '''Returns the range boundaries of a sharded migration.
+
+        The processes must agree on the boundaries, as each one scans only
+        its own ranges. The owner of the container discovers them and stores
+        them in the container's metadata, where the others find them.
+        '''
+        account = self.config['account']
+        with self.ic_pool.item() as ic:
+            headers = ic.get_container_metadata(account, container)
+            if RANGES_HEADER in headers:
+                saved = json.loads(headers[RANGES_HEADER])
+                if saved['config'] == count:
+                    return saved['boundaries']
+            if not self._owns_container(container):
+                raise ContainerNotReady(account, container)
+            boundaries = self._discover_range_boundaries(count)
+            self._update_container_headers(container, ic, {
+                RANGES_HEADER: json.dumps({'config': count,
+                                           'boundaries': boundaries})})
+        return boundaries
+
+    def _discover_range_boundaries(self, count):
+        '''Split the key space of the source container into ranges.
+
+        The keys are sampled across the whole container, without listing all
+        of them: the key prefixes are split one character at a time, breadth
+        first. A prefix that holds less than a page of keys is listed in full.
+        Otherwise, the characters that follow it are found by skipping over
+        the keys that share them (one request each). The boundaries are then
+        picked so that each range holds about as many keys, counting every
+        prefix that was not listed in full as a page.
+        '''
+        aws_bucket = self.config['aws_bucket']
+        requests = [0]
+
+        def _list(marker, limit, prefix):
+            requests[0] += 1
+            resp = self.provider.list_objects(
+                marker, limit, prefix, bucket=aws_bucket)
+            if resp.status == 404:
+                raise ContainerNotFound(
+                    self.config['aws_identity'], aws_bucket)
+            if resp.status != 200:
+                raise MigrationError(
+                    'Failed to list source bucket/container "%s"' %
+                    aws_bucket)
+            return [entry['name'] for entry in resp.body]
+
+        def _split(prefix, page):
+            # Returns the prefixes that are one character longer, as
+            # (prefix, first key, keys) tuples, where the keys are None, unless
+            # they are all known
+            children = []
+            while page:
+                if len(page[0]) == len(prefix):
+                    # The prefix is a key of its own
+                    children.append((None, page[0], page[:1]))
+                    page = page[1:]
+                    continue
+                child = page[0][:len(prefix) + 1]
+                keys = [key for key in page if key.startswith(child)]
+                if len(keys) < len(page):
+                    children.append((child, keys[0], keys))
+                    page = page[len(keys):]
+                else:
+                    children.append((child, keys[0], None))
+                    page = _list(child + MAX_KEY_CHAR, 1, prefix)
+            return children
+
+        nodes = [(self.config.get('prefix', ''), None, None)]
+        while True:
+            pending = [node for node in nodes if node[2] is None]
+            if not pending or len(pending) >= count * RANGE_SAMPLES:
+                break
+            expanded = []
+            for prefix, first, keys in nodes:
+                if keys is not None or \
+                        requests[0] >= MAX_RANGE_SAMPLE_REQUESTS:
+                    expanded.append((prefix, first, keys))
+                    continue
+                page = _list('', self.work_chunk, prefix)
+                if len(page) < self.work_chunk:
+                    if page:
+                        expanded.append((prefix, page[0], page))
+                else:
+                    expanded.extend(_split(prefix, page))
+            if expanded == nodes:
+                break
+            nodes = expanded
+
+        # Each known key weighs one, while the prefixes with more keys weigh
+        # (at least) a page
+        samples = []
+        for _, first, keys in nodes:
+            if keys is None:
+                samples.append((first, self.work_chunk))
+            else:
+                samples.extend((key, 1) for key in keys)
+        total = sum(weight for _, weight in samples)
+        # The range ends are inclusive: a range ends with the first key of
+        # the sample that follows it
+        boundaries = []
+        seen = 0
+        for key, weight in samples:
+            if seen * count >= total * (len(boundaries) + 1):
+                boundaries.append(key)
+            seen += weight
+        return boundaries
+
+    def _find_missing_in_ranges(self, container, aws_bucket, prefix, saved,
+                                shard=False):
+        '''Scans the ranges concurrently.
+
+        A range that reaches its end is marked as done and waits for the
+        others, so that the migration is only reset (and every range starts
+        over) once all of the keys have been scanned. If shard is set, the
+        ranges are assigned to the processes in turn, and only the ones of
+        this process are scanned (and counted).
+        '''
+        def _owns_range(index):
+            return not shard or index % self.nodes == self.node_id
+
+        def _process_range(index, key_range):
+            if key_range.get('done') or not _owns_range(index):
+                return key_range, 0, 0
+            marker, scanned, copied = self._find_missing_objects(
+                container, aws_bucket, key_range['marker'], prefix, False,
+                end_marker=key_range['end'])
+            if scanned == 0:
+                return dict(key_range, marker=marker, done=True), 0, 0
+            return dict(key_range, marker=marker), scanned, copied
+
+        def _process_ranges(ranges):
+            pool = eventlet.GreenPool(len(ranges))
+            results = list(pool.imap(_process_range, *zip(*enumerate(ranges))))
+            return ([new_range for new_range, _, _ in results],
+                    sum(scanned for _, scanned, _ in results),
+                    sum(copied for _, _, copied in results))
+
+        ranges = self._get_listing_ranges(container, saved, shard)
+        config = self._get_listing_ranges_config()
+        ranges, scanned, copied = _process_ranges(ranges)
+        if not all(key_range.get('done') for index, key_range
+                   in enumerate(ranges) if _owns_range(index)):
+            return {'config': config, 'ranges': ranges}, scanned, copied, \
+                False
+        ranges, scanned, copied = _process_ranges([
+            {'start': key_range['start'], 'end': key_range['end'],
+             'marker': key_range['start']} if _owns_range(index)
+            else key_range for index, key_range in enumerate(ranges)])
+        return {'config': config, 'ranges': ranges}, scanned, copied, True
+
     def _old_enough(self, remote):
         older_than = self.config.get('older_than')
         if older_than is None:
@@ -760,8 +1063,8 @@ class Migrator(object):
         return remote_time < now - older_than
 
     def _find_missing_objects(
-            self, container, aws_bucket, marker, prefix, list_all):
-
+            self, container, aws_bucket, marker, prefix, list_all,
+            end_marker=None):
         try:
             source_iter = self._iter_source_container(
                 aws_bucket, marker, prefix, list_all)
@@ -771,6 +1074,9 @@ class Migrator(object):
         copied = 0
         scanned = 0
         local_iter = self._iterate_internal_listing(container, marker, prefix)
+        if end_marker is not None:
+            source_iter = _iter_until(source_iter, end_marker)
+            local_iter = _iter_until(local_iter, end_marker)
         local = next(local_iter)
         remote = next(source_iter)
         if remote:
@@ -841,7 +1147,12 @@ class Migrator(object):
                 aws_bucket))
             return
 
-        resp = self.provider.get_object(key, **args)
+        if self.download_concurrency > 1:
+            resp = self.provider.get_object_parallel(
+                key, self.download_part_size, self.download_concurrency,
+                **args)
+        else:
+            resp = self.provider.get_object(key, **args)
         if resp.status != 200:
             resp.body.close()
             raise MigrationError('Failed to GET "%s/%s": %s' % (
@@ -980,7 +1291,8 @@ def process_migrations(migrations, migration_status, internal_pool, logger,
                        items_chunk, workers, node_id, nodes):
     handled_containers = []
     for index, migration in enumerate(migrations):
-        if migration['aws_bucket'] == '/*' or index % nodes == node_id:
+        if migration['aws_bucket'] == '/*' or migration.get('shard_keys') or\
+                index % nodes == node_id:
             if migration.get('remote_account'):
                 src_account = migration.get('remote_account')
             else:
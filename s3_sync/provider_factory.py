@@ -14,6 +14,10 @@ See the License for the specific language governing permissions and
 limitations under the License.
 """
 
+from collections import OrderedDict
+import json
+import time
+
 from .sync_s3 import SyncS3
 from .sync_swift import SyncSwift
 
@@ -29,3 +33,75 @@ def create_provider(sync_settings, max_conns, per_account=False, logger=None,
                          extra_headers=extra_headers)
     else:
         raise NotImplementedError()
+
+
+class ProviderCache(object):
+    """
+    Bounded LRU cache of providers, keyed on the sync profile.
+
+    Creating a provider sets up a new boto3 session or swiftclient connection
+    (which, for Swift, also means re-authenticating). Callers that handle many
+    short-lived requests (e.g. the shunt) should get their providers from this
+    cache, so that the clients -- and their connection pools -- are reused
+    across requests.
+
+    If `ttl` is set, providers that have not been used for that many seconds
+    are dropped and re-created on the next use.
+
+    Evicted providers are not explicitly closed, as there may be in-flight
+    requests (e.g. a streaming GET) still using their clients. The connections
+    are released once the last reference to the provider goes away.
+    """
+    DEFAULT_SIZE = 100
+    DEFAULT_MAX_CONNS = 10
+
+    def __init__(self, max_size=DEFAULT_SIZE, max_conns=DEFAULT_MAX_CONNS,
+                 ttl=None, logger=None):
+        self.max_size = max_size
+        self.max_conns = max_conns
+        self.ttl = ttl
+        self.logger = logger
+        # key -> (provider, last used time)
+        self._providers = OrderedDict()
+
+    @staticmethod
+    def _make_key(sync_settings, per_account, extra_headers):
+        return (json.dumps(sync_settings, sort_keys=True),
+                per_account,
+                json.dumps(extra_headers or {}, sort_keys=True))
+
+    def get_provider(self, sync_settings, per_account=False,
+                     extra_headers=None):
+        now = time.time()
+        self._expire(now)
+        key = self._make_key(sync_settings, per_account, extra_headers)
+        provider, _ = self._providers.pop(key, (None, None))
+        if provider is None:
+            provider = create_provider(
+                sync_settings, self.max_conns, per_account=per_account,
+                logger=self.logger, extra_headers=extra_headers)
+        # (Re-)inserting the entry marks it as the most recently used one
+        self._providers[key] = (provider, now)
+        while len(self._providers) > self.max_size:
+            self._providers.popitem(last=False)
+        return provider
+
+    def _expire(self, now):
+        if not self.ttl:
+            return
+        # The entries are in the order of use, so we can stop at the first one
+        # that is still fresh.
+        while self._providers:
+            key = next(iter(self._providers))
+            if now - self._providers[key][1] <= self.ttl:
+                break
+            del self._providers[key]
+
+    def clear(self):
+        self._providers.clear()
+
+    def providers(self):
+        return [provider for provider, _ in self._providers.values()]
+
+    def __len__(self):
+        return len(self._providers)
@@ -0,0 +1,133 @@
+"""
+Copyright 2017 SwiftStack
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+from collections import namedtuple
+import errno
+import os
+import sqlite3
+import time
+
+
+RestoreJob = namedtuple('RestoreJob', 'account container obj attempts')
+
+
+class RestoreQueue(object):
+    """
+    Durable queue of the objects to restore from the remote store into the
+    cluster.
+
+    The queue is a sqlite database local to the node. The shunt adds the
+    objects that it serves from the remote store, while the restorer daemon
+    (swift-s3-restorer) drains it. An object is queued at most once: reads of
+    an object that is already queued do not add another entry, so that
+    concurrent reads of a popular object result in a single restore.
+
+    Accounts, containers, and objects are UTF8-encoded strings.
+
+    The database is kept in the WAL mode, without a sync on every commit:
+    readers do not block the writers, and a write does not wait on the disk.
+    The last updates may be lost if the node loses power, in which case the
+    objects are queued again when they are next read.
+    """
+    # Seconds to wait for the database lock held by another process (e.g.
+    # another proxy server worker)
+    LOCK_TIMEOUT = 5
+
+    def __init__(self, queue_location, lock_timeout=LOCK_TIMEOUT):
+        self.queue_location = queue_location
+        self.lock_timeout = lock_timeout
+        self._conn = None
+
+    def _open(self):
+        if self._conn is not None:
+            return self._conn
+        queue_dir = os.path.dirname(self.queue_location)
+        if queue_dir and not os.path.exists(queue_dir):
+            try:
+                os.mkdir(queue_dir)
+            except OSError as e:
+                # Another process may have created it in the meantime
+                if e.errno != errno.EEXIST:
+                    raise
+        conn = sqlite3.connect(self.queue_location, isolation_level=None,
+                               timeout=self.lock_timeout,
+                               check_same_thread=False)
+        try:
+            conn.text_factory = str
+            conn.execute('PRAGMA journal_mode = WAL')
+            conn.execute('PRAGMA synchronous = NORMAL')
+            conn.execute('CREATE TABLE IF NOT EXISTS restores ('
+                         'account TEXT, container TEXT, object TEXT, '
+                         'attempts INTEGER DEFAULT 0, '
+                         'not_before REAL DEFAULT 0, '
+                         'PRIMARY KEY (account, container, object))')
+            conn.execute('CREATE INDEX IF NOT EXISTS restores_not_before '
+                         'ON restores (not_before)')
+        except sqlite3.DatabaseError:
+            conn.close()
+            raise
+        self._conn = conn
+        return self._conn
+
+    def put(self, account, container, obj):
+        """
+        Queues the object for a restore.
+
+        :returns: True if the object was queued; False if it was already in
+                  the queue.
+        """
+        cursor = self._open().execute(
+            'INSERT OR IGNORE INTO restores (account, container, object) '
+            'VALUES (?, ?, ?)', (account, container, obj))
+        return cursor.rowcount == 1
+
+    def get(self, limit, now=None):
+        """
+        Returns up to `limit` jobs that are due, the oldest ones first. The
+        jobs stay in the queue until they are removed or retried.
+        """
+        if now is None:
+            now = time.time()
+        rows = self._open().execute(
+            'SELECT account, container, object, attempts FROM restores '
+            'WHERE not_before <= ? ORDER BY not_before LIMIT ?',
+            (now, limit)).fetchall()
+        return [RestoreJob(*row) for row in rows]
+
+    def remove(self, job):
+        self._open().execute(
+            'DELETE FROM restores '
+            'WHERE account = ? AND container = ? AND object = ?',
+            (job.account, job.container, job.obj))
+
+    def retry(self, job, delay, now=None):
+        """Defers the job by `delay` seconds, counting the failed attempt."""
+        if now is None:
+            now = time.time()
+        self._open().execute(
+            'UPDATE restores SET attempts = ?, not_before = ? '
+            'WHERE account = ? AND container = ? AND object = ?',
+            (job.attempts + 1, now + delay, job.account, job.container,
+             job.obj))
+
+    def __len__(self):
+        return self._open().execute(
+            'SELECT COUNT(*) FROM restores').fetchone()[0]
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
@@ -0,0 +1,243 @@
+"""
+Copyright 2017 SwiftStack
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import eventlet
+eventlet.patcher.monkey_patch(all=True)
+
+import errno
+import logging
+import time
+
+from container_crawler.utils import create_internal_client
+from .daemon_utils import load_swift, setup_context, setup_logger
+from .provider_factory import ProviderCache
+from .restore_queue import RestoreQueue
+from .shunt import get_sync_profile, load_sync_profiles
+from .utils import check_slo, convert_to_local_headers, SwiftSloRestore
+from swift.common.swob import Request
+from swift.common.utils import (
+    close_if_possible, FileLikeIter, quote, ratelimit_sleep)
+
+
+LOGGER_NAME = 'swift-s3-restorer'
+
+
+def _job_name(job):
+    return '/'.join((job.account, job.container, job.obj))
+
+
+class Restorer(object):
+    """
+    Restores the objects queued by the shunt into the local cluster.
+
+    Each pass takes up to `batch_size` of the due jobs from the queue and
+    restores up to `workers` objects at a time, starting at most
+    `max_rate` restores per second (if set). Failed restores are retried
+    with an exponential backoff, starting at `retry_interval` seconds, and
+    are dropped after `max_attempts`.
+    """
+    def __init__(self, queue, sync_profiles, app, logger, workers=10,
+                 batch_size=1000, max_rate=0, retry_interval=60,
+                 max_attempts=5, slo_concurrency=1):
+        self.queue = queue
+        self.sync_profiles = sync_profiles
+        self.app = app
+        self.logger = logger
+        self.workers = workers
+        self.batch_size = batch_size
+        self.max_rate = max_rate
+        self.retry_interval = retry_interval
+        self.max_attempts = max_attempts
+        self.slo_concurrency = slo_concurrency
+        self.provider_cache = ProviderCache(max_conns=workers, logger=logger)
+
+    def _request(self, path, method, headers=None, body=None):
+        env = {'REQUEST_METHOD': method}
+        if body is not None:
+            env['wsgi.input'] = body
+        resp = Request.blank(path, environ=env, headers=headers).get_response(
+            self.app)
+        close_if_possible(resp.app_iter)
+        return resp
+
+    def restore(self, job):
+        """
+        Restores the object of the job.
+
+        :returns: True if the job is done (including when the object no longer
+                  needs to be restored); False if it should be retried.
+        """
+        name = _job_name(job)
+        sync_profile, per_account = get_sync_profile(
+            self.sync_profiles, job.account, job.container)
+        if sync_profile is None or not sync_profile.get('restore_object'):
+            self.logger.info('Not restoring %s: no matching profile' % name)
+            return True
+
+        path = '/v1/%s' % quote(name)
+        resp = self._request(path, 'HEAD')
+        if resp.is_success:
+            self.logger.debug('%s is already restored' % name)
+            return True
+        if resp.status_int != 404:
+            self.logger.warning('Failed to HEAD %s: %s' % (name, resp.status))
+            return False
+
+        provider = self.provider_cache.get_provider(sync_profile, per_account)
+        key = job.obj.decode('utf-8')
+        # The headers tell how to restore the object: SLO segments are
+        # fetched separately, so only the other objects are fetched whole
+        remote_resp = provider.head_object(key)
+        if remote_resp.status == 404:
+            self.logger.info('Not restoring %s: removed from the remote store'
+                             % name)
+            return True
+        if remote_resp.status != 200:
+            self.logger.warning(
+                'Failed to HEAD %s in the remote store: %d' % (
+                    name, remote_resp.status))
+            return False
+
+        put_headers = convert_to_local_headers(remote_resp.headers.items())
+        if check_slo(put_headers):
+            manifest = provider.get_manifest(key)
+            if not manifest:
+                self.logger.warning('Failed to get the manifest of %s' % name)
+                return False
+            get_range = SwiftSloRestore.range_getter(
+                provider, key, remote_resp.headers.get('etag'))
+            # The internal client's pipeline has no SLO middleware
+            return SwiftSloRestore(
+                get_range, put_headers, path, self.app, manifest,
+                self.slo_concurrency, self.logger,
+                internal_manifest=True).run()
+
+        args = {}
+        if sync_profile.get('protocol') == 'swift':
+            args['resp_chunk_size'] = 65536
+        remote_resp = provider.get_object(key, **args)
+        if remote_resp.status != 200:
+            close_if_possible(remote_resp.body)
+            self.logger.warning(
+                'Failed to GET %s from the remote store: %d' % (
+                    name, remote_resp.status))
+            return False
+        put_headers = convert_to_local_headers(remote_resp.headers.items())
+        if check_slo(put_headers):
+            # Replaced by an SLO since the HEAD
+            close_if_possible(remote_resp.body)
+            self.logger.info('%s changed in the remote store' % name)
+            return False
+
+        try:
+            resp = self._request(path, 'PUT', headers=put_headers,
+                                 body=FileLikeIter(remote_resp.body))
+        finally:
+            close_if_possible(remote_resp.body)
+        if not resp.is_success:
+            self.logger.warning('Failed to restore %s: %s' % (
+                name, resp.status))
+            return False
+        self.logger.debug('Restored %s' % name)
+        return True
+
+    def _process(self, job):
+        try:
+            return job, self.restore(job)
+        except Exception:
+            self.logger.exception('Failed to restore %s' % _job_name(job))
+            return job, False
+
+    def _rate_limited(self, jobs):
+        running_time = 0
+        for job in jobs:
+            if self.max_rate:
+                running_time = ratelimit_sleep(running_time, self.max_rate)
+            yield job
+
+    def run_once(self):
+        """
+        Processes the jobs that are due.
+
+        :returns: the number of processed jobs.
+        """
+        jobs = self.queue.get(self.batch_size)
+        pool = eventlet.GreenPool(self.workers)
+        for job, done in pool.imap(self._process, self._rate_limited(jobs)):
+            if done:
+                self.queue.remove(job)
+            elif job.attempts + 1 >= self.max_attempts:
+                self.logger.error(
+                    'Giving up on restoring %s after %d attempts' % (
+                        _job_name(job), job.attempts + 1))
+                self.queue.remove(job)
+            else:
+                self.queue.retry(
+                    job, self.retry_interval * 2 ** job.attempts)
+        return len(jobs)
+
+
+def run(restorer, logger, poll_interval, once):
+    while True:
+        cycle_start = time.time()
+        count = restorer.run_once()
+        elapsed = time.time() - cycle_start
+        logger.info('Processed %d restores in %0.2fs' % (count, elapsed))
+        if once:
+            return
+        # A full batch means that there may be more jobs waiting
+        if count < restorer.batch_size:
+            time.sleep(max(0, poll_interval - elapsed))
+
+
+def main():
+    args, conf = setup_context(
+        description='Daemon to restore objects into Swift')
+    if 'restorer_settings' not in conf:
+        print 'Missing restorer settings section'
+        exit(-1)
+
+    restorer_conf = conf['restorer_settings']
+    if 'queue_file' not in restorer_conf:
+        print 'Missing restore queue location!'
+        exit(-1 * errno.ENOENT)
+
+    if args.log_level:
+        restorer_conf['log_level'] = args.log_level
+    restorer_conf['console'] = args.console
+
+    setup_logger(LOGGER_NAME, restorer_conf)
+    load_swift(LOGGER_NAME, args.once)
+    logger = logging.getLogger(LOGGER_NAME)
+
+    swift_dir = conf.get('swift_dir', '/etc/swift')
+    internal_client = create_internal_client(conf, swift_dir)
+
+    restorer = Restorer(
+        RestoreQueue(restorer_conf['queue_file']), load_sync_profiles(conf),
+        internal_client.app, logger,
+        workers=int(restorer_conf.get('workers', 10)),
+        batch_size=int(restorer_conf.get('batch_size', 1000)),
+        max_rate=float(restorer_conf.get('restores_per_second', 0)),
+        retry_interval=float(restorer_conf.get('retry_interval', 60)),
+        max_attempts=int(restorer_conf.get('max_attempts', 5)),
+        slo_concurrency=int(restorer_conf.get('slo_restore_concurrency', 1)))
+    run(restorer, logger, float(restorer_conf.get('poll_interval', 5)),
+        args.once)
+
+
+if __name__ == '__main__':
+    main()
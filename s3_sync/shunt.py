@@ -14,7 +14,9 @@ See the License for the specific language governing permissions and
 limitations under the License.
 """
 
+import hashlib
 import json
+import sqlite3
 
 from os.path import getmtime
 from swift.common import constraints, swob, utils
@@ -22,14 +24,18 @@ from swift.common.wsgi import make_subrequest
 from swift.proxy.controllers.base import get_account_info
 from time import time
 
-from .provider_factory import create_provider
+from .base_sync import format_pool_metrics, ProviderResponse
+from .provider_factory import ProviderCache
+from .restore_queue import RestoreQueue
 from .utils import (check_slo, SwiftPutWrapper, SwiftSloPutWrapper,
+                    SwiftSloRestore,
                     RemoteHTTPError, convert_to_local_headers,
                     response_is_complete, filter_hop_by_hop_headers,
                     iter_listing, get_container_headers,
                     MigrationContainerStates, get_sys_migrator_header,
-                    get_list_params, format_listing_response,
-                    format_container_listing_response, splice_listing,
+                    get_list_params, iter_listing_response,
+                    iter_container_listing_response, iter_splice_listing,
+                    iter_json_array,
                     SHUNT_BYPASS_HEADER, get_listing_content_type)
 
 
@@ -96,7 +102,56 @@ def maybe_munge_profile_for_all_containers(sync_profile, container_name):
     return sync_profile, False
 
 
+def load_sync_profiles(conf):
+    """
+    Returns the profiles of the containers that are shunted, keyed on the
+    UTF8-encoded (account, container) tuple.
+    """
+    sync_profiles = {}
+    for cont in conf.get('containers', []):
+        # ONLY use shunt if merge_namespaces is set to true for sync
+        if not cont.get('merge_namespaces', False):
+            continue
+        key = (cont['account'].encode('utf-8'),
+               cont['container'].encode('utf-8'))
+        sync_profiles[key] = cont
+
+    for migration in conf.get('migrations', []):
+        profile = dict(migration)
+        # Migrations should have some sane defaults if they aren't present
+        profile.setdefault('restore_object', True)
+        profile.setdefault('container', profile['aws_bucket'])
+        profile.setdefault('migration', True)
+        # if, in the future, we support custom_prefix on the S3 side,
+        # we may need to change this. Swift side code ignores custom_prefix
+        profile['custom_prefix'] = ''
+        key = (profile['account'].encode('utf-8'),
+               profile['container'].encode('utf-8'))
+        sync_profiles[key] = profile
+    return sync_profiles
+
+
+def get_sync_profile(sync_profiles, account, container):
+    """
+    Finds the profile that applies to the UTF8-encoded account and container.
+
+    Returns a (sync profile, `per_account`) tuple, as
+    maybe_munge_profile_for_all_containers does, or (None, False) if the
+    container is not shunted.
+    """
+    sync_profile = next((sync_profiles[(account, c)]
+                         for c in (container, '/*')
+                         if (account, c) in sync_profiles), None)
+    if sync_profile is None:
+        return None, False
+    return maybe_munge_profile_for_all_containers(sync_profile, container)
+
+
 class S3SyncShunt(object):
+    # Seconds to wait for the restore queue lock held by another process
+    RESTORE_QUEUE_LOCK_TIMEOUT = 0.1
+    DEFAULT_SLO_RESTORE_MAX = 10
+
     def __init__(self, app, conf_file, conf):
         self.logger = utils.get_logger(
             conf, name='proxy-server:s3_sync.shunt',
@@ -105,6 +160,48 @@ class S3SyncShunt(object):
         self.app = app
         self.conf_file = conf_file
         self.sync_profiles = {}
+        self.provider_cache = ProviderCache(
+            max_size=int(conf.get('provider_cache_size',
+                                  ProviderCache.DEFAULT_SIZE)),
+            max_conns=int(conf.get('provider_max_conns',
+                                   ProviderCache.DEFAULT_MAX_CONNS)),
+            logger=self.logger)
+        # Optional path that serves the client pool metrics of the cached
+        # providers in the Prometheus text format
+        self.metrics_path = conf.get('metrics_path')
+        # The metrics list the remote endpoints and buckets: they are only
+        # served to these client addresses (the proxy host, by default)
+        self.metrics_allowed_addresses = set(utils.list_from_csv(
+            conf.get('metrics_allowed_addresses', '127.0.0.1, ::1')))
+        # Remote listing pages may be cached in memcache for this many seconds
+        self.listing_cache_ttl = int(conf.get('listing_cache_ttl', 0))
+        # Remote 404s may be cached in memcache for this many seconds
+        self.negative_cache_ttl = int(conf.get('negative_cache_ttl', 0))
+        # When set, SLOs are restored in the background with this many
+        # concurrent segment uploads, rather than from the client's stream
+        self.slo_restore_concurrency = int(
+            conf.get('slo_restore_concurrency', 0))
+        # Up to this many SLOs are restored in the background at once; the
+        # others are restored from the client's stream
+        self.slo_restore_max = int(conf.get(
+            'slo_restore_max', self.DEFAULT_SLO_RESTORE_MAX))
+        # Path -> greenthread of the background restores in progress
+        self._slo_restores = {}
+        # The background restores use their own providers (and connection
+        # pools), so that they cannot starve the client requests
+        self.restore_provider_cache = ProviderCache(
+            max_size=self.provider_cache.max_size,
+            max_conns=max(self.slo_restore_concurrency, 1),
+            logger=self.logger)
+        # When set, restores are queued for the restorer daemon, rather than
+        # performed from the client's stream
+        self.restore_queue = None
+        if conf.get('restore_queue'):
+            # The queue is updated from the proxy's event loop: a busy queue
+            # falls back to the inline restore, rather than stall the worker
+            self.restore_queue = RestoreQueue(
+                conf['restore_queue'],
+                lock_timeout=self.RESTORE_QUEUE_LOCK_TIMEOUT)
         self.reload_time = 15
         self._rtime = 0
         self._mtime = 0
@@ -126,33 +223,18 @@ class S3SyncShunt(object):
                                 self.conf_file, err)
             conf = {'containers': []}
 
-        self.sync_profiles = {}
-        for cont in conf.get('containers', []):
-            # ONLY use shunt if merge_namespaces is set to true for sync
-            if not cont.get('merge_namespaces', False):
-                continue
-            key = (cont['account'].encode('utf-8'),
-                   cont['container'].encode('utf-8'))
-            self.sync_profiles[key] = cont
-
-        for migration in conf.get('migrations', []):
-            profile = dict(migration)
-            # Migrations should have some sane defaults if they aren't present
-            profile.setdefault('restore_object', True)
-            profile.setdefault('container', profile['aws_bucket'])
-            profile.setdefault('migration', True)
-            # if, in the future, we support custom_prefix on the S3 side,
-            # we may need to change this. Swift side code ignores custom_prefix
-            profile['custom_prefix'] = ''
-            key = (profile['account'].encode('utf-8'),
-                   profile['container'].encode('utf-8'))
-            self.sync_profiles[key] = profile
+        # Any cached provider may have been created from a stale profile
+        self.provider_cache.clear()
+        self.restore_provider_cache.clear()
+        self.sync_profiles = load_sync_profiles(conf)
 
     def __call__(self, env, start_response):
         if time() > self._rtime:
             self._reload()
 
         req = swob.Request(env)
+        if self.metrics_path and req.path == self.metrics_path:
+            return self.handle_metrics(req, start_response)
         try:
             vers, acct, cont, obj = req.split_path(2, 4, True)
         except ValueError:
@@ -177,13 +259,13 @@ class S3SyncShunt(object):
 
             return self.app(env, start_response)
 
-        sync_profile = next((self.sync_profiles[(acct, c)]
-                             for c in (cont, '/*')
-                             if (acct, c) in self.sync_profiles), None)
+        sync_profile, per_account = get_sync_profile(
+            self.sync_profiles, acct, cont)
         if sync_profile is None:
             return self.app(env, start_response)
-        sync_profile, per_account = maybe_munge_profile_for_all_containers(
-            sync_profile, cont)
+
+        if req.method in ('PUT', 'POST', 'DELETE'):
+            self.invalidate_cache(req, acct, cont)
 
         if req.method == 'DELETE' and sync_profile.get('migration'):
             return self.handle_delete(
@@ -211,20 +293,128 @@ class S3SyncShunt(object):
         return self.app(env, start_response)
 
     def iter_remote_objects(
-            self, sync_profile, per_account, marker, limit, prefix, delimiter):
-        provider = create_provider(sync_profile, max_conns=1,
-                                   per_account=per_account)
+            self, sync_profile, per_account, marker, limit, prefix, delimiter,
+            req=None):
+        provider = self.provider_cache.get_provider(
+            sync_profile, per_account)
+        list_func = provider.list_objects
+        if req is not None:
+            list_func = self._cached_list_func(
+                req, list_func, sync_profile, per_account)
         return iter_listing(
-            provider.list_objects, self.logger, marker, limit, prefix,
-            delimiter)
+            list_func, self.logger, marker, limit, prefix, delimiter)
+
+    @staticmethod
+    def _generation_key(acct, cont):
+        return 'cloud_sync/generation/%s/%s' % (acct, cont)
+
+    @staticmethod
+    def _profile_hash(sync_profile, per_account):
+        return hashlib.md5(json.dumps(
+            [sync_profile, per_account], sort_keys=True)).hexdigest()
+
+    def _cache_prefix(self, memcache, req, sync_profile, per_account):
+        _, acct, cont, _ = req.split_path(3, 4, True)
+        generation = memcache.get(self._generation_key(acct, cont)) or 0
+        return '%s/%s' % (
+            self._profile_hash(sync_profile, per_account), generation)
+
+    def invalidate_cache(self, req, acct, cont):
+        memcache = req.environ.get('swift.cache')
+        if not (self.listing_cache_ttl or self.negative_cache_ttl) or\
+                memcache is None:
+            return
+        # Bumping the generation makes all of the cached listing pages and
+        # negative lookups of the container unreachable
+        try:
+            memcache.incr(self._generation_key(acct, cont))
+        except Exception as e:
+            self.logger.warning(
+                'Failed to invalidate the cache of %s/%s: %s',
+                acct, cont, e)
+
+    def _negative_cache_key(self, req, sync_profile, per_account, obj):
+        memcache = req.environ.get('swift.cache')
+        if not self.negative_cache_ttl or memcache is None:
+            return None
+        return 'cloud_sync/negative/%s/%s' % (
+            self._cache_prefix(memcache, req, sync_profile, per_account),
+            hashlib.md5(obj).hexdigest())
+
+    def _get_negative(self, req, cache_key):
+        if cache_key is None:
+            return None
+        result = req.environ['swift.cache'].get(cache_key)
+        self._increment('negative_cache.%s' % ('hit' if result else 'miss'))
+        return result
+
+    def _set_negative(self, req, cache_key):
+        if cache_key is None:
+            return
+        req.environ['swift.cache'].set(
+            cache_key, True, time=self.negative_cache_ttl)
+
+    def _cached_list_func(self, req, list_func, sync_profile, per_account):
+        '''Wrap the list function with the memcache-backed listing cache.
+
+        The remote pages are cached before they are formatted, so the same
+        entries serve JSON, XML, and plain text listings. The pages are keyed
+        on the profile, the generation of the container (bumped on every PUT,
+        POST, or DELETE handled by the shunt), and the listing parameters.
+        '''
+        memcache = req.environ.get('swift.cache')
+        if not self.listing_cache_ttl or memcache is None:
+            return list_func
+        cache_prefix = self._cache_prefix(
+            memcache, req, sync_profile, per_account)
+
+        def _list(marker, limit, prefix, delimiter):
+            params_hash = hashlib.md5(json.dumps(
+                [marker, limit, prefix, delimiter])).hexdigest()
+            cache_key = 'cloud_sync/listing/%s/%s' % (
+                cache_prefix, params_hash)
+            cached = memcache.get(cache_key)
+            if cached:
+                self._increment('listing_cache.hit')
+                return ProviderResponse(
+                    True, 200, cached['headers'], cached['entries'])
+            self._increment('listing_cache.miss')
+            resp = list_func(marker, limit, prefix, delimiter)
+            if resp.status == 200:
+                memcache.set(cache_key,
+                             {'headers': resp.headers, 'entries': resp.body},
+                             time=self.listing_cache_ttl)
+            return resp
+        return _list
+
+    def _increment(self, metric):
+        # Only Swift's LogAdapter has the statsd methods
+        increment = getattr(self.logger, 'increment', None)
+        if increment is not None:
+            increment(metric)
 
     def iter_remote_account(
             self, sync_profile, marker, limit, prefix, delimiter):
         '''Iterate through the remote listing of containers.'''
-        provider = create_provider(sync_profile, max_conns=1)
+        provider = self.provider_cache.get_provider(sync_profile)
         return iter_listing(
             provider.list_buckets, self.logger, marker, limit, prefix, False)
 
+    def handle_metrics(self, req, start_response):
+        if req.environ.get('REMOTE_ADDR') not in \
+                self.metrics_allowed_addresses:
+            return swob.HTTPForbidden(request=req)(
+                req.environ, start_response)
+        if req.method not in ('GET', 'HEAD'):
+            return swob.HTTPMethodNotAllowed(
+                request=req, headers={'Allow': 'GET, HEAD'})(
+                    req.environ, start_response)
+        resp = swob.Response(
+            request=req,
+            body=format_pool_metrics(self.provider_cache.providers()),
+            content_type='text/plain; version=0.0.4')
+        return resp(req.environ, start_response)
+
     def handle_account(self, req, start_response, sync_profile, account):
         limit, marker, prefix, delimiter, _ = get_list_params(
             req, constraints.ACCOUNT_LISTING_LIMIT)
@@ -242,15 +432,29 @@ class S3SyncShunt(object):
 
         _, remote_iter = self.iter_remote_account(
             sync_profile, marker, limit, prefix, delimiter)
-        spliced = splice_listing(
-            json.load(utils.FileLikeIter(app_iter)), remote_iter, limit)
-        response = format_container_listing_response(
-            spliced, resp_type, account)
-        dict_headers = dict(headers)
-        dict_headers['Content-Length'] = len(response)
+        spliced = iter_splice_listing(
+            iter_json_array(app_iter), remote_iter, limit)
+        return self._stream_listing(
+            start_response, status, headers, resp_type, app_iter,
+            iter_container_listing_response(spliced, resp_type, account))
+
+    @staticmethod
+    def _stream_listing(start_response, status, headers, resp_type,
+                        local_iter, response_iter):
+        # The spliced listing is serialized as the client reads it, so its
+        # length is not known up front
+        dict_headers = dict((k, v) for k, v in dict(headers).items()
+                            if k.lower() != 'content-length')
         dict_headers['Content-Type'] = resp_type
         start_response(status, dict_headers.items())
-        return response
+
+        def _iter_response():
+            try:
+                for chunk in response_iter:
+                    yield chunk
+            finally:
+                utils.close_if_possible(local_iter)
+        return _iter_response()
 
     def handle_object_put(
             self, req, start_response, sync_profile, per_account):
@@ -262,8 +466,8 @@ class S3SyncShunt(object):
             start_response(status, headers)
             return app_iter
 
-        provider = create_provider(sync_profile, max_conns=1,
-                                   per_account=per_account)
+        provider = self.provider_cache.get_provider(
+            sync_profile, per_account)
         headers = {}
         if sync_profile.get('protocol') == 'swift':
             try:
@@ -321,7 +525,8 @@ class S3SyncShunt(object):
             return app_iter
 
         remote_resp, remote_iter = self.iter_remote_objects(
-            sync_profile, per_account, marker, limit, prefix, delimiter)
+            sync_profile, per_account, marker, limit, prefix, delimiter,
+            req=req)
 
         if status.startswith('404 '):
             # This must be a migration, where the container has not yet been
@@ -337,17 +542,16 @@ class S3SyncShunt(object):
             # TODO: If to_wsgi does the utf8 header encoding, we wouldn't have
             # to worry about it here.
             status = remote_resp.to_wsgi()[0]
-            spliced = splice_listing([], remote_iter, limit)
+            utils.close_if_possible(app_iter)
+            app_iter = []
+            spliced = iter_splice_listing([], remote_iter, limit)
         else:
-            spliced = splice_listing(
-                json.load(utils.FileLikeIter(app_iter)), remote_iter, limit)
+            spliced = iter_splice_listing(
+                iter_json_array(app_iter), remote_iter, limit)
 
-        response = format_listing_response(spliced, resp_type, cont)
-        dict_headers = dict(headers)
-        dict_headers['Content-Length'] = len(response)
-        dict_headers['Content-Type'] = resp_type
-        start_response(status, dict_headers.items())
-        return response
+        return self._stream_listing(
+            start_response, status, headers, resp_type, app_iter,
+            iter_listing_response(spliced, resp_type, cont))
 
     def handle_container_head(self, req, start_response, sync_profile, cont,
                               per_account):
@@ -361,8 +565,8 @@ class S3SyncShunt(object):
         trans_id_headers = [(h, v) for h, v in headers if h.lower() in (
             'x-trans-id', 'x-openstack-request-id')]
 
-        provider = create_provider(sync_profile, max_conns=1,
-                                   per_account=per_account)
+        provider = self.provider_cache.get_provider(
+            sync_profile, per_account)
 
         resp = provider.head_bucket(sync_profile['aws_bucket'])
         if resp.status != 200:
@@ -400,28 +604,44 @@ class S3SyncShunt(object):
 
         utils.close_if_possible(app_iter)
 
-        provider = create_provider(sync_profile, max_conns=1,
-                                   per_account=per_account)
+        negative_key = self._negative_cache_key(
+            req, sync_profile, per_account, obj)
+        if self._get_negative(req, negative_key):
+            self.logger.debug('Cached remote 404 for %s' % req.path)
+            return swob.HTTPNotFound(request=req, headers=trans_id_headers)(
+                req.environ, start_response)
+
+        provider = self.provider_cache.get_provider(
+            sync_profile, per_account)
         if req.method == 'GET' and sync_profile.get('restore_object', False) \
                 and 'range' not in req.headers:
-            # We incur an extra request hit by checking for a possible SLO.
             obj = obj.decode('utf-8')
-            manifest = provider.get_manifest(obj)
-            self.logger.debug("Manifest: %s" % manifest)
             status, headers, app_iter = provider.shunt_object(req, obj)
             put_headers = convert_to_local_headers(headers)
 
-            if response_is_complete(int(status.split()[0]), headers):
-                if check_slo(put_headers) and manifest:
-                    app_iter = SwiftSloPutWrapper(
-                        app_iter, put_headers, req.environ['PATH_INFO'],
-                        self.app, manifest, self.logger)
-                else:
+            if response_is_complete(int(status.split()[0]), headers) and \
+                    not self.queue_restore(req):
+                # Only SLOs (including MPUs, which the providers report as
+                # SLOs) incur the extra request for the manifest.
+                manifest = None
+                if check_slo(put_headers):
+                    manifest = provider.get_manifest(obj)
+                    self.logger.debug("Manifest: %s" % manifest)
+                if not manifest:
                     app_iter = SwiftPutWrapper(
                         app_iter, put_headers, req.environ['PATH_INFO'],
                         self.app, self.logger)
+                elif not self.slo_restore_concurrency or \
+                        not self.restore_slo(req, sync_profile, per_account,
+                                             obj, put_headers, manifest):
+                    # Otherwise, the client's stream is passed through
+                    app_iter = SwiftSloPutWrapper(
+                        app_iter, put_headers, req.environ['PATH_INFO'],
+                        self.app, manifest, self.logger)
         else:
             status, headers, app_iter = provider.shunt_object(req, obj)
+        if status.startswith('404 '):
+            self._set_negative(req, negative_key)
         headers = [(k.encode('utf-8'), unicode(v).encode('utf-8'))
                    for k, v in headers]
         self.logger.debug('Remote resp: %s' % status)
@@ -432,6 +652,53 @@ class S3SyncShunt(object):
         start_response(status, headers)
         return app_iter
 
+    def queue_restore(self, req):
+        """
+        Queues the object for the restorer daemon.
+
+        :returns: True if the object is in the restore queue; False if the
+                  queue is not configured or could not be updated.
+        """
+        if self.restore_queue is None:
+            return False
+        _, acct, cont, obj = req.split_path(4, 4, True)
+        try:
+            if self.restore_queue.put(acct, cont, obj):
+                self.logger.debug('Queued the restore of %s' % req.path)
+        except (sqlite3.Error, OSError, IOError) as e:
+            self.logger.warning(
+                'Failed to queue the restore of %s: %s' % (req.path, e))
+            return False
+        return True
+
+    def restore_slo(self, req, sync_profile, per_account, obj, put_headers,
+                    manifest):
+        """
+        Restores the SLO in the background, unless it is already being
+        restored.
+
+        :returns: True if the SLO is being restored; False if too many
+                  restores are in progress.
+        """
+        path = req.environ['PATH_INFO']
+        if path in self._slo_restores:
+            self.logger.debug('Already restoring %s' % req.path)
+            return True
+        if len(self._slo_restores) >= self.slo_restore_max:
+            self.logger.debug('Too many restores to restore %s in the '
+                              'background' % req.path)
+            return False
+        provider = self.restore_provider_cache.get_provider(
+            sync_profile, per_account)
+        get_range = SwiftSloRestore.range_getter(
+            provider, obj, put_headers.get('etag'))
+        restore = SwiftSloRestore(
+            get_range, put_headers, path, self.app, manifest,
+            self.slo_restore_concurrency, self.logger).start()
+        self._slo_restores[path] = restore
+        restore.link(lambda _: self._slo_restores.pop(path, None))
+        return True
+
     def handle_delete(
             self, req, start_response, sync_profile, obj, per_account):
         status, headers, app_iter = req.call_application(self.app)
@@ -441,8 +708,8 @@ class S3SyncShunt(object):
             return app_iter
 
         if sync_profile.get('migration'):
-            provider = create_provider(sync_profile, max_conns=1,
-                                       per_account=per_account)
+            provider = self.provider_cache.get_provider(
+                sync_profile, per_account)
             remote_resp = provider.shunt_delete(req, obj)
 
         if status.startswith('404'):
@@ -472,8 +739,8 @@ class S3SyncShunt(object):
             start_response(status, headers)
             return app_iter
 
-        provider = create_provider(sync_profile, max_conns=1,
-                                   per_account=per_account)
+        provider = self.provider_cache.get_provider(
+            sync_profile, per_account)
         status, headers, app_iter = provider.shunt_post(req, obj)
         start_response(status, headers)
         return app_iter
@@ -17,6 +17,7 @@ limitations under the License.
 import eventlet
 eventlet.patcher.monkey_patch(all=True)
 
+import errno
 import json
 import logging
 import os
@@ -27,15 +28,42 @@ import time
 
 import container_crawler.base_sync
 from .provider_factory import create_provider
+from .sync_s3 import SyncIndex, SyncS3, UploadStatus
+from .utils import dump_json_atomically
 from container_crawler import RetryError
 
 
+# Status file -> the latest status of the container, until it is written out
+_pending_status = {}
+# Status file -> the time the status was last written out
+_status_write_times = {}
+
+
+def _write_status(status_file):
+    status = _pending_status.pop(status_file)
+    status_dir = os.path.dirname(status_file)
+    if not os.path.exists(status_dir):
+        os.mkdir(status_dir)
+    dump_json_atomically(status, status_file)
+    _status_write_times[status_file] = time.time()
+
+
+def flush_status():
+    """
+    Writes out the status updates that are held in memory (see
+    SyncContainer.save_last_row()). Must be called before the process exits.
+    """
+    for status_file in _pending_status.keys():
+        _write_status(status_file)
+
+
 class SyncContainer(container_crawler.base_sync.BaseSync):
     # There is an implicit link between the names of the json fields and the
     # object fields -- they have to be the same.
     POLICY_FIELDS = ['copy_after',
                      'retain_local',
                      'propagate_delete']
+    DEFAULT_STATUS_SAVE_INTERVAL = 10
 
     def __init__(self, status_dir, sync_settings, max_conns=10,
                  per_account=False):
@@ -46,61 +74,174 @@ class SyncContainer(container_crawler.base_sync.BaseSync):
         self.copy_after = int(sync_settings.get('copy_after', 0))
         self.retain_local = sync_settings.get('retain_local', True)
         self.propagate_delete = sync_settings.get('propagate_delete', True)
+        self.max_conns = max_conns
+        # The status is written out at most once per this many seconds
+        self.status_save_interval = float(sync_settings.get(
+            'status_save_interval', self.DEFAULT_STATUS_SAVE_INTERVAL))
+        # The status entries are cached until the status file changes
+        self._status = None
+        self._status_file_id = None
+        # Rows waiting to be handled in a batch: (row, Event) tuples
+        self._pending_rows = []
         self.provider = create_provider(sync_settings, max_conns,
                                         per_account=self._per_account)
+        if isinstance(self.provider, SyncS3):
+            # Keep track of multipart uploads, so that they can be resumed
+            self.provider.upload_status = UploadStatus(
+                self._status_file + '.uploads')
+            index_location = self._status_file + '.index'
+            if sync_settings.get('sync_index', False):
+                # Remember the synced objects, so that they are not checked
+                # against the remote store again
+                self.provider.sync_index = SyncIndex(
+                    index_location,
+                    json.dumps([self.provider.endpoint, self.aws_bucket]),
+                    verify=sync_settings.get('verify_sync_index', False))
+            else:
+                # The objects deleted while the index is off would not be
+                # removed from it: a stale index must not be enabled again
+                try:
+                    os.unlink(index_location)
+                except OSError as e:
+                    if e.errno != errno.ENOENT:
+                        raise
+
+    def _get_status_file_id(self):
+        try:
+            st = os.stat(self._status_file)
+        except OSError as e:
+            if e.errno == errno.ENOENT:
+                return None
+            raise
+        return (st.st_ino, st.st_mtime, st.st_size)
+
+    def _load_status(self):
+        if self._status_file in _pending_status:
+            return _pending_status[self._status_file]
+        file_id = self._get_status_file_id()
+        if self._status is not None and file_id == self._status_file_id:
+            return self._status
+        status = {}
+        if file_id is not None:
+            with open(self._status_file) as f:
+                try:
+                    status = json.load(f)
+                except ValueError:
+                    pass
+        self._status = status
+        self._status_file_id = file_id
+        return status
 
     def get_last_row(self, db_id):
-        if not os.path.exists(self._status_file):
+        status = self._load_status()
+        # First iteration did not include the bucket and DB ID
+        if 'last_row' in status:
+            return status['last_row']
+        if db_id not in status:
             return 0
-        with open(self._status_file) as f:
-            try:
-                status = json.load(f)
-                # First iteration did not include the bucket and DB ID
-                if 'last_row' in status:
-                    return status['last_row']
-                if db_id in status:
-                    entry = status[db_id]
-                    if entry['aws_bucket'] != self.aws_bucket:
-                        return 0
-                    # Prior to 0.1.18, policy was not included in the status
-                    if 'policy' in status[db_id]:
-                        for field in self.POLICY_FIELDS:
-                            value = getattr(self, field)
-                            if status[db_id]['policy'][field] != value:
-                                return 0
-                    return entry['last_row']
-                return 0
-            except ValueError:
-                return 0
+        entry = status[db_id]
+        if entry['aws_bucket'] != self.aws_bucket:
+            return 0
+        # Prior to 0.1.18, policy was not included in the status
+        if 'policy' in entry:
+            for field in self.POLICY_FIELDS:
+                value = getattr(self, field)
+                if entry['policy'][field] != value:
+                    return 0
+        return entry['last_row']
 
     def save_last_row(self, row, db_id):
-        if not os.path.exists(self._status_account_dir):
-            os.mkdir(self._status_account_dir)
-        if not os.path.exists(self._status_file):
-            with open(self._status_file, 'w') as f:
-                json.dump({db_id: dict(last_row=row,
-                                       aws_bucket=self.aws_bucket)}, f)
-                return
-
-        with open(self._status_file, 'r+') as f:
-            status = json.load(f)
-            # The first version did not include the DB ID and aws_bucket in the
-            # status entries
-            policy = {}
-            for field in self.POLICY_FIELDS:
-                policy[field] = getattr(self, field)
-            new_status = dict(last_row=row,
-                              aws_bucket=self.aws_bucket,
-                              policy=policy)
-            if 'last_row' in status:
-                status = {db_id: new_status}
+        status = dict(self._load_status())
+        # The first version did not include the DB ID and aws_bucket in the
+        # status entries
+        if 'last_row' in status:
+            status = {}
+        policy = {}
+        for field in self.POLICY_FIELDS:
+            policy[field] = getattr(self, field)
+        status[db_id] = dict(last_row=row,
+                             aws_bucket=self.aws_bucket,
+                             policy=policy)
+        # Writing the status out (and fsyncing it) for every batch of rows
+        # dominates the cost of handling small batches. The status is
+        # instead held in memory, until status_save_interval passes since it
+        # was last written. A crash may cause the rows handled in the
+        # meantime to be handled again.
+        _pending_status[self._status_file] = status
+        last_write = _status_write_times.get(self._status_file, 0)
+        if time.time() - last_write >= self.status_save_interval:
+            _write_status(self._status_file)
+            self._status = status
+            self._status_file_id = self._get_status_file_id()
+
+    def handle_batch(self, rows, swift_client):
+        """
+        Handles several rows at once, grouped by operation: the deletes are
+        propagated with the batched deletes of the provider (e.g. S3
+        multi-object deletes), while the other rows are handled concurrently
+        (up to the number of provider connections). If the batched delete
+        fails as a whole, the objects are deleted one at a time instead.
+
+        Returns a list with an entry for each row (in order): None if the row
+        was handled, or the exception that occurred, so that the row can be
+        retried.
+        """
+        results = [None] * len(rows)
+
+        def _handle(index):
+            try:
+                self._handle_row(rows[index], swift_client)
+            except Exception as e:
+                results[index] = e
+
+        pool = eventlet.GreenPool(self.max_conns)
+        deletes = []
+        for index, row in enumerate(rows):
+            if row['deleted'] and self.propagate_delete:
+                deletes.append(index)
+            elif not row['deleted']:
+                pool.spawn_n(_handle, index)
+        if deletes:
+            try:
+                errors = self.provider.delete_objects(
+                    [rows[index]['name'] for index in deletes])
+            except Exception as e:
+                self.logger.warning(
+                    'Failed to delete %d objects in a batch (%r); deleting '
+                    'them one at a time' % (len(deletes), e))
+                for index in deletes:
+                    pool.spawn_n(_handle, index)
             else:
-                status[db_id] = new_status
-            f.seek(0)
-            json.dump(status, f)
-            f.truncate()
+                for index, error in zip(deletes, errors):
+                    results[index] = error
+        pool.waitall()
+        return results
 
     def handle(self, row, swift_client):
+        """
+        Handles a row. The crawler handles several rows at once: the rows
+        that arrive while the first one waits for its turn are handled
+        together, with handle_batch(). Raises the error of the row, if any,
+        so that the row is retried.
+        """
+        result = eventlet.event.Event()
+        self._pending_rows.append((row, result))
+        if len(self._pending_rows) == 1:
+            # Let the other rows being handled join the batch
+            eventlet.sleep()
+            batch, self._pending_rows = self._pending_rows, []
+            try:
+                errors = self.handle_batch(
+                    [entry[0] for entry in batch], swift_client)
+            except Exception as e:
+                errors = [e] * len(batch)
+            for (_, event), error in zip(batch, errors):
+                event.send(error)
+        error = result.wait()
+        if error is not None:
+            raise error
+
+    def _handle_row(self, row, swift_client):
         if row['deleted']:
             if self.propagate_delete:
                 self.provider.delete_object(row['name'])
@@ -18,11 +18,16 @@ import boto3
 import botocore.exceptions
 from botocore.handlers import (
     conditionally_calculate_md5, set_list_objects_encoding_type_url)
+from collections import OrderedDict
+import errno
 import eventlet
 import hashlib
 import json
+import os
 import re
+import sqlite3
 import sys
+import time
 import traceback
 import urllib
 
@@ -31,12 +36,170 @@ from .base_sync import BaseSync
 from .base_sync import ProviderResponse
 from .utils import (
     convert_to_s3_headers, convert_to_swift_headers, FileWrapper,
-    SLOFileWrapper, ClosingResourceIterable, get_slo_etag, check_slo,
+    SegmentsFileWrapper, SLOFileWrapper, ClosingResourceIterable,
+    get_slo_etag, check_slo, dump_json_atomically,
     SLO_ETAG_FIELD, SLO_HEADER, SWIFT_USER_META_PREFIX, SWIFT_TIME_FMT,
     SeekableFileLikeIter)
 
 
+class UploadStatus(object):
+    """
+    Persists the state of the SLO multipart uploads that are in progress, so
+    that an upload that fails part way through can be resumed on the next
+    attempt, rather than restarted.
+
+    The entries are kept in a JSON file, keyed on the S3 key of the object.
+    Each one holds the upload ID, a fingerprint of the object being uploaded
+    (to detect changes between attempts) and the ETags of the completed parts.
+    The parts are written out at most once every PART_SAVE_INTERVAL seconds
+    (and when flushed): the ones that are not recorded are recovered from the
+    listing of the upload's parts when it is resumed.
+    """
+    PART_SAVE_INTERVAL = 10
+
+    def __init__(self, status_location):
+        self.status_location = status_location
+        self.uploads = None
+        self._last_save = 0
+        self._dirty = False
+
+    def _load(self):
+        if self.uploads is not None:
+            return
+        self.uploads = {}
+        try:
+            with open(self.status_location) as fh:
+                self.uploads = json.load(fh)
+        except IOError as e:
+            if e.errno != errno.ENOENT:
+                raise
+        except ValueError:
+            # Losing the state only means that the uploads are restarted
+            pass
+
+    def _save(self):
+        status_dir = os.path.dirname(self.status_location)
+        if not os.path.exists(status_dir):
+            os.mkdir(status_dir)
+        dump_json_atomically(self.uploads, self.status_location)
+        self._last_save = time.time()
+        self._dirty = False
+
+    def flush(self):
+        if self._dirty:
+            self._save()
+
+    def get_upload(self, s3_key):
+        self._load()
+        return self.uploads.get(s3_key)
+
+    def start_upload(self, s3_key, upload_id, fingerprint):
+        self._load()
+        self.uploads[s3_key] = dict(
+            upload_id=upload_id, fingerprint=fingerprint, parts={})
+        self._save()
+
+    def save_part(self, s3_key, part_number, etag):
+        self._load()
+        if s3_key not in self.uploads:
+            return
+        self.uploads[s3_key]['parts'][str(part_number)] = etag
+        self._dirty = True
+        if time.time() - self._last_save >= self.PART_SAVE_INTERVAL:
+            self._save()
+
+    def remove_upload(self, s3_key):
+        self._load()
+        if self.uploads.pop(s3_key, None) is not None:
+            self._save()
+
+
+class SyncIndex(object):
+    """
+    Records the ETag and a hash of the metadata of the objects synced to the
+    remote store, so that unchanged objects are not examined again (e.g. when
+    a container is re-crawled after a policy change).
+
+    The index is a sqlite database, kept next to the container's status file
+    and keyed on the S3 key of the object. It also records the remote
+    destination: if that changes, the entries are discarded. Losing the
+    index is harmless -- the objects are checked against the remote store
+    and the index is rebuilt as they are processed. In the verification mode,
+    the entries are not used, but are still updated from the results of
+    those checks.
+    """
+    def __init__(self, index_location, destination, verify=False):
+        self.index_location = index_location
+        self.destination = destination
+        self.verify = verify
+        self._conn = None
+
+    def _open(self):
+        if self._conn is not None:
+            return self._conn
+        index_dir = os.path.dirname(self.index_location)
+        if not os.path.exists(index_dir):
+            os.mkdir(index_dir)
+        try:
+            self._conn = self._connect()
+        except sqlite3.DatabaseError:
+            # A damaged index is discarded and rebuilt
+            os.unlink(self.index_location)
+            self._conn = self._connect()
+        row = self._conn.execute(
+            "SELECT value FROM info WHERE key = 'destination'").fetchone()
+        if row is None or row[0] != self.destination:
+            # The entries describe the objects in another remote store
+            self.clear()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO info VALUES ('destination', ?)",
+                (self.destination,))
+        return self._conn
+
+    def _connect(self):
+        conn = sqlite3.connect(self.index_location, isolation_level=None,
+                               check_same_thread=False)
+        try:
+            conn.text_factory = str
+            # The index can always be rebuilt: trade durability for speed
+            conn.execute('PRAGMA synchronous = OFF')
+            conn.execute('CREATE TABLE IF NOT EXISTS synced ('
+                         'name TEXT PRIMARY KEY, etag TEXT, meta_hash TEXT)')
+            conn.execute('CREATE TABLE IF NOT EXISTS info ('
+                         'key TEXT PRIMARY KEY, value TEXT)')
+        except sqlite3.DatabaseError:
+            conn.close()
+            raise
+        return conn
+
+    def get(self, name):
+        if self.verify:
+            return None
+        return self._open().execute(
+            'SELECT etag, meta_hash FROM synced WHERE name = ?',
+            (name,)).fetchone()
+
+    def set(self, name, etag, meta_hash):
+        self._open().execute(
+            'INSERT OR REPLACE INTO synced VALUES (?, ?, ?)',
+            (name, etag, meta_hash))
+
+    def remove(self, name):
+        self._open().execute('DELETE FROM synced WHERE name = ?', (name,))
+
+    def clear(self):
+        self._open().execute('DELETE FROM synced')
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+
 class SyncS3(BaseSync):
+    # boto3 clients are safe to share between greenthreads: each one keeps a
+    # pool of (up to) this many HTTP connections
+    HTTP_CONN_POOL_SIZE = 10
     # S3 prefix space: 6 16 digit characters
     PREFIX_LEN = 6
     PREFIX_SPACE = 16 ** PREFIX_LEN
@@ -47,6 +210,23 @@ class SyncS3(BaseSync):
     CLOUD_SYNC_VERSION = '5.0'
     GOOGLE_UA_STRING = 'CloudSync/%s (GPN:SwiftStack)' % CLOUD_SYNC_VERSION
     SLO_MANIFEST_SUFFIX = '.swift_slo_manifest'
+    # Attempts at uploading an SLO part are retried with exponential backoff
+    SLO_PART_RETRIES = 3
+    SLO_RETRY_BACKOFF = 1  # seconds
+
+    # Maximum number of keys in a multi-object delete request
+    DELETE_BATCH_SIZE = 1000
+    # Number of objects for which the last synced state is remembered
+    SYNCED_CACHE_SIZE = 10000
+
+    def __init__(self, *args, **kwargs):
+        super(SyncS3, self).__init__(*args, **kwargs)
+        # Set to an UploadStatus instance to make SLO uploads resumable
+        self.upload_status = None
+        # Set to a SyncIndex instance to persist the state of synced objects
+        self.sync_index = None
+        # S3 key -> ETag and metadata hash last synced (LRU)
+        self._synced = OrderedDict()
 
     def _add_extra_headers(self, model, params, **kwargs):
         """
@@ -80,12 +260,15 @@ class SyncS3(BaseSync):
         if not self.endpoint or self.endpoint.endswith('amazonaws.com'):
             # We always use v4 signer with Amazon, as it will support all
             # regions.
-            boto_config = boto3.session.Config(signature_version='s3v4',
-                                               s3={'aws_chunked': True})
+            boto_config = boto3.session.Config(
+                signature_version='s3v4', s3={'aws_chunked': True},
+                max_pool_connections=self.conns_per_client)
         else:
             # For the other providers, we default to v2 signer, as a lot of
             # them don't support v4 (e.g. Google)
-            boto_config = boto3.session.Config(s3={'addressing_style': 'path'})
+            boto_config = boto3.session.Config(
+                s3={'addressing_style': 'path'},
+                max_pool_connections=self.conns_per_client)
             if self._google():
                 boto_config.user_agent = "%s %s" % (
                     self.GOOGLE_UA_STRING, boto_session._session.user_agent())
@@ -122,66 +305,131 @@ class SyncS3(BaseSync):
 
     def upload_object(self, swift_key, storage_policy_index, internal_client):
         s3_key = self.get_s3_name(swift_key)
-        try:
-            with self.client_pool.get_client() as s3_client:
-                s3_meta = s3_client.head_object(Bucket=self.aws_bucket,
-                                                Key=s3_key)
-        except botocore.exceptions.ClientError as e:
-            resp_meta = e.response.get('ResponseMetadata', {})
-            if resp_meta.get('HTTPStatusCode', 0) == 404:
-                s3_meta = None
-            else:
-                raise e
         swift_req_hdrs = {
             'X-Backend-Storage-Policy-Index': storage_policy_index,
             'X-Newest': True
         }
 
+        # The object is opened right away: its headers are all we need to
+        # compare against the remote object and, if they differ, the same
+        # request is used to upload the data.
         try:
-            metadata = internal_client.get_object_metadata(
-                self.account, self.container, swift_key,
-                headers=swift_req_hdrs)
+            wrapper_stream = FileWrapper(internal_client,
+                                         self.account,
+                                         self.container,
+                                         swift_key,
+                                         swift_req_hdrs)
         except UnexpectedResponse as e:
             if '404 Not Found' in e.message:
+                self._abort_stale_upload(s3_key)
                 return
             raise
 
-        self.logger.debug("Metadata: %s" % str(metadata))
-        if check_slo(metadata):
-            self.upload_slo(swift_key, storage_policy_index, s3_meta,
-                            internal_client)
-            return
-
-        if s3_meta and self.check_etag(metadata['etag'], s3_meta['ETag']):
-            if self.is_object_meta_synced(s3_meta, metadata):
+        try:
+            metadata = wrapper_stream.get_headers()
+            self.logger.debug("Metadata: %s" % str(metadata))
+            if not check_slo(metadata):
+                self._abort_stale_upload(s3_key)
+            # When the local copy is removed after the upload, the remote
+            # object is always checked: the recorded state may be stale (e.g.
+            # the remote object expired or was removed out of band).
+            if self.settings.get('retain_local', True) and \
+                    self._is_synced(s3_key, metadata):
                 return
-            elif not self.in_glacier(s3_meta):
-                self.update_metadata(swift_key, metadata)
+
+            if check_slo(metadata):
+                # The internal client returns the manifest itself, which
+                # saves upload_slo() from having to GET it again.
+                manifest = json.loads(''.join(wrapper_stream))
+                wrapper_stream.close()
+                self.upload_slo(swift_key, storage_policy_index,
+                                self._head_s3_object(s3_key), internal_client,
+                                manifest=manifest, headers=metadata)
                 return
 
-        with self.client_pool.get_client() as s3_client:
-            wrapper_stream = FileWrapper(internal_client,
-                                         self.account,
-                                         self.container,
-                                         swift_key,
-                                         swift_req_hdrs)
-            self.logger.debug('Uploading %s with meta: %r' % (
-                s3_key, wrapper_stream.get_s3_headers()))
+            s3_meta = self._head_s3_object(s3_key)
+            if s3_meta and self.check_etag(metadata['etag'], s3_meta['ETag']):
+                if self.is_object_meta_synced(s3_meta, metadata):
+                    self._set_synced(s3_key, metadata)
+                    return
+                elif not self.in_glacier(s3_meta):
+                    self.update_metadata(swift_key, metadata)
+                    self._set_synced(s3_key, metadata)
+                    return
 
-            params = dict(
-                Bucket=self.aws_bucket,
-                Key=s3_key,
-                Body=wrapper_stream,
-                Metadata=wrapper_stream.get_s3_headers(),
-                ContentLength=len(wrapper_stream),
-                ContentType=metadata['content-type']
-            )
-            if self._is_amazon() and self.encryption:
-                params['ServerSideEncryption'] = 'AES256'
-            s3_client.put_object(**params)
+            with self.client_pool.get_client() as s3_client:
+                self.logger.debug('Uploading %s with meta: %r' % (
+                    s3_key, wrapper_stream.get_s3_headers()))
+
+                params = dict(
+                    Bucket=self.aws_bucket,
+                    Key=s3_key,
+                    Body=wrapper_stream,
+                    Metadata=wrapper_stream.get_s3_headers(),
+                    ContentLength=len(wrapper_stream),
+                    ContentType=metadata['content-type']
+                )
+                if self._is_amazon() and self.encryption:
+                    params['ServerSideEncryption'] = 'AES256'
+                s3_client.put_object(**params)
+            self._set_synced(s3_key, metadata)
+        finally:
+            wrapper_stream.close()
+
+    def _head_s3_object(self, s3_key):
+        try:
+            with self.client_pool.get_client() as s3_client:
+                return s3_client.head_object(Bucket=self.aws_bucket,
+                                             Key=s3_key)
+        except botocore.exceptions.ClientError as e:
+            resp_meta = e.response.get('ResponseMetadata', {})
+            if resp_meta.get('HTTPStatusCode', 0) == 404:
+                return None
+            raise e
+
+    @staticmethod
+    def _get_sync_record(swift_meta):
+        meta_hash = hashlib.md5(json.dumps(
+            [convert_to_s3_headers(swift_meta),
+             swift_meta.get('content-type')],
+            sort_keys=True)).hexdigest()
+        return (swift_meta.get('etag'), meta_hash)
+
+    def _is_synced(self, s3_key, swift_meta):
+        """
+        Checks whether the object was already synced with the same ETag and
+        metadata by this provider, in which case the remote object does not
+        need to be examined again.
+        """
+        record = self._synced.pop(s3_key, None)
+        if record is None and self.sync_index:
+            record = self.sync_index.get(s3_key)
+        if record is None:
+            return False
+        # Keep the entry most recently used
+        self._cache_sync_record(s3_key, tuple(record))
+        return tuple(record) == self._get_sync_record(swift_meta)
+
+    def _set_synced(self, s3_key, swift_meta):
+        record = self._get_sync_record(swift_meta)
+        if self._synced.pop(s3_key, None) != record and self.sync_index:
+            self.sync_index.set(s3_key, *record)
+        self._cache_sync_record(s3_key, record)
+
+    def _cache_sync_record(self, s3_key, record):
+        self._synced[s3_key] = record
+        while len(self._synced) > self.SYNCED_CACHE_SIZE:
+            self._synced.popitem(last=False)
+
+    def _forget_synced(self, s3_key):
+        self._synced.pop(s3_key, None)
+        if self.sync_index:
+            self.sync_index.remove(s3_key)
 
     def delete_object(self, swift_key):
         s3_key = self.get_s3_name(swift_key)
+        self._forget_synced(s3_key)
+        self._abort_stale_upload(s3_key)
         self.logger.debug('Deleting object %s' % s3_key)
         resp = self._call_boto('delete_object', Bucket=self.aws_bucket,
                                Key=s3_key)
@@ -200,6 +448,54 @@ class SyncS3(BaseSync):
 
         return resp
 
+    def delete_objects(self, swift_keys):
+        if self._google():
+            # GCS does not support the multi-object delete
+            return super(SyncS3, self).delete_objects(swift_keys)
+
+        s3_keys = map(self.get_s3_name, swift_keys)
+        # The manifests of SLOs are removed in the same requests. Deleting a
+        # key that does not exist succeeds, so there is no need to check
+        # whether the objects are SLOs.
+        delete_keys = []
+        seen = set()
+        for s3_key in s3_keys:
+            self._forget_synced(s3_key)
+            self._abort_stale_upload(s3_key)
+            for key in (s3_key, self.get_manifest_name(s3_key)):
+                if key not in seen:
+                    seen.add(key)
+                    delete_keys.append(key)
+
+        errors = {}
+        for start in range(0, len(delete_keys), self.DELETE_BATCH_SIZE):
+            batch = delete_keys[start:start + self.DELETE_BATCH_SIZE]
+            self.logger.debug('Deleting %d keys from %s' % (
+                len(batch), self.aws_bucket))
+            try:
+                with self.client_pool.get_client() as s3_client:
+                    resp = s3_client.delete_objects(
+                        Bucket=self.aws_bucket,
+                        Delete={'Objects': [{'Key': key} for key in batch],
+                                'Quiet': True})
+            except Exception as e:
+                self.logger.error('Failed to delete %d keys from %s: %r' % (
+                    len(batch), self.aws_bucket, e))
+                for key in batch:
+                    errors[key] = e
+                continue
+            for error in resp.get('Errors', []):
+                if error.get('Code') == 'NoSuchKey':
+                    continue
+                errors[error['Key']] = RuntimeError(
+                    'Failed to delete %s: %s %s' % (
+                        error['Key'], error.get('Code'),
+                        error.get('Message')))
+
+        return [errors.get(s3_key) or
+                errors.get(self.get_manifest_name(s3_key))
+                for s3_key in s3_keys]
+
     def shunt_object(self, req, swift_key):
         """Fetch an object from the remote cluster to stream back to a client.
 
@@ -248,6 +544,13 @@ class SyncS3(BaseSync):
         return self._call_boto(
             'get_object', Bucket=bucket, Key=key, **options)
 
+    def get_object_range(self, swift_key, start, end, bucket=None,
+                         if_match=None, **options):
+        options['Range'] = 'bytes=%d-%d' % (start, end)
+        if if_match:
+            options['IfMatch'] = '"%s"' % if_match
+        return self.get_object(swift_key, bucket=bucket, **options)
+
     def head_bucket(self, bucket=None, **options):
         if not bucket:
             bucket = self.aws_bucket
@@ -361,7 +664,8 @@ class SyncS3(BaseSync):
 
         if op == 'get_object':
             entry = self.client_pool.get_client()
-            resp = _perform_op(entry.client)
+            start = time.time()
+            resp = self._record_op(op, start, _perform_op(entry.client))
             if resp.success:
                 resp.body = ClosingResourceIterable(
                     entry,
@@ -373,7 +677,8 @@ class SyncS3(BaseSync):
             return resp
         else:
             with self.client_pool.get_client() as s3_client:
-                return _perform_op(s3_client)
+                start = time.time()
+                return self._record_op(op, start, _perform_op(s3_client))
 
     def list_objects(self, marker, limit, prefix, delimiter=None,
                      bucket=None):
@@ -454,12 +759,13 @@ class SyncS3(BaseSync):
                 e.message)
 
     def upload_slo(self, swift_key, storage_policy_index, s3_meta,
-                   internal_client):
+                   internal_client, manifest=None, headers=None):
         # Converts an SLO into a multipart upload. We use the segments as
-        # is, for the part sizes.
-        # NOTE: If the SLO segment is < 5MB and is not the last segment, the
-        # UploadPart call will fail. We need to stitch segments together in
-        # that case.
+        # is, for the part sizes, unless they are smaller than the minimum
+        # part size. In that case, adjacent segments are stitched together
+        # (see _get_slo_parts()) and the resulting object carries the Swift
+        # manifest ETag in its metadata, since its ETag no longer matches the
+        # SLO ETag.
         #
         # For Google Cloud Storage, we will convert the SLO into a single
         # object put, assuming the SLO is < 5TB. If the SLO is > 5TB, we have
@@ -469,13 +775,15 @@ class SyncS3(BaseSync):
             'X-Backend-Storage-Policy-Index': storage_policy_index,
             'X-Newest': True
         }
-        status, headers, body = internal_client.get_object(
-            self.account, self.container, swift_key, headers=swift_req_hdrs)
-        if status != 200:
+        if manifest is None:
+            status, headers, body = internal_client.get_object(
+                self.account, self.container, swift_key,
+                headers=swift_req_hdrs)
+            if status != 200:
+                body.close()
+                raise RuntimeError('Failed to get the manifest')
+            manifest = json.loads(''.join(body))
             body.close()
-            raise RuntimeError('Failed to get the manifest')
-        manifest = json.loads(''.join(body))
-        body.close()
         self.logger.debug("JSON manifest: %s" % str(manifest))
         s3_key = self.get_s3_name(swift_key)
 
@@ -492,21 +800,21 @@ class SyncS3(BaseSync):
             if s3_meta:
                 slo_etag = s3_meta['Metadata'].get(SLO_ETAG_FIELD, None)
                 if slo_etag == headers['etag']:
-                    if self.is_object_meta_synced(s3_meta, headers):
-                        return
-                    self.update_metadata(swift_key, headers)
+                    if not self.is_object_meta_synced(s3_meta, headers):
+                        self.update_metadata(swift_key, headers)
+                    self._set_synced(s3_key, headers)
                     return
             self._upload_google_slo(manifest, headers, s3_key, swift_req_hdrs,
                                     internal_client)
         else:
-            expected_etag = get_slo_etag(manifest)
-
-            if s3_meta and self.check_etag(expected_etag, s3_meta['ETag']):
+            if s3_meta and self._is_slo_uploaded(manifest, headers, s3_meta):
                 if self.is_object_meta_synced(s3_meta, headers):
+                    self._set_synced(s3_key, headers)
                     return
                 elif not self.in_glacier(s3_meta):
                     self.update_slo_metadata(headers, manifest, s3_key,
                                              swift_req_hdrs, internal_client)
+                    self._set_synced(s3_key, headers)
                     return
             self._upload_slo(manifest, headers, s3_key, swift_req_hdrs,
                              internal_client)
@@ -524,6 +832,7 @@ class SyncS3(BaseSync):
             if self._is_amazon() and self.encryption:
                 params['ServerSideEncryption'] = 'AES256'
             s3_client.put_object(**params)
+        self._set_synced(s3_key, headers)
 
     def _upload_google_slo(self, manifest, metadata, s3_key, req_hdrs,
                            internal_client):
@@ -538,25 +847,55 @@ class SyncS3(BaseSync):
                                  ContentLength=len(slo_wrapper),
                                  ContentType=metadata['content-type'])
 
-    def _validate_slo_manifest(self, manifest):
-        parts = len(manifest)
-        if parts > self.MAX_PARTS:
-            self.logger.error('Cannot upload a manifest with more than %d '
-                              'segments. ' % self.MAX_PARTS)
-            return False
+    def _is_slo_uploaded(self, manifest, swift_meta, s3_meta):
+        if self.check_etag(get_slo_etag(manifest), s3_meta['ETag']):
+            return True
+        # Stitched uploads cannot be verified with the SLO ETag
+        slo_etag = s3_meta['Metadata'].get(SLO_ETAG_FIELD, None)
+        return slo_etag is not None and slo_etag == swift_meta['etag']
+
+    def _get_slo_parts(self, manifest):
+        """
+        Groups the SLO segments into the parts of the multipart upload.
 
-        for index, segment in enumerate(manifest):
+        Segments are combined with the ones that follow them until the part
+        is at least MIN_PART_SIZE bytes (except for the last part). If all of
+        the segments are large enough, every segment is its own part and the
+        resulting ETag matches the SLO ETag.
+
+        Returns a list of lists of segments.
+        """
+        parts = []
+        part = []
+        part_size = 0
+        for segment in manifest:
+            part.append(segment)
+            part_size += int(segment['bytes'])
+            if part_size >= self.MIN_PART_SIZE:
+                parts.append(part)
+                part = []
+                part_size = 0
+        if part:
+            parts.append(part)
+        return parts
+
+    def _get_slo_upload_meta(self, swift_meta, parts, manifest):
+        if len(parts) == len(manifest):
+            return swift_meta
+        # Record the manifest ETag, as the ETag of stitched parts cannot be
+        # derived from the manifest
+        meta = dict(swift_meta)
+        meta[SWIFT_USER_META_PREFIX + SLO_ETAG_FIELD] = swift_meta['etag']
+        return meta
+
+    def _validate_slo_manifest(self, manifest):
+        for segment in manifest:
             if 'bytes' not in segment or 'hash' not in segment:
                 # Should never happen
                 self.logger.error('SLO segment %s must include size and etag' %
                                   segment['name'])
                 return False
             size = int(segment['bytes'])
-            if size < self.MIN_PART_SIZE and index < parts - 1:
-                self.logger.error('SLO segment %s must be greater than %d MB' %
-                                  (segment['name'],
-                                   self.MIN_PART_SIZE / self.MB))
-                return False
             if size > self.MAX_PART_SIZE:
                 self.logger.error('SLO segment %s must be smaller than %d GB' %
                                   (segment['name'],
@@ -566,6 +905,20 @@ class SyncS3(BaseSync):
                 self.logger.error('Found unsupported "range" parameter for %s '
                                   'segment ' % segment['name'])
                 return False
+
+        parts = self._get_slo_parts(manifest)
+        if len(parts) > self.MAX_PARTS:
+            self.logger.error('Cannot upload a manifest with more than %d '
+                              'parts. ' % self.MAX_PARTS)
+            return False
+        for part in parts:
+            if sum([int(segment['bytes']) for segment in part]) >\
+                    self.MAX_PART_SIZE:
+                self.logger.error(
+                    'Cannot stitch SLO segments %s to %s into a part smaller '
+                    'than %d GB' % (part[0]['name'], part[-1]['name'],
+                                    self.MAX_PART_SIZE / self.GB))
+                return False
         return True
 
     def _create_multipart_upload(self, swift_meta, s3_key):
@@ -582,8 +935,20 @@ class SyncS3(BaseSync):
 
     def _upload_slo(self, manifest, object_meta, s3_key, req_headers,
                     internal_client):
-        multipart_resp = self._create_multipart_upload(object_meta, s3_key)
-        upload_id = multipart_resp['UploadId']
+        slo_parts = self._get_slo_parts(manifest)
+        upload_meta = self._get_slo_upload_meta(object_meta, slo_parts,
+                                                manifest)
+        fingerprint = self._get_upload_fingerprint(manifest, upload_meta)
+        upload_id, part_etags = self._resume_multipart_upload(
+            s3_key, fingerprint, slo_parts)
+        if upload_id:
+            self.logger.info('Resuming the upload of %s (%d of %d parts)' % (
+                s3_key, len(part_etags), len(slo_parts)))
+        else:
+            multipart_resp = self._create_multipart_upload(upload_meta, s3_key)
+            upload_id = multipart_resp['UploadId']
+            if self.upload_status:
+                self.upload_status.start_upload(s3_key, upload_id, fingerprint)
 
         work_queue = eventlet.queue.Queue(self.SLO_QUEUE_SIZE)
         worker_pool = eventlet.greenpool.GreenPool(self.SLO_WORKERS)
@@ -591,10 +956,11 @@ class SyncS3(BaseSync):
         for _ in range(0, self.SLO_WORKERS):
             workers.append(
                 worker_pool.spawn(self._upload_part_worker, upload_id, s3_key,
-                                  req_headers, work_queue, len(manifest),
-                                  internal_client))
-        for segment_number, segment in enumerate(manifest, 1):
-            work_queue.put((segment_number, segment))
+                                  req_headers, work_queue, len(slo_parts),
+                                  internal_client, part_etags))
+        for part_number, segments in enumerate(slo_parts, 1):
+            if part_number not in part_etags:
+                work_queue.put((part_number, segments))
 
         work_queue.join()
         for _ in range(0, self.SLO_WORKERS):
@@ -604,20 +970,118 @@ class SyncS3(BaseSync):
         for thread in workers:
             errors += thread.wait()
 
-        # TODO: errors list contains the failed part numbers. We should retry
-        # those parts on failure.
         if errors:
-            self._abort_upload(s3_key, upload_id)
-            raise RuntimeError('Failed to upload an SLO as %s' % s3_key)
+            if not self.upload_status:
+                self._abort_upload(s3_key, upload_id)
+            else:
+                # The completed parts are kept for the next attempt
+                self.upload_status.flush()
+            raise RuntimeError('Failed to upload an SLO as %s (parts: %s)' % (
+                s3_key, ', '.join(map(str, sorted(errors)))))
 
-        parts = [{'PartNumber': number, 'ETag': segment['hash']}
-                 for number, segment in enumerate(manifest, 1)]
+        parts = [{'PartNumber': number, 'ETag': part_etags[number]}
+                 for number in range(1, len(slo_parts) + 1)]
         try:
             # TODO: Validate the response ETag
             self._complete_multipart_upload(s3_key, upload_id, parts)
         except:
             self._abort_upload(s3_key, upload_id)
             raise
+        finally:
+            if self.upload_status:
+                self.upload_status.remove_upload(s3_key)
+
+    @staticmethod
+    def _get_upload_fingerprint(manifest, upload_meta):
+        # Identifies the content and the metadata of an upload, so that a
+        # stale upload is never resumed
+        return hashlib.md5(json.dumps(
+            [get_slo_etag(manifest), convert_to_s3_headers(upload_meta),
+             upload_meta.get('content-type')],
+            sort_keys=True)).hexdigest()
+
+    def _resume_multipart_upload(self, s3_key, fingerprint, slo_parts):
+        """
+        Looks up a previous attempt at uploading the object and returns its
+        upload ID and the parts that were completed (as a dictionary of part
+        numbers to ETags). Only the parts that S3 reports with the ETags
+        recorded when they were uploaded are considered complete. The parts
+        that were not recorded must match the ETag of their segment or, if
+        they combine several segments, their size.
+
+        Returns (None, {}) if there is no upload to resume.
+        """
+        if not self.upload_status:
+            return None, {}
+        entry = self.upload_status.get_upload(s3_key)
+        if not entry:
+            return None, {}
+        upload_id = entry['upload_id']
+        if entry['fingerprint'] != fingerprint:
+            self._abort_stale_upload(s3_key)
+            return None, {}
+
+        try:
+            listed_parts = self._list_parts(s3_key, upload_id)
+        except botocore.exceptions.ClientError as e:
+            # Most likely, the upload was aborted or expired
+            self.logger.info('Cannot resume upload %s of %s: %s' % (
+                upload_id, s3_key, e))
+            self.upload_status.remove_upload(s3_key)
+            return None, {}
+
+        part_etags = {}
+        for part in listed_parts:
+            part_number = part['PartNumber']
+            etag = part['ETag'][1:-1]
+            recorded_etag = entry['parts'].get(str(part_number))
+            if recorded_etag is not None:
+                complete = recorded_etag == etag
+            elif 0 < part_number <= len(slo_parts):
+                segments = slo_parts[part_number - 1]
+                if len(segments) == 1:
+                    complete = segments[0]['hash'] == etag
+                else:
+                    complete = part.get('Size') == sum(
+                        int(segment['bytes']) for segment in segments)
+            else:
+                complete = False
+            if complete:
+                part_etags[part_number] = etag
+        return upload_id, part_etags
+
+    def _abort_stale_upload(self, s3_key):
+        """
+        Aborts the upload left behind by a failed attempt at uploading an
+        object that has since changed or been removed, so that its parts are
+        not kept (and billed) forever.
+        """
+        if not self.upload_status:
+            return
+        entry = self.upload_status.get_upload(s3_key)
+        if not entry:
+            return
+        upload_id = entry['upload_id']
+        self.logger.info('Aborting upload %s of %s: the object changed or '
+                         'was removed since the last attempt' % (
+                             upload_id, s3_key))
+        self.upload_status.remove_upload(s3_key)
+        try:
+            self._abort_upload(s3_key, upload_id)
+        except botocore.exceptions.ClientError as e:
+            self.logger.warning('Failed to abort upload %s of %s: %s' % (
+                upload_id, s3_key, e))
+
+    def _list_parts(self, s3_key, upload_id):
+        parts = []
+        params = dict(Bucket=self.aws_bucket, Key=s3_key, UploadId=upload_id)
+        while True:
+            with self.client_pool.get_client() as s3_client:
+                resp = s3_client.list_parts(**params)
+            parts += resp.get('Parts', [])
+            if not resp.get('IsTruncated'):
+                return parts
+            params['PartNumberMarker'] = resp['NextPartNumberMarker']
 
     def _complete_multipart_upload(self, s3_key, upload_id, parts):
         with self.client_pool.get_client() as s3_client:
@@ -646,7 +1110,7 @@ class SyncS3(BaseSync):
                 PartNumber=int(part_number))
 
     def _upload_part_worker(self, upload_id, s3_key, req_headers, queue,
-                            part_count, internal_client):
+                            part_count, internal_client, part_etags):
         errors = []
         while True:
             work = queue.get()
@@ -655,30 +1119,62 @@ class SyncS3(BaseSync):
                 return errors
 
             try:
-                part_number, segment = work
-                container, obj = segment['name'].split('/', 2)[1:]
-                self.logger.debug('Uploading part %d from %s: %s bytes' % (
-                    part_number, self.account + segment['name'],
-                    segment['bytes']))
-                wrapper = FileWrapper(internal_client, self.account,
-                                      container, obj, req_headers)
-                resp = self._upload_part(
-                    s3_key, body=wrapper, content_length=len(wrapper),
-                    upload_id=upload_id, part_number=part_number)
-                if not self.check_etag(segment['hash'], resp['ETag']):
-                    self.logger.error('Part %d ETag mismatch (%s): %s %s',
-                                      part_number,
-                                      self.account + segment['name'],
-                                      segment['hash'], resp['ETag'])
-                    errors.append(part_number)
+                part_number, segments = work
+                attempt = 0
+                while True:
+                    try:
+                        etag = self._upload_slo_part(
+                            upload_id, s3_key, req_headers, part_number,
+                            segments, internal_client)
+                        break
+                    except Exception as e:
+                        if attempt == self.SLO_PART_RETRIES:
+                            raise
+                        self.logger.warning(
+                            'Retrying part %d of %s: %s' % (
+                                part_number, s3_key, e))
+                        eventlet.sleep(self.SLO_RETRY_BACKOFF * 2 ** attempt)
+                        attempt += 1
+                part_etags[part_number] = etag
+                if self.upload_status:
+                    self.upload_status.save_part(s3_key, part_number, etag)
             except:
                 self.logger.error('Failed to upload part %d for %s: %s' % (
-                    part_number, self.account + segment['name'],
+                    part_number, self.account + segments[0]['name'],
                     traceback.format_exc()))
                 errors.append(part_number)
             finally:
                 queue.task_done()
 
+    def _upload_slo_part(self, upload_id, s3_key, req_headers, part_number,
+                         segments, internal_client):
+        segment = segments[0]
+        self.logger.debug('Uploading part %d from %s: %d bytes' % (
+            part_number, self.account + segment['name'],
+            sum([int(entry['bytes']) for entry in segments])))
+        if len(segments) == 1:
+            container, obj = segment['name'].split('/', 2)[1:]
+            wrapper = FileWrapper(internal_client, self.account,
+                                  container, obj, req_headers)
+        else:
+            wrapper = SegmentsFileWrapper(
+                internal_client, self.account, segments, req_headers)
+        try:
+            resp = self._upload_part(
+                s3_key, body=wrapper, content_length=len(wrapper),
+                upload_id=upload_id, part_number=part_number)
+        finally:
+            wrapper.close()
+        if len(segments) == 1:
+            etag = segment['hash']
+        else:
+            etag = wrapper.get_md5()
+        if not self.check_etag(etag, resp['ETag']):
+            raise RuntimeError('Part %d ETag mismatch (%s): %s %s' % (
+                part_number, self.account + segment['name'], etag,
+                resp['ETag']))
+        return etag
+
     def get_prefix(self):
         if self.use_custom_prefix:
             return self.custom_prefix
@@ -742,31 +1238,41 @@ class SyncS3(BaseSync):
                             internal_client):
         # For large objects, we should use the multipart copy, which means
         # creating a new multipart upload, with copy-parts
-        # NOTE: if we ever stich MPU objects, we need to replicate the
-        # stitching calculation to get the offset correctly.
-        multipart_resp = self._create_multipart_upload(swift_meta, s3_key)
+        slo_parts = self._get_slo_parts(manifest)
+        multipart_resp = self._create_multipart_upload(
+            self._get_slo_upload_meta(swift_meta, slo_parts, manifest),
+            s3_key)
 
-        # The original manifest must match the MPU parts to ensure that
+        # The parts must match the ones of the original upload to ensure that
         # ETags match
         offset = 0
-        for part_number, segment in enumerate(manifest, 1):
-            container, obj = segment['name'].split('/', 2)[1:]
-            segment_meta = internal_client.get_object_metadata(
-                self.account, container, obj, headers=req_headers)
-            length = int(segment_meta['content-length'])
+        parts = []
+        for part_number, segments in enumerate(slo_parts, 1):
+            length = 0
+            for segment in segments:
+                container, obj = segment['name'].split('/', 2)[1:]
+                segment_meta = internal_client.get_object_metadata(
+                    self.account, container, obj, headers=req_headers)
+                length += int(segment_meta['content-length'])
             resp = self._upload_part_copy(s3_key, self.aws_bucket, s3_key,
                                           multipart_resp['UploadId'],
                                           part_number, 'bytes=%d-%d' % (
                                               offset, offset + length - 1))
             s3_etag = resp['CopyPartResult']['ETag']
-            if not self.check_etag(segment['hash'], s3_etag):
-                raise RuntimeError('Part %d ETag mismatch (%s): %s %s' % (
-                    part_number, self.account + segment['name'],
-                    segment['hash'], resp['ETag']))
+            if len(segments) == 1:
+                segment = segments[0]
+                if not self.check_etag(segment['hash'], s3_etag):
+                    raise RuntimeError('Part %d ETag mismatch (%s): %s %s' % (
+                        part_number, self.account + segment['name'],
+                        segment['hash'], s3_etag))
+                etag = segment['hash']
+            else:
+                # Stitched parts are copied from the object itself, so their
+                # ETags are whatever S3 computed on the original upload
+                etag = s3_etag[1:-1]
+            parts.append({'PartNumber': part_number, 'ETag': etag})
             offset += length
 
-        parts = [{'PartNumber': number, 'ETag': segment['hash']}
-                 for number, segment in enumerate(manifest, 1)]
         self._complete_multipart_upload(s3_key, multipart_resp['UploadId'],
                                         parts)
 
@@ -14,13 +14,16 @@ See the License for the specific language governing permissions and
 limitations under the License.
 """
 
+from collections import OrderedDict
 import datetime
 import eventlet
+import hashlib
 import json
 import swiftclient
 from swift.common.internal_client import UnexpectedResponse
 from swift.common.utils import FileLikeIter
 import sys
+import time
 import traceback
 import urllib
 
@@ -29,11 +32,137 @@ from .utils import (FileWrapper, ClosingResourceIterable, check_slo,
                     SWIFT_USER_META_PREFIX, SWIFT_TIME_FMT)
 
 
+def get_auth_v1(conn):
+    """
+    Authenticates the swiftclient connection with the v1 auth API, as
+    Connection.get_auth() does, but also returns the number of seconds the
+    token remains valid (X-Auth-Token-Expires), or None if the auth service
+    does not report it.
+    """
+    parsed, http_conn = swiftclient.client.http_connection(
+        conn.authurl, cacert=conn.cacert, insecure=conn.insecure,
+        timeout=conn.timeout)
+    http_conn.request('GET', parsed.path, '',
+                      {'X-Auth-User': conn.user, 'X-Auth-Key': conn.key})
+    resp = http_conn.getresponse()
+    body = resp.read()
+    resp.close()
+    http_conn.close()
+    url = resp.getheader('x-storage-url')
+    if resp.status < 200 or resp.status >= 300 or (body and not url):
+        raise swiftclient.exceptions.ClientException.from_response(
+            resp, 'Auth GET failed', body)
+    token = resp.getheader('x-storage-token', resp.getheader('x-auth-token'))
+    url = conn.os_options.get('object_storage_url') or url
+    try:
+        expires_in = int(resp.getheader('x-auth-token-expires'))
+    except (TypeError, ValueError):
+        expires_in = None
+    return url, token, expires_in
+
+
+class AuthTokenCache(object):
+    """
+    Auth tokens of the remote clusters, shared by all of the swiftclient
+    connections in the process, so that each connection does not have to
+    authenticate on its own.
+
+    A token is refreshed shortly before it expires, or when a connection
+    reports it as rejected (401). Only one refresh is in flight for a set of
+    credentials at a time: other greenthreads wait for its result.
+    """
+    # Used if the auth service does not report when the tokens expire
+    # (Keystone tokens expire after an hour by default)
+    TOKEN_TTL = 3600
+    # Tokens are refreshed this many seconds before they expire (or halfway
+    # through their lifetime, if that is shorter), so that the requests in
+    # flight do not fail with an expired token
+    EXPIRY_MARGIN = 60
+
+    def __init__(self, ttl=TOKEN_TTL):
+        self.ttl = ttl
+        self._tokens = {}
+        self._locks = {}
+
+    def get_auth(self, key, auth_func, invalid_token=None):
+        """
+        Returns the (storage URL, token) tuple for the credentials identified
+        by key, calling auth_func() to authenticate if there is no valid
+        token. auth_func() returns the storage URL and token, optionally
+        followed by the number of seconds the token is valid for (None if
+        unknown). invalid_token is the token the caller found to be rejected.
+        """
+        auth = self._get_valid_auth(key, invalid_token)
+        if auth:
+            return auth
+        lock = self._locks.setdefault(key, eventlet.semaphore.Semaphore())
+        with lock:
+            # The token may have been refreshed while we waited
+            auth = self._get_valid_auth(key, invalid_token)
+            if auth:
+                return auth
+            result = auth_func()
+            url, token = result[:2]
+            expires_in = result[2] if len(result) > 2 else None
+            if expires_in is None:
+                expires_in = self.ttl
+            self._tokens[key] = (
+                url, token, time.time() + expires_in -
+                min(self.EXPIRY_MARGIN, expires_in / 2.0))
+            return url, token
+
+    def _get_valid_auth(self, key, invalid_token):
+        if key not in self._tokens:
+            return None
+        url, token, expires = self._tokens[key]
+        if token == invalid_token or time.time() >= expires:
+            return None
+        return url, token
+
+    def wrap_connection(self, conn, key):
+        """
+        Makes the swiftclient connection get its token from the cache. The
+        connection calls get_auth() when it has no token, which after the
+        first request means that its token was rejected.
+        """
+        connection_get_auth = conn.get_auth
+        used_token = [None]
+
+        def auth_func():
+            if conn.auth_version in swiftclient.client.AUTH_VERSIONS_V1:
+                # Also learn when the token expires
+                return get_auth_v1(conn)
+            return connection_get_auth()
+
+        def get_auth():
+            conn.url, conn.token = self.get_auth(
+                key, auth_func, invalid_token=used_token[0])
+            used_token[0] = conn.token
+            return conn.url, conn.token
+        conn.get_auth = get_auth
+        return conn
+
+
+AUTH_TOKEN_CACHE = AuthTokenCache()
+
+
 class SyncSwift(BaseSync):
+    # Used if the remote cluster does not advertise its bulk delete limit
+    DEFAULT_BULK_DELETE_LIMIT = 10000
+    # Number of objects for which the type of the remote object (SLO
+    # manifest or not) is remembered
+    MANIFEST_CACHE_SIZE = 10000
+
     def __init__(self, *args, **kwargs):
         super(SyncSwift, self).__init__(*args, **kwargs)
         # Used to verify the remote container in case of per_account uploads
         self.verified_container = False
+        # Number of objects per bulk delete request (0 if not supported);
+        # discovered through /info on the first batched delete
+        self.bulk_delete_limit = None
+        # Swift key -> whether the remote object is an SLO manifest, as last
+        # uploaded or seen by this provider (LRU)
+        self._manifests = OrderedDict()
 
     @property
     def remote_container(self):
@@ -60,10 +189,17 @@ class SyncSwift(BaseSync):
             os_options = {
                 'object_storage_url': '%s:%s%s' % (scheme, host, path)}
 
+        # Connections with the same credentials share their auth token
+        auth_key = (endpoint, username,
+                    hashlib.md5(key.encode('utf8')).hexdigest(),
+                    os_options.get('object_storage_url'))
+
         def swift_client_factory():
-            return swiftclient.client.Connection(
-                authurl=endpoint, user=username, key=key, retries=3,
-                os_options=os_options)
+            return AUTH_TOKEN_CACHE.wrap_connection(
+                swiftclient.client.Connection(
+                    authurl=endpoint, user=username, key=key, retries=3,
+                    os_options=os_options),
+                auth_key)
         return swift_client_factory
 
     @staticmethod
@@ -142,16 +278,19 @@ class SyncSwift(BaseSync):
                 if headers['etag'] == metadata['etag']:
                     if not self._is_meta_synced(metadata, headers):
                         self.update_metadata(swift_key, metadata)
+                    self._set_manifest(swift_key, True)
                     return
             except swiftclient.exceptions.ClientException as e:
                 if e.http_status != 404:
                     raise
             self._upload_slo(swift_key, swift_req_hdrs, internal_client)
+            self._set_manifest(swift_key, True)
             return
 
         if remote_meta and metadata['etag'] == remote_meta['etag']:
             if not self._is_meta_synced(metadata, remote_meta):
                 self.update_metadata(swift_key, metadata)
+            self._set_manifest(swift_key, check_slo(remote_meta))
             return
 
         with self.client_pool.get_client() as swift_client:
@@ -170,6 +309,13 @@ class SyncSwift(BaseSync):
                                     etag=wrapper_stream.get_headers()['etag'],
                                     headers=self._client_headers(headers),
                                     content_length=len(wrapper_stream))
+        self._set_manifest(swift_key, False)
+
+    def _set_manifest(self, swift_key, is_manifest):
+        self._manifests.pop(swift_key, None)
+        self._manifests[swift_key] = is_manifest
+        while len(self._manifests) > self.MANIFEST_CACHE_SIZE:
+            self._manifests.popitem(last=False)
 
     def delete_object(self, swift_key):
         """Delete an object from the remote cluster.
@@ -178,18 +324,26 @@ class SyncSwift(BaseSync):
         remote store may have SLO manifests, as well. Because of that, this
         turns into HEAD+DELETE.
         """
+        self._manifests.pop(swift_key, None)
+        headers = self._head_remote_object(swift_key)
+        if headers is None:
+            return
+        return self._delete_remote_object(swift_key, check_slo(headers))
+
+    def _head_remote_object(self, swift_key):
         with self.client_pool.get_client() as swift_client:
             try:
-                headers = swift_client.head_object(
+                return swift_client.head_object(
                     self.remote_container, swift_key,
                     headers=self._client_headers())
             except swiftclient.exceptions.ClientException as e:
                 if e.http_status == 404:
-                    return
+                    return None
                 raise
 
+    def _delete_remote_object(self, swift_key, is_manifest):
         delete_kwargs = {'headers': self._client_headers()}
-        if check_slo(headers):
+        if is_manifest:
             delete_kwargs['query_string'] = 'multipart-manifest=delete'
         resp = self._call_swiftclient('delete_object',
                                       self.remote_container, swift_key,
@@ -198,6 +352,110 @@ class SyncSwift(BaseSync):
             resp.reraise()
         return resp
 
+    def delete_objects(self, swift_keys):
+        """Delete several objects from the remote cluster.
+
+        The objects are removed with the bulk middleware, if the remote
+        cluster supports it, and one at a time otherwise. A bulk delete does
+        not remove the segments of SLOs: the objects this provider uploaded
+        as SLO manifests are deleted individually, along with their segments.
+        The objects it has no record of are examined first.
+        """
+        limit = self._get_bulk_delete_limit()
+        if not limit:
+            return super(SyncSwift, self).delete_objects(swift_keys)
+
+        results = [None] * len(swift_keys)
+        bulk_indexes = []
+        for index, swift_key in enumerate(swift_keys):
+            is_manifest = self._manifests.pop(swift_key, None)
+            if is_manifest is False:
+                bulk_indexes.append(index)
+                continue
+            try:
+                if is_manifest is None:
+                    headers = self._head_remote_object(swift_key)
+                    if headers is None:
+                        continue
+                    is_manifest = check_slo(headers)
+                if is_manifest:
+                    self._delete_remote_object(swift_key, True)
+                else:
+                    bulk_indexes.append(index)
+            except Exception as e:
+                results[index] = e
+
+        for start in range(0, len(bulk_indexes), limit):
+            batch = bulk_indexes[start:start + limit]
+            errors = self._bulk_delete([swift_keys[i] for i in batch])
+            for index in batch:
+                results[index] = errors.get(swift_keys[index])
+        return results
+
+    def _get_bulk_delete_limit(self):
+        if self.bulk_delete_limit is None:
+            try:
+                with self.client_pool.get_client() as swift_client:
+                    info = swift_client.get_capabilities()
+            except Exception as e:
+                # Try again with the next batch
+                self.logger.warning(
+                    'Failed to get the capabilities of %s: %r' % (
+                        self.endpoint, e))
+                return 0
+            if 'bulk_delete' in info:
+                self.bulk_delete_limit = int(
+                    info['bulk_delete'].get('max_deletes_per_request',
+                                            self.DEFAULT_BULK_DELETE_LIMIT))
+            else:
+                self.bulk_delete_limit = 0
+        return self.bulk_delete_limit
+
+    def _bulk_delete(self, swift_keys):
+        """Removes the objects with a single bulk delete request.
+
+        :returns: dictionary of the keys that could not be removed and the
+                  corresponding errors.
+        """
+        paths = {}
+        for swift_key in swift_keys:
+            path = '/%s/%s' % (self.remote_container, swift_key)
+            if isinstance(path, unicode):
+                path = path.encode('utf8')
+            paths[path] = swift_key
+        self.logger.debug('Bulk deleting %d objects from %s' % (
+            len(paths), self.remote_container))
+        try:
+            with self.client_pool.get_client() as swift_client:
+                _, body = swift_client.post_account(
+                    headers=self._client_headers(
+                        {'Accept': 'application/json',
+                         'Content-Type': 'text/plain'}),
+                    query_string='bulk-delete',
+                    data='\n'.join(urllib.quote(path) for path in paths))
+            result = json.loads(body)
+        except Exception as e:
+            self.logger.error('Bulk delete from %s failed: %r' % (
+                self.remote_container, e))
+            return dict((swift_key, e) for swift_key in swift_keys)
+
+        errors = {}
+        for path, status in result.get('Errors', []):
+            path = urllib.unquote(path.encode('utf8'))
+            if path in paths:
+                errors[paths[path]] = RuntimeError(
+                    'Failed to delete %s: %s' % (path, str(status)))
+        processed = (result.get('Number Deleted', 0) +
+                     result.get('Number Not Found', 0) +
+                     len(result.get('Errors', [])))
+        if processed < len(paths):
+            # The request was aborted: the remaining objects are retried
+            error = RuntimeError('Bulk delete failed: %s %s' % (
+                result.get('Response Status'), result.get('Response Body')))
+            for swift_key in swift_keys:
+                errors.setdefault(swift_key, error)
+        return errors
+
     def shunt_object(self, req, swift_key):
         """Fetch an object from the remote cluster to stream back to a client.
 
@@ -267,6 +525,17 @@ class SyncSwift(BaseSync):
         return self._call_swiftclient(
             'get_object', bucket, swift_key, **options)
 
+    def get_object_range(self, swift_key, start, end, bucket=None,
+                         if_match=None, **options):
+        headers = dict(options.pop('headers', {}))
+        headers['Range'] = 'bytes=%d-%d' % (start, end)
+        if if_match:
+            headers['If-Match'] = if_match
+        # Parts are streamed back through the client pool
+        options.setdefault('resp_chunk_size', 65536)
+        return self.get_object(swift_key, bucket=bucket, headers=headers,
+                               **options)
+
     def head_bucket(self, bucket=None, **options):
         if bucket is None:
             bucket = self.remote_container
@@ -341,7 +610,8 @@ class SyncSwift(BaseSync):
         # TODO: always use `response_dict` biz
         if op == 'get_object' and 'resp_chunk_size' in args:
             entry = self.client_pool.get_client()
-            resp = _perform_op(entry.client)
+            start = time.time()
+            resp = self._record_op(op, start, _perform_op(entry.client))
             if resp.success:
                 resp.body = ClosingResourceIterable(
                     entry, resp.body, resp.body.resp.close)
@@ -354,7 +624,8 @@ class SyncSwift(BaseSync):
                 response_dict = args.get('response_dict', {})
                 args['response_dict'] = response_dict
             with self.client_pool.get_client() as swift_client:
-                return _perform_op(swift_client)
+                start = time.time()
+                return self._record_op(op, start, _perform_op(swift_client))
 
     def _make_content_location(self, bucket):
         # If the identity gets in here as UTF8-encoded string (e.g. through the
@@ -18,7 +18,10 @@ import eventlet
 import hashlib
 import json
 from lxml import etree
+import os
 import StringIO
+import sys
+import tempfile
 import urllib
 
 # Old (prior to 2.11) versions of swift cannot import this, but cloud sync
@@ -161,8 +164,14 @@ class SeekableFileLikeIter(FileLikeIter):
           correct for an actual offset of zero.  Also, without a callback
           specified, any attempt to seek after any data has been read will
           result in a RuntimeError.
+
+    Partially read chunks are kept whole, along with the offset of the data
+    that has not been read yet, so that every read copies only the data that
+    it returns (and reads of whole chunks copy nothing).
     """
     def __init__(self, iterable_or_filelike, length=None, seek_zero_cb=None):
+        self._buf = None
+        self._buf_offset = 0
         try:
             super(SeekableFileLikeIter, self).__init__(iterable_or_filelike)
         except TypeError as e:
@@ -180,6 +189,18 @@ class SeekableFileLikeIter(FileLikeIter):
         self.seek_zero_cb = seek_zero_cb
         self._bytes_delivered = 0  # capped by length, if given
 
+    @property
+    def buf(self):
+        # The base class (e.g. readline()) expects the unread data in buf
+        if not self._buf_offset:
+            return self._buf
+        return self._buf[self._buf_offset:]
+
+    @buf.setter
+    def buf(self, data):
+        self._buf = data
+        self._buf_offset = 0
+
     def tell(self):
         return self._bytes_delivered
 
@@ -255,18 +276,23 @@ class SeekableFileLikeIter(FileLikeIter):
         if size < 0:
             return b''.join(self)
         elif not size:
-            chunk = b''
-        elif self.buf:
-            chunk = self.buf
-            self.buf = None
+            return b''
+        elif self._buf:
+            chunk, offset = self._buf, self._buf_offset
         else:
             try:
                 chunk = self.next(called_from_read=True)
             except StopIteration:
                 return b''
-        if len(chunk) > size:
-            self.buf = chunk[size:]
-            chunk = chunk[:size]
+            offset = 0
+        end = offset + size
+        if end < len(chunk):
+            self._buf, self._buf_offset = chunk, end
+            chunk = chunk[offset:end]
+        else:
+            self.buf = None
+            if offset:
+                chunk = chunk[offset:]
         return self._account_data_delivered(chunk)
 
     def __len__(self):
@@ -338,62 +364,67 @@ class FileWrapper(SeekableFileLikeIter):
         return super(FileWrapper, self).close()
 
 
-class SLOFileWrapper(object):
-
-    # For Google Cloud Storage, we convert SLO to a single object. We can't do
-    # that easily with InternalClient, as it does not allow query parameters.
-    # This means that if we turn on SLO in the pipeline, we will not be able to
-    # retrieve the manifest object itself. In the future, this may be converted
-    # to a resumable upload or we may resort to using compose.
-    #
-    # For the headers, we must also attach the Swift manifest ETag, as we have
-    # no way of verifying the object has been uploaded otherwise.
-    def __init__(self, swift_client, account, manifest, manifest_meta,
-                 headers={}):
+class SegmentsFileWrapper(object):
+    """
+        Presents a list of SLO segments as a single file-like object, opening
+        each segment with a FileWrapper as it is reached. The MD5 of the data
+        read so far is kept, so that callers can compute the ETag of a part
+        that is stitched together from several segments.
+    """
+    def __init__(self, swift_client, account, segments, headers={}):
         self._swift = swift_client
-        self._manifest = manifest
+        self._segments = segments
         self._account = account
         self._swift_req_headers = headers
-        self._s3_headers = convert_to_s3_headers(manifest_meta)
-        self._s3_headers[SLO_ETAG_FIELD] = manifest_meta['etag']
         self._segment = None
         self._segment_index = 0
-        self._size = sum([int(segment['bytes']) for segment in self._manifest])
+        self._size = sum([int(segment['bytes']) for segment in self._segments])
+        self._pos = 0
+        self._md5 = hashlib.md5()
 
     def seek(self, pos, flag=0):
         if pos != 0:
             raise RuntimeError('Arbitrary seeks are not supported')
-        if not self._segment:
-            return
-        self._segment.close()
-        self._segment = None
+        self._pos = 0
+        self._md5 = hashlib.md5()
         self._segment_index = 0
+        if self._segment:
+            self._segment.close()
+            self._segment = None
 
     def reset(self, *args, **kwargs):
         self.seek(0)
 
+    def tell(self):
+        return self._pos
+
     def _open_next_segment(self):
-        segment = self._manifest[self._segment_index]
+        segment = self._segments[self._segment_index]
         container, key = segment['name'].split('/', 2)[1:]
         self._segment = FileWrapper(self._swift, self._account, container,
                                     key, self._swift_req_headers)
         self._segment_index += 1
 
     def read(self, size=-1):
-        if not self._segment:
-            self._open_next_segment()
-        data = self._segment.read(size)
-        if not data:
-            self._segment.close()
-            if self._segment_index < len(self._manifest):
+        data = ''
+        while not data:
+            if not self._segment:
+                if self._segment_index == len(self._segments):
+                    return data
                 self._open_next_segment()
-                data = self._segment.read(size)
+            data = self._segment.read(size)
+            if not data:
+                self._segment.close()
+                self._segment = None
+        self._pos += len(data)
+        self._md5.update(data)
         return data
 
     def next(self):
-        data = self.read()
+        data = self.read(65536)
         if not data:
             raise StopIteration()
+        return data
 
     def __iter__(self):
         return self
@@ -401,6 +432,32 @@ class SLOFileWrapper(object):
     def __len__(self):
         return self._size
 
+    def get_md5(self):
+        return self._md5.hexdigest()
+
+    def close(self):
+        if self._segment:
+            self._segment.close()
+            self._segment = None
+
+
+class SLOFileWrapper(SegmentsFileWrapper):
+
+    # For Google Cloud Storage, we convert SLO to a single object. We can't do
+    # that easily with InternalClient, as it does not allow query parameters.
+    # This means that if we turn on SLO in the pipeline, we will not be able to
+    # retrieve the manifest object itself. In the future, this may be converted
+    # to a resumable upload or we may resort to using compose.
+    #
+    # For the headers, we must also attach the Swift manifest ETag, as we have
+    # no way of verifying the object has been uploaded otherwise.
+    def __init__(self, swift_client, account, manifest, manifest_meta,
+                 headers={}):
+        super(SLOFileWrapper, self).__init__(
+            swift_client, account, manifest, headers)
+        self._s3_headers = convert_to_s3_headers(manifest_meta)
+        self._s3_headers[SLO_ETAG_FIELD] = manifest_meta['etag']
+
     def get_s3_headers(self):
         return self._s3_headers
 
@@ -419,23 +476,33 @@ class BlobstorePutWrapper(object):
             return ''
         if size == -1 or size > self.chunk_size:
             size = self.chunk_size
-        resp = ''
+        if size < 0:
+            raise RuntimeError('Negative chunk size')
+        # The pieces are joined once at the end. When a read covers a whole
+        # queued chunk, the chunk itself is returned, without any copies.
+        pieces = []
         while size:
-            if size < 0:
-                raise RuntimeError('Negative chunk size')
             if self.chunk == '':
                 self.closed = True
                 break
             if not self.chunk or self.chunk_offset == len(self.chunk):
                 self.chunk = self.queue.get()
                 self.chunk_offset = 0
+                continue
 
-            read_sz = min(size, len(self.chunk) - self.chunk_offset)
-            new_offset = self.chunk_offset + read_sz
-            resp += self.chunk[self.chunk_offset:new_offset]
+            chunk_len = len(self.chunk)
+            if self.chunk_offset == 0 and size >= chunk_len:
+                pieces.append(self.chunk)
+                read_sz = chunk_len
+            else:
+                read_sz = min(size, chunk_len - self.chunk_offset)
+                pieces.append(self.chunk[
+                    self.chunk_offset:self.chunk_offset + read_sz])
             size -= read_sz
-            self.chunk_offset = new_offset
-        return resp
+            self.chunk_offset += read_sz
+        if len(pieces) == 1:
+            return pieces[0]
+        return ''.join(pieces)
 
     def close(self):
         self.closed = True
@@ -515,84 +582,22 @@ class SwiftSloPutWrapper(SwiftPutWrapper):
             body, headers, path, app, logger)
 
     def _create_request_path(self, target):
-        # The path is /<version>/<account>/<container>/<object>. We strip off
-        # the container and object from the path.
-        parts = self.path.split('/', 3)[:3]
-        # [1:] strips off the leading "/" that manifest names include
-        parts.append(target)
-        return '/'.join(parts)
+        return _slo_request_path(self.path, target)
 
     def _ensure_segments_container(self):
-        env = {'REQUEST_METHOD': 'PUT'}
         segment_path = self.manifest[self.segment_index]['name']
-        container_path = segment_path.split('/', 2)[1]
-        req = Request.blank(
-            # The manifest path is /<container>/<object>
-            self._create_request_path(container_path),
-            environ=env)
-        resp = req.get_response(self.app)
-        if not resp.is_success:
+        if not _put_segments_container(
+                self.app, self.path, segment_path, self.logger):
             self.failed = True
-            if self.logger:
-                self.logger.warning(
-                    'Failed to create the segment container %s: %s' % (
-                        container_path, resp.status))
-        close_if_possible(resp.app_iter)
 
     def _create_put_request(self):
         self._ensure_segments_container()
-        env = {'REQUEST_METHOD': 'PUT',
-               'wsgi.input': self.put_wrapper,
-               'CONTENT_LENGTH': self.manifest[self.segment_index]['bytes']}
-        return Request.blank(
-            self._create_request_path(
-                self.manifest[self.segment_index]['name'][1:]),
-            environ=env,
-            headers={'ETag': self.manifest[self.segment_index]['hash']})
+        return _segment_put_request(
+            self.path, self.manifest[self.segment_index], self.put_wrapper)
 
     def _upload_manifest(self):
-        SLO_FIELD_MAP = {
-            'bytes': 'size_bytes',
-            'hash': 'etag',
-            'name': 'path',
-            'range': 'range'
-        }
-
-        env = {}
-        env['REQUEST_METHOD'] = 'PUT'
-        # We have to transform the SLO fields, as Swift internally uses a
-        # different representation from what the client submits. Unfortunately,
-        # when we extract the manifest with the InternalClient, we don't have
-        # SLO in the pipeline and retrieve the internal represenation.
-        put_manifest = [
-            dict([(SLO_FIELD_MAP[k], v) for k, v in entry.items()
-                  if k in SLO_FIELD_MAP])
-            for entry in self.manifest]
-
-        content = json.dumps(put_manifest)
-        env['wsgi.input'] = StringIO.StringIO(content)
-        env['CONTENT_LENGTH'] = len(content)
-        env['QUERY_STRING'] = 'multipart-manifest=put'
-        # The SLO header must not be set on manifest PUT and we should remove
-        # the content length of the whole SLO, as we will overwrite it with the
-        # length of the manifest itself.
-        if SLO_HEADER in self.headers:
-            del self.headers[SLO_HEADER]
-        del self.headers['Content-Length']
-        etag = hashlib.md5()
-        for entry in self.manifest:
-            etag.update(entry['hash'])
-        self.headers['ETag'] = etag.hexdigest()
-        req = Request.blank(self.path, environ=env, headers=self.headers)
-        resp = req.get_response(self.app)
-        if self.logger:
-            if resp.status_int == 202:
-                self.logger.warning(
-                    'SLO %s possibly already overwritten' % self.path)
-            elif not resp.is_success:
-                self.logger.warning('Failed to create the manifest %s: %s' % (
-                    self.path, resp.status))
-        close_if_possible(resp.app_iter)
+        _put_slo_manifest(
+            self.app, self.path, self.headers, self.manifest, self.logger)
 
     def read(self, size=-1):
         chunk = self._read_chunk(size)
@@ -633,6 +638,201 @@ class SwiftSloPutWrapper(SwiftPutWrapper):
         return chunk
 
 
+def _slo_request_path(path, target):
+    # The path is /<version>/<account>/<container>/<object>. We strip off
+    # the container and object from the path.
+    parts = path.split('/', 3)[:3]
+    parts.append(target)
+    return '/'.join(parts)
+
+
+def _put_segments_container(app, path, segment_path, logger):
+    env = {'REQUEST_METHOD': 'PUT'}
+    # The manifest path is /<container>/<object>
+    container_path = segment_path.split('/', 2)[1]
+    req = Request.blank(
+        _slo_request_path(path, container_path),
+        environ=env)
+    resp = req.get_response(app)
+    if not resp.is_success and logger:
+        logger.warning(
+            'Failed to create the segment container %s: %s' % (
+                container_path, resp.status))
+    close_if_possible(resp.app_iter)
+    return resp.is_success
+
+
+def _segment_put_request(path, segment, body):
+    env = {'REQUEST_METHOD': 'PUT',
+           'wsgi.input': body,
+           'CONTENT_LENGTH': segment['bytes']}
+    # [1:] strips off the leading "/" that manifest names include
+    return Request.blank(
+        _slo_request_path(path, segment['name'][1:]),
+        environ=env,
+        headers={'ETag': segment['hash']})
+
+
+def _put_slo_manifest(app, path, headers, manifest, logger, internal=False):
+    """
+    Uploads the manifest of an SLO. Unless `internal` is set, `app` must
+    include the SLO middleware. Otherwise (e.g. with the internal client's
+    pipeline), the manifest is stored in the internal format, as is.
+    """
+    if internal:
+        return _put_internal_slo_manifest(app, path, headers, manifest, logger)
+
+    SLO_FIELD_MAP = {
+        'bytes': 'size_bytes',
+        'hash': 'etag',
+        'name': 'path',
+        'range': 'range'
+    }
+
+    env = {}
+    env['REQUEST_METHOD'] = 'PUT'
+    # We have to transform the SLO fields, as Swift internally uses a
+    # different representation from what the client submits. Unfortunately,
+    # when we extract the manifest with the InternalClient, we don't have
+    # SLO in the pipeline and retrieve the internal represenation.
+    put_manifest = [
+        dict([(SLO_FIELD_MAP[k], v) for k, v in entry.items()
+              if k in SLO_FIELD_MAP])
+        for entry in manifest]
+
+    content = json.dumps(put_manifest)
+    env['wsgi.input'] = StringIO.StringIO(content)
+    env['CONTENT_LENGTH'] = len(content)
+    env['QUERY_STRING'] = 'multipart-manifest=put'
+    # The SLO header must not be set on manifest PUT and we should remove
+    # the content length of the whole SLO, as we will overwrite it with the
+    # length of the manifest itself.
+    if SLO_HEADER in headers:
+        del headers[SLO_HEADER]
+    del headers['Content-Length']
+    etag = hashlib.md5()
+    for entry in manifest:
+        etag.update(entry['hash'])
+    headers['ETag'] = etag.hexdigest()
+    req = Request.blank(path, environ=env, headers=headers)
+    resp = req.get_response(app)
+    if logger:
+        if resp.status_int == 202:
+            logger.warning(
+                'SLO %s possibly already overwritten' % path)
+        elif not resp.is_success:
+            logger.warning('Failed to create the manifest %s: %s' % (
+                path, resp.status))
+    close_if_possible(resp.app_iter)
+    return resp.is_success
+
+
+def _put_internal_slo_manifest(app, path, headers, manifest, logger):
+    content = json.dumps(manifest)
+    headers[SLO_HEADER] = 'True'
+    headers['Content-Length'] = str(len(content))
+    # The SLO middleware is not in the pipeline: the ETag is that of the
+    # manifest JSON content, rather than the hash of the segment hashes
+    headers['ETag'] = hashlib.md5(content).hexdigest()
+    req = Request.blank(path, environ={
+        'REQUEST_METHOD': 'PUT',
+        'wsgi.input': StringIO.StringIO(content)}, headers=headers)
+    resp = req.get_response(app)
+    if not resp.is_success and logger:
+        logger.warning('Failed to create the manifest %s: %s' % (
+            path, resp.status))
+    close_if_possible(resp.app_iter)
+    return resp.is_success
+
+
+class SwiftSloRestore(object):
+    """
+        Restores an SLO into the local cluster, independently of the client
+        reading the object.
+
+        Every segment is fetched from the remote store with its own ranged GET
+        (`get_range(start, end)` returns an iterable of the segment's bytes)
+        and is uploaded by one of at most `concurrency` greenthreads. The
+        manifest is uploaded only after all of the segments are restored.
+
+        Set `internal_manifest` if `app` does not include the SLO middleware
+        (e.g. it is the internal client's pipeline).
+    """
+    def __init__(self, get_range, headers, path, app, manifest, concurrency,
+                 logger, internal_manifest=False):
+        self.internal_manifest = internal_manifest
+        self.get_range = get_range
+        self.headers = headers
+        self.path = path
+        self.app = app
+        self.manifest = manifest
+        self.concurrency = concurrency
+        self.logger = logger
+
+    @staticmethod
+    def range_getter(provider, key, etag):
+        """
+        Returns a `get_range` function that fetches the ranges of the object
+        from the provider, provided that its ETag still matches.
+        """
+        def _get_range(start, end):
+            resp = provider.get_object_range(key, start, end, if_match=etag)
+            if resp.status not in (200, 206):
+                close_if_possible(resp.body)
+                raise RemoteHTTPError(resp, 'Failed to GET %s: %d' % (
+                    key, resp.status))
+            return resp.body
+        return _get_range
+
+    def start(self):
+        return eventlet.spawn(self.run)
+
+    def _restore_segment(self, start, segment):
+        end = start + segment['bytes'] - 1
+        try:
+            body = self.get_range(start, end)
+        except Exception as e:
+            if self.logger:
+                self.logger.warning('Failed to fetch segment %s: %s' % (
+                    segment['name'], e))
+            return False
+        try:
+            resp = _segment_put_request(
+                self.path, segment, FileLikeIter(body)).get_response(self.app)
+            close_if_possible(resp.app_iter)
+        finally:
+            close_if_possible(body)
+        if not resp.is_success and self.logger:
+            self.logger.warning('Failed to restore segment %s: %s' % (
+                segment['name'], resp.status))
+        return resp.is_success
+
+    def run(self):
+        containers = {}
+        for segment in self.manifest:
+            containers.setdefault(segment['name'].split('/', 2)[1], segment)
+        for segment in containers.values():
+            if not _put_segments_container(
+                    self.app, self.path, segment['name'], self.logger):
+                return False
+
+        offsets = []
+        offset = 0
+        for segment in self.manifest:
+            offsets.append(offset)
+            offset += segment['bytes']
+        pool = eventlet.GreenPool(self.concurrency)
+        # Consume all of the results, so that the segments that can be
+        # restored are, even after a failure
+        results = list(pool.imap(
+            self._restore_segment, offsets, self.manifest))
+        if not all(results):
+            return False
+        return _put_slo_manifest(
+            self.app, self.path, self.headers, self.manifest, self.logger,
+            internal=self.internal_manifest)
+
+
 class ClosingResourceIterable(object):
     """
         Wrapper to ensure the resource is returned back to the pool after the
@@ -711,6 +911,84 @@ class ClosingResourceIterable(object):
         self.close()
 
 
+class ParallelRangeIterable(object):
+    """
+        Reassembles an object from ranged GETs that are issued concurrently.
+
+        The first part of the object is streamed from `first_body`, while up to
+        `concurrency` of the following parts are fetched in the background with
+        `get_range(start, end)`. The fetches start on the first read, so that
+        closing the iterable without reading it does not generate any
+        requests. Each part is buffered until it is consumed, which bounds the
+        memory used to roughly `concurrency * part_size` bytes.
+    """
+    def __init__(self, first_body, get_range, length, part_size, concurrency):
+        self.first_body = first_body
+        self.get_range = get_range
+        self.length = length
+        self.part_size = part_size
+        self.concurrency = concurrency
+        self.current = None
+        self.next_offset = min(part_size, length)
+        self.pending = []
+        self.closed = False
+
+    def _spawn_fetches(self):
+        while len(self.pending) < self.concurrency and\
+                self.next_offset < self.length:
+            end = min(self.next_offset + self.part_size, self.length) - 1
+            self.pending.append(
+                eventlet.spawn(self._fetch, self.next_offset, end))
+            self.next_offset = end + 1
+
+    def _fetch(self, start, end):
+        # Errors are handed to the reader, rather than the eventlet hub (which
+        # would log them on its own)
+        try:
+            return self.get_range(start, end), None
+        except Exception:
+            return None, sys.exc_info()
+
+    def next(self):
+        if self.closed:
+            raise ValueError('I/O operation on closed iterable')
+        if self.current is None:
+            self.current = iter(self.first_body)
+            self._spawn_fetches()
+        try:
+            return next(self.current)
+        except StopIteration:
+            # Only the first part is streamed; the rest are returned whole
+            self.current = iter(())
+        except Exception:
+            self.close()
+            raise
+        if not self.pending:
+            self.close()
+            raise StopIteration
+        data, exc_info = self.pending.pop(0).wait()
+        if exc_info:
+            self.close()
+            raise exc_info[0], exc_info[1], exc_info[2]
+        self._spawn_fetches()
+        return data
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        for fetch in self.pending:
+            fetch.kill()
+        self.pending = []
+        close_if_possible(self.first_body)
+
+    def __next__(self):
+        return self.next()
+
+    def __iter__(self):
+        return self
+
+
 def _propagated_hdr(hdr):
     return hdr.startswith('x-container-meta-') or hdr in PROPAGATED_HDRS
 
@@ -818,6 +1096,25 @@ def diff_account_headers(remote_headers, local_headers):
                 [(k, '') for k in missing_remote_keys])
 
 
+def dump_json_atomically(data, path):
+    """
+    Writes data as JSON to the file at path. The file is replaced in one
+    step, so a crash leaves either the old or the new contents behind,
+    rather than a truncated file.
+    """
+    fd, tmp_path = tempfile.mkstemp(
+        dir=os.path.dirname(path), prefix='.%s.' % os.path.basename(path))
+    try:
+        with os.fdopen(fd, 'w') as fh:
+            json.dump(data, fh)
+            fh.flush()
+            os.fsync(fh.fileno())
+        os.rename(tmp_path, path)
+    except Exception:
+        os.unlink(tmp_path)
+        raise
+
+
 def filter_hop_by_hop_headers(headers):
     # Take an iterable of (key, value) tuples and return a list of (key, value)
     # tuples with any hop-by-hop headers removed.
@@ -908,41 +1205,99 @@ def response_is_complete(status_code, headers):
     return end + 1 == length
 
 
-def iter_listing(list_func, logger, marker, limit, prefix, *args):
-    def _results_iterator(_resp):
+def iter_listing_pages(resp, next_page, prefetch=0):
+    """Yield the listing response and the pages that follow it.
+
+    next_page() is called with the entries of a page and returns the response
+    for the following one. The iteration stops after the first failed or empty
+    page. If prefetch is set, up to that many pages are requested on a
+    greenthread while the current one is consumed. Closing the iterator (e.g.
+    once the caller has all of the entries it needs) stops the prefetching.
+    """
+    if not prefetch:
         while True:
-            if _resp.status != 200:
-                logger.error(
-                    'Failed to list the remote store: %s' %
-                    _resp.status)
-                break
-            if not _resp.body:
-                break
-            for item in _resp.body:
-                if 'name' in item:
-                    marker = item['name']
-                else:
-                    marker = item['subdir']
-                item['content_location'] = [item['content_location']]
-                yield item, marker
-            # WSGI supplies the request parameters as UTF-8 encoded
-            # strings. We should do the same when submitting
-            # subsequent requests.
-            marker = marker.encode('utf-8')
-            _resp = list_func(marker, limit, prefix, *args)
+            yield resp
+            if resp.status != 200 or not resp.body:
+                return
+            resp = next_page(resp.body)
+
+    slots = eventlet.semaphore.Semaphore(prefetch)
+    pages = eventlet.queue.LightQueue()
+
+    def _fetch(resp):
+        try:
+            while resp.status == 200 and resp.body:
+                slots.acquire()
+                resp = next_page(resp.body)
+                pages.put((resp, None))
+        except Exception:
+            pages.put((None, sys.exc_info()))
+
+    fetcher = eventlet.spawn(_fetch, resp)
+    try:
+        while True:
+            yield resp
+            if resp.status != 200 or not resp.body:
+                return
+            resp, exc_info = pages.get()
+            slots.release()
+            if exc_info:
+                raise exc_info[0], exc_info[1], exc_info[2]
+    finally:
+        fetcher.kill()
+
+
+def _entry_key(entry):
+    return entry['name'] if 'name' in entry else entry['subdir']
+
+
+def iter_listing(list_func, logger, marker, limit, prefix, *args, **kwargs):
+    """List the remote store, starting at the marker.
+
+    Returns the first response and an iterator of (entry, key) tuples over all
+    of the pages, terminated by (None, None). The optional `prefetch` keyword
+    argument is passed on to iter_listing_pages().
+    """
+    prefetch = kwargs.pop('prefetch', 0)
+    if kwargs:
+        raise TypeError('Unexpected arguments: %s' % ', '.join(kwargs))
+
+    def _next_page(entries):
+        # WSGI supplies the request parameters as UTF-8 encoded strings. We
+        # should do the same when submitting subsequent requests.
+        next_marker = _entry_key(entries[-1]).encode('utf-8')
+        return list_func(next_marker, limit, prefix, *args)
+
+    def _results_iterator(_resp):
+        pages = iter_listing_pages(_resp, _next_page, prefetch)
+        try:
+            for _resp in pages:
+                if _resp.status != 200:
+                    logger.error(
+                        'Failed to list the remote store: %s' %
+                        _resp.status)
+                    break
+                for item in _resp.body or []:
+                    item['content_location'] = [item['content_location']]
+                    yield item, _entry_key(item)
+        finally:
+            pages.close()
         yield None, None  # just to simplify some book-keeping
 
     resp = list_func(marker, limit, prefix, *args)
     return resp, _results_iterator(resp)
 
 
-def splice_listing(local_iter, remote_iter, limit):
-    remote_item, remote_key = next(remote_iter)
-    # There used to be an unnecessary short-circuit here if remote_item is
-    # false. However, it's easier to handle "local_iter" possibly only yielding
-    # items and not tuples of (item, key) if that's only handled in one place.
+def iter_splice_listing(local_iter, remote_iter, limit):
+    """Merge the local and remote listings, yielding up to `limit` entries.
 
-    spliced_response = []
+    The remote iterator is only advanced as far as needed, so no remote pages
+    are requested once the limit is reached.
+    """
+    if limit <= 0:
+        return
+    count = 0
+    remote_item, remote_key = next(remote_iter)
     for local_item in local_iter:
         # If local_iter came from iter_listing() then it has local_key in it
         # already, otherwise it will have come from a local Swift cluster
@@ -960,22 +1315,14 @@ def splice_listing(local_iter, remote_iter, limit):
             # local_iter came from iter_listing() and it's exhausted
             break
 
-        if len(spliced_response) == limit:
-            break
-
-        if not remote_item:
-            spliced_response.append(local_item)
-            continue
-
-        while (remote_item and remote_key < local_key and
-               len(spliced_response) < limit):
-            spliced_response.append(remote_item)
+        while remote_item and remote_key < local_key:
+            yield remote_item
+            count += 1
+            if count == limit:
+                return
             remote_item, remote_key = next(remote_iter)
 
-        if len(spliced_response) == limit:
-            break
-
-        if remote_key == local_key:
+        if remote_item and remote_key == local_key:
             # duplicate!
             # XXX(darrell): this is backward for cloud-connector; the value to
             # append here will have to come from the caller--we don't have
@@ -983,65 +1330,172 @@ def splice_listing(local_iter, remote_iter, limit):
             # local_item['content_location'] or
             # local_item['content_location'][0] or something??
             remote_item['content_location'].append('swift')
-            spliced_response.append(remote_item)
+            yield remote_item
+            count += 1
+            if count == limit:
+                return
             remote_item, remote_key = next(remote_iter)
         else:
-            spliced_response.append(local_item)
+            yield local_item
+            count += 1
+            if count == limit:
+                return
 
     while remote_item:
-        if len(spliced_response) == limit:
-            break
-        spliced_response.append(remote_item)
+        yield remote_item
+        count += 1
+        if count == limit:
+            return
         remote_item, _junk = next(remote_iter)
-    return spliced_response
+
+
+def splice_listing(local_iter, remote_iter, limit):
+    return list(iter_splice_listing(local_iter, remote_iter, limit))
+
+
+def iter_json_array(chunks):
+    """Incrementally decode a JSON array (e.g. a Swift listing), yielding its
+    elements as soon as they have been read from the chunks iterable.
+    """
+    decoder = json.JSONDecoder()
+    chunks = iter(chunks)
+    buf = ''
+    pos = 0
+    started = False
+    exhausted = False
+    while True:
+        while pos < len(buf) and buf[pos] in ' \t\r\n':
+            pos += 1
+        if started and pos < len(buf) and buf[pos] == ']':
+            return
+        if started and pos < len(buf) and buf[pos] == ',':
+            pos += 1
+            continue
+        if not started and pos < len(buf):
+            if buf[pos] != '[':
+                raise ValueError('Expected a JSON array')
+            started = True
+            pos += 1
+            continue
+        if pos < len(buf):
+            try:
+                item, end = decoder.raw_decode(buf, pos)
+            except ValueError:
+                if exhausted:
+                    raise
+            else:
+                # Make sure a value is not split across chunks, e.g. a number
+                if end < len(buf) or exhausted:
+                    yield item
+                    pos = end
+                    continue
+        if exhausted:
+            raise ValueError('Truncated JSON array')
+        try:
+            buf = buf[pos:] + next(chunks)
+            pos = 0
+        except StopIteration:
+            exhausted = True
+
+
+def _xml_listing_entry(entry, entry_node, fields):
+    obj = etree.Element(entry_node)
+    for f in fields:
+        if f not in entry:
+            continue
+        el = etree.Element(f)
+        text = entry[f]
+        if type(text) == str:
+            text = text.decode('utf-8')
+        elif type(text) == int:
+            text = str(text)
+        el.text = text
+        obj.append(el)
+    return obj
+
+
+def _iter_xml_listing(
+        list_results, root_node, root_name, entry_node, fields):
+    root = etree.Element(root_node, name=root_name)
+    started = False
+    for entry in list_results:
+        if not started:
+            # Serialize the root without the entries (the declaration is
+            # replaced to match the Swift listings) and open it
+            header = etree.tostring(
+                root, encoding='UTF-8', xml_declaration=True).replace(
+                    "<?xml version='1.0' encoding='UTF-8'?>",
+                    '<?xml version="1.0" encoding="UTF-8"?>', 1)
+            yield header[:-2] + '>'
+            started = True
+        yield etree.tostring(
+            _xml_listing_entry(entry, entry_node, fields), encoding='UTF-8')
+    if started:
+        yield '</%s>' % root_node
+    else:
+        yield format_xml_listing([], root_node, root_name, entry_node, fields)
+
+
+def _iter_listing_response(list_results, list_format, root_node, root_name,
+                           entry_node, fields):
+    if list_format == 'application/json':
+        separator = '['
+        for entry in list_results:
+            yield separator + json.dumps(entry)
+            separator = ', '
+        yield '[]' if separator == '[' else ']'
+    elif list_format.endswith('/xml'):
+        for chunk in _iter_xml_listing(
+                list_results, root_node, root_name, entry_node, fields):
+            yield chunk
+    else:
+        # Default to plain format
+        separator = ''
+        for entry in list_results:
+            name = entry['name'] if 'name' in entry else entry['subdir']
+            if isinstance(name, unicode):
+                name = name.encode('utf-8')
+            yield separator + name
+            separator = '\n'
 
 
 def format_xml_listing(
         list_results, root_node, root_name, entry_node, fields):
     root = etree.Element(root_node, name=root_name)
     for entry in list_results:
-        obj = etree.Element(entry_node)
-        for f in fields:
-            if f not in entry:
-                continue
-            el = etree.Element(f)
-            text = entry[f]
-            if type(text) == str:
-                text = text.decode('utf-8')
-            elif type(text) == int:
-                text = str(text)
-            el.text = text
-            obj.append(el)
-        root.append(obj)
+        root.append(_xml_listing_entry(entry, entry_node, fields))
     resp = etree.tostring(root, encoding='UTF-8', xml_declaration=True)
     return resp.replace("<?xml version='1.0' encoding='UTF-8'?>",
                         '<?xml version="1.0" encoding="UTF-8"?>', 1)
 
 
+CONTAINER_LISTING_FIELDS = ['name', 'count', 'bytes', 'last_modified',
+                            'subdir']
+OBJECT_LISTING_FIELDS = ['name', 'content_type', 'hash', 'bytes',
+                         'last_modified', 'subdir']
+
+
+def iter_container_listing_response(list_results, list_format, account):
+    """Serialize an account listing incrementally, as it is iterated over."""
+    return _iter_listing_response(list_results, list_format, 'account',
+                                  account, 'container',
+                                  CONTAINER_LISTING_FIELDS)
+
+
+def iter_listing_response(list_results, list_format, container):
+    """Serialize a container listing incrementally, as it is iterated over."""
+    return _iter_listing_response(list_results, list_format, 'container',
+                                  container, 'object', OBJECT_LISTING_FIELDS)
+
+
 def format_container_listing_response(list_results, list_format, account):
-    if list_format == 'application/json':
-        return json.dumps(list_results)
-    if list_format.endswith('/xml'):
-        fields = ['name', 'count', 'bytes', 'last_modified', 'subdir']
-        return format_xml_listing(
-            list_results, 'account', account, 'container', fields)
-    # Default to plain format
-    return u'\n'.join(entry['name'] if 'name' in entry else entry['subdir']
-                      for entry in list_results).encode('utf-8')
+    return ''.join(iter_container_listing_response(
+        list_results, list_format, account))
 
 
 def format_listing_response(list_results, list_format, container):
-    if list_format == 'application/json':
-        return json.dumps(list_results)
-    if list_format.endswith('/xml'):
-        fields = ['name', 'content_type', 'hash', 'bytes', 'last_modified',
-                  'subdir']
-        return format_xml_listing(
-            list_results, 'container', container, 'object', fields)
-
-    # Default to plain format
-    return u'\n'.join(entry['name'] if 'name' in entry else entry['subdir']
-                      for entry in list_results).encode('utf-8')
+    return ''.join(iter_listing_response(
+        list_results, list_format, container))
 
 
 def get_list_params(req, list_limit):
@@ -0,0 +1,127 @@
+"""
+Copyright 2017 SwiftStack
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+Micro-benchmark of the upload path: measures the throughput of FileWrapper
+(a SeekableFileLikeIter over an object stream from the internal client), as
+boto reads it in put_object and upload_part. It also counts the slices (the
+string allocations) and the bytes they copy for every MB that is read.
+
+Run it from the top of the repository:
+
+    python test/perf/bench_file_wrapper.py [--size MB] [--iterations N]
+"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..'))
+
+from s3_sync.utils import FileWrapper  # noqa
+
+
+MB = 1024 * 1024
+
+
+class CountingStr(str):
+    """A string that counts the slices taken of it (and of its slices)."""
+    slices = 0
+    copied = 0
+
+    def __getslice__(self, start, end):
+        data = CountingStr(str.__getslice__(self, start, end))
+        CountingStr.slices += 1
+        CountingStr.copied += len(data)
+        return data
+
+
+class FakeInternalClient(object):
+    def __init__(self, total, chunk_size, chunk_type=str):
+        self.total = total
+        self.chunk_size = chunk_size
+        self.chunk_type = chunk_type
+
+    def _body(self):
+        sent = 0
+        while sent < self.total:
+            size = min(self.chunk_size, self.total - sent)
+            # Every chunk is a new string, as it would be off of the network
+            yield self.chunk_type('x' * size)
+            sent += size
+
+    def get_object(self, account, container, key, headers=None):
+        return (200, {'Content-Length': str(self.total)},
+                FakeBody(self._body()))
+
+
+class FakeBody(object):
+    def __init__(self, iterable):
+        self.iterable = iterable
+
+    def __iter__(self):
+        return self.iterable
+
+    def close(self):
+        pass
+
+
+def drain(wrapper, read_size):
+    start = time.time()
+    while wrapper.read(read_size):
+        pass
+    return time.time() - start
+
+
+def bench(total, chunk_size, read_size):
+    client = FakeInternalClient(total, chunk_size)
+    return drain(FileWrapper(client, 'AUTH_test', 'c', 'o'), read_size)
+
+
+def count_copies(total, chunk_size, read_size):
+    CountingStr.slices = CountingStr.copied = 0
+    client = FakeInternalClient(total, chunk_size, CountingStr)
+    drain(FileWrapper(client, 'AUTH_test', 'c', 'o'), read_size)
+    megabytes = float(total) / MB
+    return CountingStr.slices / megabytes, CountingStr.copied / megabytes
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[-3])
+    parser.add_argument('--size', type=int, default=256,
+                        help='MB to read in every run; defaults to 256')
+    parser.add_argument('--iterations', type=int, default=3,
+                        help='runs of every case (the best one is reported)')
+    args = parser.parse_args()
+    total = args.size * MB
+
+    cases = [
+        # (source chunk size, boto read size)
+        (65536, 8192),
+        (65536, 65536),
+        (1024 * 1024, 8192),
+    ]
+    print '%12s %12s %10s %14s %16s' % (
+        'chunk size', 'read size', 'MB/s', 'slices/MB', 'bytes copied/MB')
+    for chunk_size, read_size in cases:
+        elapsed = min(bench(total, chunk_size, read_size)
+                      for _ in range(args.iterations))
+        slices, copied = count_copies(total, chunk_size, read_size)
+        print '%12d %12d %10.1f %14.1f %16.0f' % (
+            chunk_size, read_size, args.size / elapsed, slices, copied)
+
+
+if __name__ == '__main__':
+    main()
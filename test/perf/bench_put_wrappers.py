@@ -0,0 +1,121 @@
+"""
+Copyright 2017 SwiftStack
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+Micro-benchmark of the restore path of the shunt: measures the throughput
+(MB/s) of SwiftPutWrapper and SwiftSloPutWrapper. The restore PUTs are sent
+to a WSGI app that drains them the way the proxy server does, so the results
+reflect the CPU cost of the wrappers alone.
+
+Run it from the top of the repository:
+
+    python test/perf/bench_put_wrappers.py [--size MB] [--iterations N]
+"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..'))
+
+from s3_sync.utils import (  # noqa
+    SLO_HEADER, SwiftPutWrapper, SwiftSloPutWrapper)
+
+
+MB = 1024 * 1024
+
+
+class DrainingApp(object):
+    def __init__(self, read_size):
+        self.read_size = read_size
+
+    def __call__(self, env, start_response):
+        body = env['wsgi.input']
+        while body.read(self.read_size):
+            pass
+        start_response('201 Created', [])
+        return ['']
+
+
+def source(total, chunk_size):
+    chunk = 'x' * chunk_size
+    sent = 0
+    while sent < total:
+        size = min(chunk_size, total - sent)
+        yield chunk if size == chunk_size else chunk[:size]
+        sent += size
+
+
+def drain(wrapper):
+    start = time.time()
+    for _ in wrapper:
+        pass
+    return time.time() - start
+
+
+def bench_put(total, chunk_size, read_size):
+    wrapper = SwiftPutWrapper(
+        source(total, chunk_size), {'Content-Length': str(total)},
+        '/v1/AUTH_test/c/o', DrainingApp(read_size), None)
+    return drain(wrapper)
+
+
+def bench_slo_put(total, chunk_size, read_size, segment_size):
+    manifest = []
+    offset = 0
+    while offset < total:
+        size = min(segment_size, total - offset)
+        manifest.append({'name': '/segments/%d' % len(manifest),
+                         'hash': 'etag', 'bytes': size})
+        offset += size
+    wrapper = SwiftSloPutWrapper(
+        source(total, chunk_size),
+        {'Content-Length': str(total), SLO_HEADER: 'True'},
+        '/v1/AUTH_test/c/o', DrainingApp(read_size), manifest, None)
+    return drain(wrapper)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[-3])
+    parser.add_argument('--size', type=int, default=256,
+                        help='MB to restore in every run; defaults to 256')
+    parser.add_argument('--iterations', type=int, default=3,
+                        help='runs of every case (the best one is reported)')
+    args = parser.parse_args()
+    total = args.size * MB
+
+    cases = [
+        # (source chunk size, proxy read size)
+        (65536, 65536),
+        (8192, 65536),
+        (65536, 8192),
+        (1000, 65536),
+    ]
+    print '%-20s %12s %12s %10s' % ('wrapper', 'chunk size', 'read size',
+                                    'MB/s')
+    for chunk_size, read_size in cases:
+        for name, bench in (
+                ('SwiftPutWrapper',
+                 lambda: bench_put(total, chunk_size, read_size)),
+                ('SwiftSloPutWrapper',
+                 lambda: bench_slo_put(
+                     total, chunk_size, read_size, 16 * MB))):
+            elapsed = min(bench() for _ in range(args.iterations))
+            print '%-20s %12d %12d %10.1f' % (
+                name, chunk_size, read_size, args.size / elapsed)
+
+
+if __name__ == '__main__':
+    main()
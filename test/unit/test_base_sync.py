@@ -14,6 +14,7 @@ See the License for the specific language governing permissions and
 limitations under the License.
 """
 
+import eventlet
 import mock
 from s3_sync import base_sync
 from swift.common import swob
@@ -103,3 +104,175 @@ class TestBaseSync(unittest.TestCase):
                 "{'Content-Length': '88', 'Foo': 'bar'}",
                 ("A" * 70) + '...'),
             cm.exception.message)
+
+    @mock.patch('s3_sync.base_sync.BaseSync._get_client_factory')
+    def test_delete_objects(self, factory_mock):
+        factory_mock.return_value = mock.Mock()
+        base = base_sync.BaseSync(self.settings, max_conns=1)
+        error = RuntimeError('failed')
+        base.delete_object = mock.Mock(side_effect=[None, error, None])
+
+        self.assertEqual([None, error, None],
+                         base.delete_objects(['foo', 'bar', 'baz']))
+        base.delete_object.assert_has_calls(
+            [mock.call('foo'), mock.call('bar'), mock.call('baz')])
+
+    @mock.patch('s3_sync.base_sync.BaseSync._get_client_factory')
+    def test_http_pool_shared_clients(self, factory_mock):
+        factory_mock.return_value = mock.Mock(side_effect=lambda: mock.Mock())
+
+        class SharedSync(base_sync.BaseSync):
+            HTTP_CONN_POOL_SIZE = 2
+
+        base = SharedSync(self.settings, max_conns=3)
+        self.assertEqual(2, base.client_pool.pool_size)
+        entries = [base.client_pool.get_client() for _ in range(3)]
+        self.assertIs(entries[0], entries[1])
+        self.assertIsNot(entries[0], entries[2])
+        self.assertEqual(2, len(base.client_pool.client_pool))
+        self.assertEqual(0, base.client_pool.free_count())
+        self.assertEqual({'hits': 1, 'creations': 2, 'closes': 0,
+                          'waits': 0, 'wait_time': 0.0,
+                          'wait_histogram': [3, 0, 0, 0, 0, 0],
+                          'timeouts': 0, 'ops': {}}, base.client_pool.stats)
+
+        for entry in entries:
+            entry.close()
+        self.assertEqual(3, base.client_pool.free_count())
+        with self.assertRaises(RuntimeError):
+            entries[2].close()
+
+        # A small number of connections limits the connections per client
+        base = SharedSync(self.settings, max_conns=1)
+        self.assertEqual(1, base.conns_per_client)
+        self.assertEqual(1, base.client_pool.pool_size)
+
+    @mock.patch('s3_sync.base_sync.BaseSync._get_client_factory')
+    def test_http_pool_wait_stats(self, factory_mock):
+        factory_mock.return_value = mock.Mock()
+        base = base_sync.BaseSync(self.settings, max_conns=1)
+        entry = base.client_pool.get_client()
+
+        def _release():
+            eventlet.sleep(0.01)
+            entry.close()
+        eventlet.spawn(_release)
+        with base.client_pool.get_client():
+            pass
+
+        self.assertEqual(1, base.client_pool.stats['waits'])
+        self.assertGreater(base.client_pool.stats['wait_time'], 0)
+        self.assertEqual(1, base.client_pool.stats['hits'])
+        self.assertEqual(1, base.client_pool.stats['creations'])
+        self.assertEqual(2, sum(base.client_pool.stats['wait_histogram']))
+        self.assertEqual(1, base.client_pool.stats['wait_histogram'][0])
+
+    @mock.patch('s3_sync.base_sync.BaseSync._get_client_factory')
+    def test_http_pool_acquire_timeout(self, factory_mock):
+        factory_mock.return_value = mock.Mock()
+        settings = dict(self.settings, pool_acquire_timeout='0.01')
+        logger = mock.Mock()
+        base = base_sync.BaseSync(settings, max_conns=1, logger=logger)
+        self.assertEqual(0.01, base.client_pool.acquire_timeout)
+        entry = base.client_pool.get_client()
+        self.assertEqual(1, base.client_pool.in_use_count())
+
+        with self.assertRaises(base_sync.ClientPoolTimeout):
+            base.client_pool.get_client()
+        self.assertEqual(1, base.client_pool.stats['timeouts'])
+        self.assertEqual(1, base.client_pool.stats['waits'])
+        logger.increment.assert_has_calls([
+            mock.call('client_pool.creations'),
+            mock.call('client_pool.timeouts')])
+
+        entry.close()
+        self.assertEqual(0, base.client_pool.in_use_count())
+        with base.client_pool.get_client():
+            pass
+
+    @mock.patch('s3_sync.base_sync.BaseSync._get_client_factory')
+    def test_http_pool_ops_and_closes(self, factory_mock):
+        factory_mock.return_value = mock.Mock()
+        logger = mock.Mock()
+        base = base_sync.BaseSync(self.settings, max_conns=2, logger=logger)
+        base._close_conn = mock.Mock()
+        with mock.patch('s3_sync.base_sync.time.time', return_value=12.5):
+            resp = base._record_op(
+                'head_object', 10, base_sync.ProviderResponse(
+                    True, 200, {}, ''))
+            base._record_op('head_object', 12, base_sync.ProviderResponse(
+                False, 404, {}, ''))
+        self.assertTrue(resp.success)
+        self.assertEqual(
+            {'head_object': {'count': 2, 'errors': 1, 'time': 3.0}},
+            base.client_pool.stats['ops'])
+        logger.timing.assert_has_calls([
+            mock.call('ops.head_object.timing', 2500.0),
+            mock.call('ops.head_object.timing', 500.0)])
+        logger.increment.assert_called_once_with('ops.head_object.errors')
+
+        with base.client_pool.get_client():
+            pass
+        with base.client_pool.get_client():
+            pass
+        logger.increment.assert_called_with('client_pool.hits')
+        base.close()
+        self.assertEqual(1, base.client_pool.stats['closes'])
+        logger.increment.assert_called_with('client_pool.closes')
+        # Closing the clients does not return connections to the pool
+        self.assertEqual(0, base.client_pool.in_use_count())
+        self.assertEqual(2, base.client_pool.free_count())
+        base.close()
+        self.assertEqual(0, base.client_pool.in_use_count())
+
+    @mock.patch('s3_sync.base_sync.BaseSync._get_client_factory')
+    def test_http_pool_client_factory_error(self, factory_mock):
+        factory_mock.return_value.side_effect = [RuntimeError('failed'),
+                                                 mock.Mock()]
+        base = base_sync.BaseSync(self.settings, max_conns=1)
+        with self.assertRaises(RuntimeError):
+            base.client_pool.get_client()
+        self.assertEqual(0, base.client_pool.in_use_count())
+        self.assertEqual([], base.client_pool.client_pool)
+
+        with base.client_pool.get_client():
+            self.assertEqual(1, base.client_pool.in_use_count())
+        self.assertEqual(0, base.client_pool.in_use_count())
+
+    @mock.patch('s3_sync.base_sync.BaseSync._get_client_factory')
+    def test_format_pool_metrics(self, factory_mock):
+        factory_mock.return_value = mock.Mock()
+        base = base_sync.BaseSync(self.settings, max_conns=2)
+        entry = base.client_pool.get_client()
+        base.client_pool.record_op('get_object', 0.5, False)
+
+        metrics = base_sync.format_pool_metrics([base]).splitlines()
+        labels = 'provider="BaseSync",endpoint="s3:/",bucket="bucket"'
+        for line in [
+                '# TYPE cloud_sync_client_pool_size gauge',
+                'cloud_sync_client_pool_size{%s} 2' % labels,
+                'cloud_sync_client_pool_in_use{%s} 1' % labels,
+                'cloud_sync_client_pool_free{%s} 1' % labels,
+                'cloud_sync_client_pool_clients_created_total{%s} 1' % labels,
+                'cloud_sync_client_pool_clients_closed_total{%s} 0' % labels,
+                'cloud_sync_client_pool_client_reuses_total{%s} 0' % labels,
+                '# TYPE cloud_sync_client_pool_acquire_wait_seconds '
+                'histogram',
+                'cloud_sync_client_pool_acquire_wait_seconds_bucket'
+                '{%s,le="0.001"} 1' % labels,
+                'cloud_sync_client_pool_acquire_wait_seconds_bucket'
+                '{%s,le="+Inf"} 1' % labels,
+                'cloud_sync_client_pool_acquire_wait_seconds_count{%s} 1' %
+                labels,
+                '# TYPE cloud_sync_request_duration_seconds summary',
+                'cloud_sync_request_duration_seconds_sum'
+                '{%s,op="get_object"} 0.5' % labels,
+                'cloud_sync_request_duration_seconds_count'
+                '{%s,op="get_object"} 1' % labels,
+                'cloud_sync_request_errors_total{%s,op="get_object"} 1' %
+                labels]:
+            self.assertIn(line, metrics)
+        self.assertEqual(1, len([
+            line for line in metrics if line.startswith(
+                '# TYPE cloud_sync_client_pool_acquire_wait_seconds')]))
+        entry.close()
@@ -109,7 +109,7 @@ class TestCloudConnectorApp(TestCloudConnectorBase):
             'secret_key': u'\u062akey val',
         }
 
-        patcher = mock.patch('s3_sync.cloud_connector.app.create_provider')
+        patcher = mock.patch('s3_sync.provider_factory.create_provider')
         self.mock_create_provider = patcher.start()
         self.addCleanup(patcher.stop)
 
@@ -279,9 +279,10 @@ class TestCloudConnectorApp(TestCloudConnectorBase):
         exp_profile['container'] = 'jojo'
         self.assertEqual(exp_profile, controller.local_to_me_profile)
         self.assertEqual([
-            mock.call(controller.local_to_me_profile, max_conns=1,
-                      per_account=True, logger=self.app.logger),
-            mock.call(controller.remote_to_me_profile, max_conns=1,
+            mock.call(controller.local_to_me_profile, 10,
+                      per_account=True, logger=self.app.logger,
+                      extra_headers=None),
+            mock.call(controller.remote_to_me_profile, 10,
                       per_account=False, logger=self.app.logger,
                       extra_headers={'x-cloud-sync-shunt-bypass': 'true'}),
         ], self.mock_create_provider.mock_calls)
@@ -297,6 +298,36 @@ class TestCloudConnectorApp(TestCloudConnectorBase):
                  if 'secret' not in k}),
         ], self.mock_logger.mock_calls)
 
+    def test_controller_providers_reused(self):
+        controller, _ = self.controller_for(u'AUTH_b\u062a', 'jojo', 'oo',
+                                            'GET')
+        other_controller, _ = self.controller_for(u'AUTH_b\u062a', 'jojo',
+                                                  'other', 'PUT')
+        self.assertEqual(2, self.mock_create_provider.call_count)
+        self.assertIs(controller.local_to_me_provider,
+                      other_controller.local_to_me_provider)
+        self.assertIs(controller.remote_to_me_provider,
+                      other_controller.remote_to_me_provider)
+
+        # A different S3 identity gets its own remote-to-me provider
+        self.s3_identity = {
+            'access_key': u'other key id',
+            'secret_key': u'other key val',
+        }
+        self.mock_create_provider.side_effect = None
+        self.mock_create_provider.return_value = mock.Mock()
+        third_controller, _ = self.controller_for(u'AUTH_b\u062a', 'jojo',
+                                                  'oo', 'GET')
+        self.assertEqual(3, self.mock_create_provider.call_count)
+        self.assertIs(controller.local_to_me_provider,
+                      third_controller.local_to_me_provider)
+        self.assertIsNot(controller.remote_to_me_provider,
+                         third_controller.remote_to_me_provider)
+
+        # Reloading the sync config drops the cached providers
+        self.app.load_sync_config(json.dumps(self.sync_conf))
+        self.assertEqual(0, len(self.app.provider_cache))
+
     def test_container_head_in_local(self):
         controller, req = self.controller_for(u'AUTH_b\u062a', 'jojo',
                                               verb='HEAD')
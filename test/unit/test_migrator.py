@@ -123,6 +123,17 @@ class TestMigratorUtils(unittest.TestCase):
               'status': {'moved': 100,
                          'scanned': 200}},
              True),
+            # Tuning settings do not change the identity of a migration
+            ({'account': 'swift5',
+              'aws_bucket': 'bucket',
+              'aws_identity': 'aws access key'},
+             {'account': 'swift5',
+              'aws_bucket': 'bucket',
+              'aws_identity': 'aws access key',
+              'download_concurrency': 4,
+              'listing_prefetch': 2,
+              'pool_acquire_timeout': 5},
+             True),
         ]
         failures = []
         for left, right, expected in test_cases:
@@ -566,6 +577,26 @@ class TestMigratorUtils(unittest.TestCase):
         with open(self.status_file_path) as rf:
             self.assertEqual(1, len(json.load(rf)))
 
+    def test_status_save_ranges(self):
+        config = {'aws_bucket': 'bucket', 'aws_identity': 'id',
+                  'account': 'AUTH_test', 'listing_ranges': 2}
+        ranges = {'config': 2, 'ranges': [
+            {'start': '', 'end': 'm', 'marker': 'c'},
+            {'start': 'm', 'end': None, 'marker': 'x'}]}
+        self.setup_status_file_path()
+        status = s3_sync.migrator.Status(self.status_file_path)
+        status.load_status_list()
+        status.save_migration(config, '', 2, 2, ranges=ranges)
+        status.load_status_list()
+        self.assertEqual(ranges, status.get_migration(config)['ranges'])
+
+        # Changing the number of ranges does not reset the migration
+        self.assertEqual(ranges, status.get_migration(
+            dict(config, listing_ranges=4))['ranges'])
+
+        status.save_migration(config, 'marker', 1, 1)
+        self.assertNotIn('ranges', status.get_migration(config))
+
     @mock.patch('s3_sync.migrator.json.load')
     def test_load_corrupt_json(self, mock_json_load):
         mock_json_load.side_effect = ValueError(
@@ -758,6 +789,274 @@ class TestMigrator(unittest.TestCase):
             [mock.call(None, 10000, None),
              mock.call(buckets[0]['name'], 10000, None)])
 
+    def test_iter_source_container_prefetch(self):
+        config = dict(self.migrator.config, listing_prefetch='2')
+        self.migrator = s3_sync.migrator.Migrator(
+            config, mock.Mock(), 1000, 5, self.migrator.ic_pool, self.logger,
+            0, 1)
+        self.assertEqual(2, self.migrator.listing_prefetch)
+        self.migrator.provider = mock.Mock()
+        self.migrator.provider.list_objects.side_effect = [
+            ProviderResponse(True, 200, {}, [{'name': 'a'}, {'name': 'b'}]),
+            ProviderResponse(True, 200, {}, [{'name': 'c'}]),
+            ProviderResponse(True, 200, {}, [])]
+
+        self.assertEqual(
+            [{'name': 'a'}, {'name': 'b'}, {'name': 'c'}, None],
+            list(self.migrator._iter_source_container(
+                'bucket', '', 'pre', True)))
+        self.migrator.provider.list_objects.assert_has_calls([
+            mock.call('', 1000, 'pre', bucket='bucket'),
+            mock.call('b', 1000, 'pre', bucket='bucket'),
+            mock.call('c', 1000, 'pre', bucket='bucket')])
+
+        # Errors on the prefetched pages are raised as they are reached
+        self.migrator.provider.list_objects.side_effect = [
+            ProviderResponse(True, 200, {}, [{'name': 'a'}]),
+            ProviderResponse(False, 500, {}, 'Server Error')]
+        source_iter = self.migrator._iter_source_container(
+            'bucket', '', '', True)
+        self.assertEqual({'name': 'a'}, next(source_iter))
+        with self.assertRaises(s3_sync.migrator.MigrationError):
+            next(source_iter)
+
+    def _fake_listing(self, names, calls=None):
+        names = sorted(names)
+
+        def list_objects(marker, limit, prefix, delimiter=None, bucket=None):
+            if calls is not None:
+                calls.append((marker, limit, prefix))
+            return ProviderResponse(True, 200, {}, [
+                {'name': name, 'hash': 'etag',
+                 'last_modified': create_list_timestamp(1.5e9)}
+                for name in names
+                if name > marker and name.startswith(prefix)][:limit])
+        return list_objects
+
+    def test_get_listing_ranges(self):
+        self.migrator.provider = mock.Mock()
+        calls = []
+        self.migrator.provider.list_objects.side_effect = self._fake_listing(
+            ['a/1', 'a/2', 'b', 'c/1', 'd'], calls)
+        self.migrator.listing_ranges = 2
+        self.assertEqual([
+            {'start': '', 'end': 'c/1', 'marker': ''},
+            {'start': 'c/1', 'end': None, 'marker': 'c/1'},
+        ], self.migrator._get_listing_ranges('bucket', {}))
+        self.assertEqual([('', 1000, '')], calls)
+
+        # Fewer keys than ranges
+        self.migrator.listing_ranges = 8
+        self.assertEqual(
+            ['a/2', 'b', 'c/1', 'd', None],
+            [r['end'] for r in
+             self.migrator._get_listing_ranges('bucket', {})])
+
+        # Saved ranges are reused if the configuration has not changed
+        saved = {'config': 8, 'ranges': [
+            {'start': '', 'end': 'c/', 'marker': 'a'},
+            {'start': 'c/', 'end': None, 'marker': 'd/e'}]}
+        self.assertIs(saved['ranges'], self.migrator._get_listing_ranges(
+            'bucket', saved))
+
+        # Explicit boundaries
+        self.migrator.provider.reset_mock()
+        self.migrator.listing_ranges = ['m', 'f']
+        self.assertEqual([
+            {'start': '', 'end': 'f', 'marker': ''},
+            {'start': 'f', 'end': 'm', 'marker': 'f'},
+            {'start': 'm', 'end': None, 'marker': 'm'},
+        ], self.migrator._get_listing_ranges('bucket', saved))
+        self.assertEqual([], self.migrator.provider.mock_calls)
+
+        # Empty container
+        self.migrator.provider.list_objects.side_effect = self._fake_listing(
+            [])
+        self.migrator.listing_ranges = 2
+        self.assertEqual([{'start': '', 'end': None, 'marker': ''}],
+                         self.migrator._get_listing_ranges('bucket', {}))
+
+        self.migrator.provider.list_objects.side_effect = None
+        self.migrator.provider.list_objects.return_value = ProviderResponse(
+            False, 404, {}, '')
+        with self.assertRaises(s3_sync.migrator.ContainerNotFound):
+            self.migrator._get_listing_ranges('bucket', {})
+
+    def test_get_listing_ranges_flat(self):
+        # A flat key space, much larger than a page, with most of the keys at
+        # the end of it
+        names = ['%04d' % i for i in range(0, 1000, 10)] + \
+            ['9%05d' % i for i in range(50000)]
+        self.migrator.provider = mock.Mock()
+        calls = []
+        self.migrator.provider.list_objects.side_effect = self._fake_listing(
+            names, calls)
+        self.migrator.work_chunk = 100
+        self.migrator.listing_ranges = 4
+        ranges = self.migrator._get_listing_ranges('bucket', {})
+        # The boundaries are spread across the whole key space, not only the
+        # first page of the listing
+        self.assertEqual(['912000', '925000', '938000', None],
+                         [r['end'] for r in ranges])
+        # Far fewer requests than listing all of the keys
+        self.assertLess(len(calls), len(names) / 100 / 2)
+        for start, end in zip([''] + [r['end'] for r in ranges[:-1]],
+                              [r['end'] for r in ranges]):
+            count = len([name for name in names
+                         if name > start and (end is None or name <= end)])
+            self.assertLess(abs(count - len(names) / 4), len(names) / 8)
+
+    @mock.patch('s3_sync.migrator.create_provider')
+    def test_listing_ranges_pass(self, create_provider_mock):
+        config = dict(self.migrator.config, listing_ranges=['a'])
+        self.migrator = s3_sync.migrator.Migrator(
+            config, mock.Mock(), 2, 5, self.migrator.ic_pool, self.logger,
+            0, 1)
+        self.migrator._migrate_object = mock.Mock()
+        self.swift_client.make_request.return_value = mock.Mock(
+            status_int=200, body='[]')
+        calls = []
+        create_provider_mock.return_value.list_objects.side_effect = \
+            self._fake_listing(['a', 'b/1', 'b/2', 'b/3', 'c'], calls)
+        self.migrator.status.get_migration.return_value = {}
+        self.migrator.next_pass()
+
+        def _check_pass(markers, migrated, ranges, is_reset):
+            self.assertEqual(markers, sorted(c[0] for c in calls))
+            self.assertEqual(
+                migrated, sorted(c[0][2] for c in
+                                 self.migrator._migrate_object.call_args_list))
+            ranges = {'config': ['a'], 'ranges': ranges}
+            self.migrator.status.save_migration.assert_called_once_with(
+                self.migrator.config, '', len(migrated), len(migrated),
+                is_reset, ranges=ranges)
+            calls[:] = []
+            self.migrator._migrate_object.reset_mock()
+            self.migrator.status.reset_mock()
+            self.migrator.status.get_migration.return_value = {
+                'ranges': ranges}
+
+        # Both ranges are scanned in the same pass, each up to the work chunk
+        _check_pass(['', 'a'], ['a', 'b/1', 'b/2'], [
+            {'start': '', 'end': 'a', 'marker': 'a'},
+            {'start': 'a', 'end': None, 'marker': 'b/2'}], False)
+
+        # The range that is done waits for the other one
+        self.migrator.next_pass()
+        _check_pass(['a', 'b/2'], ['b/3', 'c'], [
+            {'start': '', 'end': 'a', 'marker': 'a', 'done': True},
+            {'start': 'a', 'end': None, 'marker': 'c'}], False)
+
+        # Once all of the ranges are done, they all start over
+        self.migrator.next_pass()
+        _check_pass(['', 'a', 'c'], ['a', 'b/1', 'b/2'], [
+            {'start': '', 'end': 'a', 'marker': 'a'},
+            {'start': 'a', 'end': None, 'marker': 'b/2'}], True)
+
+    def test_owns_container(self):
+        names = [u'container-%d' % i for i in range(100)] + [u'\u062a']
+        migrators = [
+            s3_sync.migrator.Migrator(
+                self.migrator.config, None, 1000, 5, self.migrator.ic_pool,
+                self.logger, node_id, 3)
+            for node_id in range(3)]
+        for name in names:
+            self.assertEqual(1, len(
+                [m for m in migrators if m._owns_container(name)]))
+        # The containers are spread across the processes
+        for migrator in migrators:
+            self.assertGreater(
+                len(filter(migrator._owns_container, names)), 10)
+        # A single process owns all of the containers
+        self.assertTrue(all(map(self.migrator._owns_container, names)))
+
+    @mock.patch('s3_sync.migrator.create_provider')
+    def test_reconcile_containers_owner(self, create_provider_mock):
+        create_provider_mock.return_value.list_buckets.return_value = \
+            ProviderResponse(True, 200, [], [])
+        names = ['container-%d' % i for i in range(20)]
+        deleted = []
+        for node_id in range(2):
+            migrator = s3_sync.migrator.Migrator(
+                {'aws_bucket': '/*', 'account': 'AUTH_test'}, mock.Mock(),
+                1000, 5, self.migrator.ic_pool, self.logger, node_id, 2)
+            migrator._iterate_internal_listing = mock.Mock(
+                return_value=iter([{'name': name} for name in names] +
+                                  [None]))
+            migrator._maybe_delete_internal_container = mock.Mock()
+            self.assertEqual([], migrator.next_pass())
+            node_deleted = [
+                c[0][0] for c in
+                migrator._maybe_delete_internal_container.call_args_list]
+            # Only the owner of a container removes it
+            self.assertTrue(0 < len(node_deleted) < len(names))
+            self.assertTrue(all(map(migrator._owns_container, node_deleted)))
+            deleted += node_deleted
+        self.assertEqual(sorted(names), sorted(deleted))
+
+    @mock.patch('s3_sync.migrator.Migrator._update_container_headers')
+    @mock.patch('s3_sync.migrator.create_provider')
+    def test_shard_keys(self, create_provider_mock, update_headers_mock):
+        names = ['obj-%02d' % i for i in range(20)]
+        calls = []
+        create_provider_mock.return_value.list_objects.side_effect = \
+            self._fake_listing(names, calls)
+        self.swift_client.make_request.return_value = mock.Mock(
+            status_int=200, body='[]')
+        self.swift_client.container_exists.return_value = True
+        metadata = {}
+        self.swift_client.get_container_metadata.side_effect = \
+            lambda *args: dict(metadata)
+        update_headers_mock.side_effect = \
+            lambda container, ic, headers: metadata.update(headers)
+        config = dict(self.migrator.config, shard_keys=True,
+                      listing_ranges=4)
+        migrators = [
+            s3_sync.migrator.Migrator(
+                config, mock.Mock(), 1000, 5, self.migrator.ic_pool,
+                self.logger, node_id, 2)
+            for node_id in range(2)]
+        owner = [m for m in migrators if m._owns_container('bucket')][0]
+        other = [m for m in migrators if m is not owner][0]
+        for migrator in migrators:
+            migrator.status.get_migration.return_value = {}
+            migrator._migrate_object = mock.Mock()
+
+        # The other process waits for the owner to pick the ranges
+        other.next_pass()
+        self.assertEqual([], calls)
+        self.assertEqual([], other._migrate_object.mock_calls)
+        other.status.save_migration.assert_called_once_with(
+            other.config, '', 0, 0, False, ranges=None)
+        other.status.reset_mock()
+
+        migrated = []
+        for index, migrator in enumerate([owner, other]):
+            migrator.next_pass()
+            keys = [c[0][2] for c in migrator._migrate_object.call_args_list]
+            self.assertTrue(0 < len(keys) < len(names))
+            migrated += keys
+            # Each process scans (and counts) only its own ranges
+            ranges = migrator.status.save_migration.call_args[1]['ranges']
+            self.assertEqual(4, ranges['config'])
+            self.assertEqual(4, len(ranges['ranges']))
+            migrator.status.save_migration.assert_called_once_with(
+                migrator.config, '', len(keys), len(keys), False,
+                ranges=ranges)
+            if index == 0:
+                boundaries = [r['end'] for r in ranges['ranges'][:-1]]
+                self.assertEqual(
+                    {s3_sync.migrator.RANGES_HEADER: json.dumps(
+                        {'config': 4, 'boundaries': boundaries})},
+                    metadata)
+            else:
+                # The boundaries are the ones of the owner
+                self.assertEqual(
+                    boundaries, [r['end'] for r in ranges['ranges'][:-1]])
+        self.assertEqual(sorted(names), sorted(migrated))
+        update_headers_mock.assert_called_once_with(
+            'bucket', self.swift_client, metadata)
+
     @mock.patch('s3_sync.migrator.create_provider')
     def test_list_buckets_error(self, create_provider_mock):
         create_provider_mock.return_value.list_buckets.return_value = \
@@ -1767,6 +2066,40 @@ class TestMigrator(unittest.TestCase):
             {internal_header: '1500000000.00000',
              'x-timestamp': '1500000000.00000'})
 
+    @mock.patch('s3_sync.migrator.create_provider')
+    def test_parallel_download(self, create_provider_mock):
+        config = dict(self.migrator.config, download_concurrency=4,
+                      download_part_size=1024)
+        self.migrator = s3_sync.migrator.Migrator(
+            config, mock.Mock(), 1000, 5, self.migrator.ic_pool, self.logger,
+            0, 1)
+        provider_mock = create_provider_mock.return_value
+        provider_mock.list_objects.side_effect = [
+            ProviderResponse(True, 200, {}, [{'name': 'qux'}]),
+            ProviderResponse(True, 200, {}, [])]
+        provider_mock.get_object_parallel.return_value = ProviderResponse(
+            True, 200, {'last-modified': create_timestamp(1.5e9)}, [])
+        swift_404_resp = mock.Mock()
+        swift_404_resp.status_int = 404
+        self.migrator.status.get_migration.return_value = {}
+
+        self.swift_client.make_request.side_effect = [
+            mock.Mock(status_int=200, body='[]'),
+            mock.Mock(status_int=200, body='[]')]
+        self.swift_client.get_object_metadata.side_effect = UnexpectedResponse(
+            '', swift_404_resp)
+
+        self.migrator.next_pass()
+
+        # Every worker may hold a connection for the first part of an object
+        # and for each of the parts fetched in the background
+        create_provider_mock.assert_called_once_with(
+            mock.ANY, self.migrator.ic_pool.max_size * 5, False)
+        provider_mock.get_object_parallel.assert_called_once_with(
+            'qux', 1024, 4, bucket='bucket')
+        provider_mock.get_object.assert_not_called()
+        self.assertEqual(1, self.swift_client.upload_object.call_count)
+
 
 class TestStatus(unittest.TestCase):
 
@@ -2063,6 +2396,19 @@ class TestMain(unittest.TestCase):
                 config['migrations'], mock_status.return_value, mock.ANY,
                 mock.ANY, 42, 1337, 0, 15, 60, True)
 
+    def test_process_migrations_shard_keys(self):
+        migrations = [{'aws_bucket': 'bucket1', 'aws_identity': 'id'},
+                      {'aws_bucket': 'bucket2', 'aws_identity': 'id',
+                       'shard_keys': True}]
+        status = mock.Mock()
+        with self.patch('Migrator') as mock_migrator:
+            mock_migrator.return_value.next_pass.return_value = []
+            s3_sync.migrator.process_migrations(
+                migrations, status, None, self.logger, 1000, 5, 1, 2)
+        # The sharded migration is processed by every process
+        mock_migrator.assert_called_once_with(
+            migrations[1], status, 1000, 5, None, self.logger, 1, 2)
+
     @mock.patch('s3_sync.migrator.create_provider')
     def test_migrate_all_containers_error(self, create_provider_mock):
         provider_mock = mock.Mock()
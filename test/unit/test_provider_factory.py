@@ -0,0 +1,110 @@
+"""
+Copyright 2018 SwiftStack
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import mock
+import unittest
+
+from s3_sync import provider_factory
+from s3_sync.sync_s3 import SyncS3
+from s3_sync.sync_swift import SyncSwift
+
+
+class TestProviderCache(unittest.TestCase):
+    def setUp(self):
+        self.profile = {
+            'account': 'AUTH_a',
+            'container': 'c',
+            'aws_bucket': 'bucket',
+            'aws_identity': 'id',
+            'aws_secret': 'secret',
+        }
+
+    def test_get_provider(self):
+        cache = provider_factory.ProviderCache(max_size=2, max_conns=5)
+        provider = cache.get_provider(self.profile)
+        self.assertIsInstance(provider, SyncS3)
+        # A single S3 client serves all of the connections
+        self.assertEqual(1, provider.client_pool.pool_size)
+        self.assertEqual(5, provider.client_pool.conns_per_client)
+        self.assertIs(provider, cache.get_provider(dict(self.profile)))
+        self.assertIsNot(provider, cache.get_provider(self.profile,
+                                                      per_account=True))
+        self.assertIsNot(provider, cache.get_provider(
+            self.profile, extra_headers={'x-foo': 'bar'}))
+
+        swift_profile = dict(self.profile, protocol='swift',
+                             aws_endpoint='http://swift/auth/v1.0')
+        self.assertIsInstance(cache.get_provider(swift_profile), SyncSwift)
+
+    @mock.patch('s3_sync.provider_factory.create_provider')
+    def test_lru_eviction(self, create_mock):
+        create_mock.side_effect = lambda *args, **kwargs: mock.Mock()
+        cache = provider_factory.ProviderCache(max_size=2)
+        profiles = [dict(self.profile, container='c%d' % i)
+                    for i in range(3)]
+
+        first = cache.get_provider(profiles[0])
+        cache.get_provider(profiles[1])
+        # Touch the first one, so that the second one is evicted next
+        self.assertIs(first, cache.get_provider(profiles[0]))
+        cache.get_provider(profiles[2])
+        self.assertEqual(2, len(cache))
+        self.assertEqual(3, create_mock.call_count)
+
+        self.assertIs(first, cache.get_provider(profiles[0]))
+        self.assertEqual(3, create_mock.call_count)
+        cache.get_provider(profiles[1])
+        self.assertEqual(4, create_mock.call_count)
+
+    @mock.patch('s3_sync.provider_factory.create_provider')
+    def test_clear(self, create_mock):
+        create_mock.side_effect = lambda *args, **kwargs: mock.Mock()
+        cache = provider_factory.ProviderCache()
+        provider = cache.get_provider(self.profile)
+        cache.clear()
+        self.assertEqual(0, len(cache))
+        self.assertIsNot(provider, cache.get_provider(self.profile))
+
+    @mock.patch('s3_sync.provider_factory.create_provider')
+    def test_providers(self, create_mock):
+        create_mock.side_effect = lambda *args, **kwargs: mock.Mock()
+        cache = provider_factory.ProviderCache()
+        self.assertEqual([], cache.providers())
+        first = cache.get_provider(self.profile)
+        second = cache.get_provider(dict(self.profile, aws_bucket='other'))
+        self.assertEqual([first, second], cache.providers())
+
+    @mock.patch('s3_sync.provider_factory.time')
+    @mock.patch('s3_sync.provider_factory.create_provider')
+    def test_idle_ttl(self, create_mock, time_mock):
+        create_mock.side_effect = lambda *args, **kwargs: mock.Mock()
+        cache = provider_factory.ProviderCache(ttl=60)
+        other_profile = dict(self.profile, container='other')
+
+        time_mock.time.return_value = 1000
+        provider = cache.get_provider(self.profile)
+        other = cache.get_provider(other_profile)
+        time_mock.time.return_value = 1050
+        self.assertIs(provider, cache.get_provider(self.profile))
+        # Using the provider resets its idle time
+        time_mock.time.return_value = 1100
+        self.assertIs(provider, cache.get_provider(self.profile))
+        self.assertEqual(1, len(cache))
+        self.assertIsNot(other, cache.get_provider(other_profile))
+
+        time_mock.time.return_value = 1161
+        self.assertIsNot(provider, cache.get_provider(self.profile))
+        self.assertEqual(1, len(cache))
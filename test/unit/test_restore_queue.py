@@ -0,0 +1,94 @@
+"""
+Copyright 2017 SwiftStack
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import errno
+import mock
+import os
+import shutil
+import tempfile
+import unittest
+
+from s3_sync.restore_queue import RestoreJob, RestoreQueue
+
+
+class TestRestoreQueue(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.location = os.path.join(self.tempdir, 'restore', 'queue.db')
+        self.queue = RestoreQueue(self.location)
+
+    def tearDown(self):
+        self.queue.close()
+        shutil.rmtree(self.tempdir)
+
+    def test_put_dedupes(self):
+        self.assertTrue(self.queue.put('AUTH_a', 'c', 'o'))
+        self.assertFalse(self.queue.put('AUTH_a', 'c', 'o'))
+        self.assertTrue(self.queue.put('AUTH_a', 'c', 'o2'))
+        self.assertTrue(self.queue.put('AUTH_a', 'c2', 'o'))
+        self.assertEqual(3, len(self.queue))
+        self.assertTrue(os.path.exists(self.location))
+        self.assertEqual(('wal',), self.queue._open().execute(
+            'PRAGMA journal_mode').fetchone())
+
+    def test_directory_race(self):
+        # Another process creates the directory first
+        location = os.path.join(self.tempdir, 'other', 'queue.db')
+        queue = RestoreQueue(location)
+        real_mkdir = os.mkdir
+
+        def mkdir(path):
+            real_mkdir(path)
+            raise OSError(errno.EEXIST, 'File exists')
+
+        with mock.patch('s3_sync.restore_queue.os.mkdir', side_effect=mkdir):
+            self.assertTrue(queue.put('AUTH_a', 'c', 'o'))
+        queue.close()
+
+        # Other errors are raised (the parent directory does not exist)
+        queue = RestoreQueue(os.path.join(self.location, 'queue.db'))
+        with self.assertRaises(OSError):
+            queue.put('AUTH_a', 'c', 'o')
+
+    def test_durable(self):
+        self.queue.put('AUTH_a', 'c', 'unicod\xc3\xa9')
+        self.queue.close()
+        queue = RestoreQueue(self.location)
+        self.assertEqual([RestoreJob('AUTH_a', 'c', 'unicod\xc3\xa9', 0)],
+                         queue.get(10))
+        queue.close()
+
+    def test_get_remove(self):
+        for obj in ('a', 'b', 'c'):
+            self.queue.put('AUTH_a', 'c', obj)
+        jobs = self.queue.get(2)
+        self.assertEqual(2, len(jobs))
+        # The jobs stay in the queue until they are removed
+        self.assertEqual(3, len(self.queue))
+        for job in jobs:
+            self.queue.remove(job)
+        self.assertEqual(['c'], [job.obj for job in self.queue.get(10)])
+
+    def test_retry(self):
+        self.queue.put('AUTH_a', 'c', 'o')
+        job = self.queue.get(1)[0]
+        self.queue.retry(job, 60, now=1000)
+        self.assertEqual([], self.queue.get(10, now=1059))
+        self.assertEqual([RestoreJob('AUTH_a', 'c', 'o', 1)],
+                         self.queue.get(10, now=1060))
+        # Queueing the object again does not reset the retry
+        self.assertFalse(self.queue.put('AUTH_a', 'c', 'o'))
+        self.assertEqual([], self.queue.get(10, now=1059))
@@ -0,0 +1,214 @@
+"""
+Copyright 2017 SwiftStack
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import hashlib
+import json
+import mock
+import os
+import shutil
+import tempfile
+import unittest
+
+from s3_sync.base_sync import ProviderResponse
+from s3_sync import restorer
+from s3_sync.restore_queue import RestoreQueue
+from s3_sync.shunt import load_sync_profiles
+from s3_sync.utils import SLO_HEADER
+
+
+class FakeLocalSwift(object):
+    def __init__(self):
+        self.objects = {}
+        self.headers = {}
+        self.calls = []
+
+    def __call__(self, env, start_response):
+        method = env['REQUEST_METHOD']
+        path = env['PATH_INFO']
+        self.calls.append((method, path))
+        if method == 'PUT':
+            # Like the proxy server without the SLO middleware (the internal
+            # client's pipeline)
+            if 'multipart-manifest' in env.get('QUERY_STRING', ''):
+                start_response('400 Bad Request', [])
+                return ['']
+            body = env['wsgi.input'].read()
+            if 'HTTP_ETAG' in env and \
+                    env['HTTP_ETAG'] != hashlib.md5(body).hexdigest():
+                start_response('422 Unprocessable Entity', [])
+                return ['']
+            self.objects[path] = body
+            self.headers[path] = dict(
+                (key[5:], value) for key, value in env.items()
+                if key.startswith('HTTP_'))
+            start_response('201 Created', [])
+        elif path in self.objects:
+            start_response('200 OK', [])
+        else:
+            start_response('404 Not Found', [])
+        return ['']
+
+
+class TestRestorer(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.queue = RestoreQueue(os.path.join(self.tempdir, 'queue.db'))
+        self.sync_profiles = load_sync_profiles({
+            'containers': [{
+                'account': 'AUTH_a',
+                'container': 'c',
+                'aws_bucket': 'bucket',
+                'aws_identity': 'id',
+                'aws_secret': 'secret',
+                'merge_namespaces': True,
+                'restore_object': True}]})
+        self.app = FakeLocalSwift()
+        self.logger = mock.Mock()
+        self.restorer = restorer.Restorer(
+            self.queue, self.sync_profiles, self.app, self.logger,
+            workers=2, max_attempts=2)
+        self.provider = mock.Mock()
+        self.provider.head_object.return_value = ProviderResponse(
+            True, 200, {'Content-Length': '4', 'etag': 'etag'}, [''])
+        self.restorer.provider_cache = mock.Mock()
+        self.restorer.provider_cache.get_provider.return_value = \
+            self.provider
+
+    def tearDown(self):
+        self.queue.close()
+        shutil.rmtree(self.tempdir)
+
+    def test_restore_object(self):
+        self.provider.get_object.return_value = ProviderResponse(
+            True, 200, {'Content-Length': '4',
+                        'etag': hashlib.md5('data').hexdigest()},
+            iter(['da', 'ta']))
+        self.queue.put('AUTH_a', 'c', 'unicod\xc3\xa9')
+        self.assertEqual(1, self.restorer.run_once())
+        self.provider.head_object.assert_called_once_with(u'unicod\xe9')
+        self.provider.get_object.assert_called_once_with(u'unicod\xe9')
+        self.assertEqual({'/v1/AUTH_a/c/unicod\xc3\xa9': 'data'},
+                         self.app.objects)
+        self.assertEqual(0, len(self.queue))
+
+    def test_already_restored(self):
+        self.app.objects['/v1/AUTH_a/c/o'] = 'data'
+        self.queue.put('AUTH_a', 'c', 'o')
+        self.restorer.run_once()
+        self.assertEqual([('HEAD', '/v1/AUTH_a/c/o')], self.app.calls)
+        self.assertEqual([], self.provider.mock_calls)
+        self.assertEqual(0, len(self.queue))
+
+    def test_no_profile(self):
+        self.queue.put('AUTH_a', 'other', 'o')
+        self.restorer.run_once()
+        self.assertEqual([], self.app.calls)
+        self.assertEqual(0, len(self.queue))
+
+    def test_removed_from_remote(self):
+        self.provider.head_object.return_value = ProviderResponse(
+            False, 404, {}, [''])
+        self.queue.put('AUTH_a', 'c', 'o')
+        self.restorer.run_once()
+        self.assertEqual({}, self.app.objects)
+        self.assertEqual(0, len(self.queue))
+        self.provider.get_object.assert_not_called()
+
+    def test_retry(self):
+        self.provider.head_object.return_value = ProviderResponse(
+            False, 503, {}, [''])
+        self.queue.put('AUTH_a', 'c', 'o')
+        with mock.patch('time.time', return_value=1000):
+            self.restorer.run_once()
+        self.assertEqual([], self.queue.get(10, now=1059))
+        self.assertEqual(1, self.queue.get(10, now=1060)[0].attempts)
+
+        # The restore is dropped after max_attempts
+        with mock.patch('time.time', return_value=1060):
+            self.restorer.run_once()
+        self.assertEqual(0, len(self.queue))
+        self.logger.error.assert_called_once_with(
+            'Giving up on restoring AUTH_a/c/o after 2 attempts')
+
+    def test_error(self):
+        self.provider.get_object.side_effect = RuntimeError('oops')
+        self.queue.put('AUTH_a', 'c', 'o')
+        self.restorer.run_once()
+        self.assertEqual(1, self.queue.get(10, now=2 ** 32)[0].attempts)
+        self.logger.exception.assert_called_once_with(
+            'Failed to restore AUTH_a/c/o')
+
+    def test_restore_slo(self):
+        data = 'a' * 10 + 'b' * 5
+        manifest = [
+            {'name': '/c_segments/part1',
+             'hash': hashlib.md5(data[:10]).hexdigest(), 'bytes': 10},
+            {'name': '/c_segments/part2',
+             'hash': hashlib.md5(data[10:]).hexdigest(), 'bytes': 5}]
+        self.provider.head_object.return_value = ProviderResponse(
+            True, 200, {'Content-Length': '15', SLO_HEADER: 'True',
+                        'etag': '"slo-etag"'}, [''])
+        self.provider.get_manifest.return_value = manifest
+        self.provider.get_object_range.side_effect = \
+            lambda key, start, end, **kwargs: ProviderResponse(
+                True, 206, {}, iter([data[start:end + 1]]))
+        self.queue.put('AUTH_a', 'c', 'slo')
+        self.restorer.run_once()
+
+        # The object is never fetched whole
+        self.provider.get_object.assert_not_called()
+        self.assertEqual(
+            [mock.call(u'slo', 0, 9, if_match='"slo-etag"'),
+             mock.call(u'slo', 10, 14, if_match='"slo-etag"')],
+            self.provider.get_object_range.mock_calls)
+        self.assertEqual(data[:10],
+                         self.app.objects['/v1/AUTH_a/c_segments/part1'])
+        self.assertEqual(data[10:],
+                         self.app.objects['/v1/AUTH_a/c_segments/part2'])
+        # The manifest is stored in the internal format, as an SLO
+        stored = self.app.objects['/v1/AUTH_a/c/slo']
+        self.assertEqual(manifest, json.loads(stored))
+        headers = self.app.headers['/v1/AUTH_a/c/slo']
+        self.assertEqual('True', headers['X_STATIC_LARGE_OBJECT'])
+        self.assertEqual(hashlib.md5(stored).hexdigest(), headers['ETAG'])
+        self.assertEqual(0, len(self.queue))
+
+    def test_replaced_by_slo(self):
+        body = mock.Mock()
+        self.provider.get_object.return_value = ProviderResponse(
+            True, 200, {'Content-Length': '15', SLO_HEADER: 'True',
+                        'etag': '"slo-etag"'}, body)
+        self.queue.put('AUTH_a', 'c', 'o')
+        self.restorer.run_once()
+        body.close.assert_called_once_with()
+        self.assertEqual({}, self.app.objects)
+        self.assertEqual(1, self.queue.get(10, now=2 ** 32)[0].attempts)
+
+    @mock.patch('s3_sync.restorer.ratelimit_sleep')
+    def test_rate_limit(self, mock_sleep):
+        mock_sleep.return_value = 0
+        self.app.objects['/v1/AUTH_a/c/o1'] = 'data'
+        self.app.objects['/v1/AUTH_a/c/o2'] = 'data'
+        self.queue.put('AUTH_a', 'c', 'o1')
+        self.queue.put('AUTH_a', 'c', 'o2')
+        self.restorer.run_once()
+        self.assertEqual([], mock_sleep.mock_calls)
+
+        self.restorer.max_rate = 5
+        self.queue.put('AUTH_a', 'c', 'o1')
+        self.queue.put('AUTH_a', 'c', 'o2')
+        self.restorer.run_once()
+        self.assertEqual([mock.call(0, 5)] * 2, mock_sleep.mock_calls)
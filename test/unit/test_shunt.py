@@ -17,6 +17,9 @@ limitations under the License.
 import json
 import lxml
 import mock
+import os
+import shutil
+import sqlite3
 import StringIO
 import tempfile
 import unittest
@@ -54,6 +57,27 @@ class FakeSwift(object):
         return body
 
 
+class FakeMemcache(object):
+    def __init__(self):
+        self.store = {}
+
+    def get(self, key):
+        if key not in self.store:
+            return None
+        return json.loads(self.store[key])
+
+    def set(self, key, value, time=0):
+        self.store[key] = json.dumps(value)
+
+    def incr(self, key, delta=1, time=0):
+        value = self.get(key) or 0
+        self.store[key] = json.dumps(value + delta)
+        return value + delta
+
+    def keys(self, prefix):
+        return [key for key in self.store if key.startswith(prefix)]
+
+
 class TestShunt(unittest.TestCase):
     def setUp(self):
         self.patchers = [mock.patch(name) for name in (
@@ -464,6 +488,57 @@ class TestShunt(unittest.TestCase):
         _test_shunted('/v1/AUTH_b/c1/o', True)
         _test_shunted('/v1/AUTH_b/c2/o', True)
 
+    def test_object_negative_cache(self):
+        with tempfile.NamedTemporaryFile() as fp:
+            json.dump(self.conf, fp)
+            fp.flush()
+            app = shunt.filter_factory({
+                'conf_file': fp.name,
+                'negative_cache_ttl': '10'})(self.swift)
+        memcache = FakeMemcache()
+        path = u'/v1/AUTH_a/sw\u00e9ft/o'
+
+        def _request(method='GET', status='404 Not Found'):
+            req = swob.Request.blank(path, method=method, environ={
+                '__test__.status': status,
+                'swift.trans_id': 'local trans id',
+                'swift.cache': memcache})
+            status, headers, body_iter = req.call_application(app)
+            body = ''.join(body_iter)
+            utils.close_if_possible(body_iter)
+            return status, body
+
+        self.mock_shunt_swift.return_value = (
+            '404 Not Found', [], ['remote 404'])
+        self.assertEqual('404 Not Found', _request()[0])
+        self.assertEqual(1, self.mock_shunt_swift.call_count)
+
+        # Further lookups are answered from the cache
+        self.assertEqual('404 Not Found', _request()[0])
+        self.assertEqual('404 Not Found', _request('HEAD')[0])
+        self.assertEqual(1, self.mock_shunt_swift.call_count)
+
+        # A PUT through the shunt invalidates the cached 404
+        self.assertEqual('201 Created', _request('PUT', '201 Created')[0])
+        self.mock_shunt_swift.side_effect = lambda *args: (
+            '200 OK', [('Content-Length', '12')], iter(['remote swift']))
+        self.assertEqual(('200 OK', 'remote swift'), _request())
+        self.assertEqual(('200 OK', 'remote swift'), _request())
+        self.assertEqual(3, self.mock_shunt_swift.call_count)
+
+    def test_object_negative_cache_disabled(self):
+        memcache = FakeMemcache()
+        self.mock_shunt_swift.return_value = (
+            '404 Not Found', [], ['remote 404'])
+        for _ in range(2):
+            req = swob.Request.blank(u'/v1/AUTH_a/sw\u00e9ft/o', environ={
+                '__test__.status': '404 Not Found',
+                'swift.cache': memcache})
+            status, _, _ = req.call_application(self.app)
+            self.assertEqual('404 Not Found', status)
+        self.assertEqual(2, self.mock_shunt_swift.call_count)
+        self.assertEqual([], memcache.keys('cloud_sync/'))
+
     @mock.patch.object(sync_swift.SyncSwift, 'get_manifest')
     @mock.patch.object(sync_s3.SyncS3, 'get_manifest')
     @mock.patch.object(sync_swift.SyncSwift, 'shunt_object')
@@ -554,9 +629,153 @@ class TestShunt(unittest.TestCase):
                         ('PUT', '/v1/%s/foo' % path),
                     ])
             self.assertEqual(payload, resp_body)
+            # The manifest is only requested for SLOs
+            self.assertEqual(
+                1 if is_slo else 0,
+                mock_s3_get_manifest.call_count +
+                mock_swift_get_manifest.call_count)
             mock_call.reset_mock()
+            mock_s3_get_manifest.reset_mock()
+            mock_swift_get_manifest.reset_mock()
             self.swift.calls = []
 
+    @mock.patch.object(sync_swift.SyncSwift, 'get_object_range')
+    @mock.patch.object(sync_swift.SyncSwift, 'get_manifest')
+    def test_background_slo_restore(self, mock_get_manifest, mock_get_range):
+        with tempfile.NamedTemporaryFile() as fp:
+            json.dump(self.conf, fp)
+            fp.flush()
+            app = shunt.filter_factory({
+                'conf_file': fp.name,
+                'slo_restore_concurrency': '2'})(self.swift)
+        payload = 'a' * 10 + 'b' * 5
+        mock_get_manifest.return_value = [
+            {'name': '/segments/part1', 'hash': 'etag1', 'bytes': 10},
+            {'name': '/segments/part2', 'hash': 'etag2', 'bytes': 5}]
+        mock_get_range.side_effect = lambda key, start, end, **kw: \
+            ProviderResponse(True, 206, {}, iter([payload[start:end + 1]]))
+        self.mock_shunt_swift.return_value = (
+            '200 OK', [('Content-Length', len(payload)),
+                       (utils.SLO_HEADER, 'True'),
+                       ('etag', '"slo-etag"')], iter([payload]))
+
+        req = swob.Request.blank(u'/v1/AUTH_a/sw\u00e9ft/slo', environ={
+            '__test__.response_dict': {'GET': {'status': '404 Not Found'}}})
+        path = u'/v1/AUTH_a/sw\u00e9ft/slo'.encode('utf-8')
+        status, headers, body_iter = req.call_application(app)
+        self.assertEqual('200 OK', status)
+        # The client's stream is not wrapped
+        self.assertEqual(payload, ''.join(body_iter))
+        self.assertEqual([path], app.shunted_app._slo_restores.keys())
+        self.assertTrue(app.shunted_app._slo_restores[path].wait())
+        self.assertEqual({}, app.shunted_app._slo_restores)
+        # The restore has its own provider
+        self.assertEqual(1, len(app.shunted_app.restore_provider_cache))
+        self.assertEqual(
+            sorted([mock.call(u'slo', 0, 9, if_match='"slo-etag"'),
+                    mock.call(u'slo', 10, 14, if_match='"slo-etag"')]),
+            sorted(mock_get_range.mock_calls))
+        self.assertEqual(
+            [('HEAD', '/v1/AUTH_a'),
+             ('GET', path),
+             ('PUT', '/v1/AUTH_a/segments'),
+             ('PUT', '/v1/AUTH_a/segments/part1'),
+             ('PUT', '/v1/AUTH_a/segments/part2'),
+             ('PUT', path)],
+            [(e['REQUEST_METHOD'], e['PATH_INFO']) for e in self.swift.calls])
+        self.assertEqual('multipart-manifest=put',
+                         self.swift.calls[-1]['QUERY_STRING'])
+
+    @mock.patch.object(sync_swift.SyncSwift, 'get_manifest')
+    def test_background_slo_restore_limits(self, mock_get_manifest):
+        with tempfile.NamedTemporaryFile() as fp:
+            json.dump(self.conf, fp)
+            fp.flush()
+            app = shunt.filter_factory({
+                'conf_file': fp.name,
+                'slo_restore_concurrency': '2',
+                'slo_restore_max': '1'})(self.swift)
+        payload = 'a' * 15
+        mock_get_manifest.return_value = [
+            {'name': '/segments/part1', 'hash': 'etag1', 'bytes': 15}]
+        self.mock_shunt_swift.side_effect = lambda *args: (
+            '200 OK', [('Content-Length', len(payload)),
+                       (utils.SLO_HEADER, 'True'),
+                       ('etag', '"slo-etag"')], iter([payload]))
+
+        container_path = '/v1/AUTH_a/sw\xc3\xa9ft/'
+
+        def _get(obj):
+            req = swob.Request.blank(container_path + obj, environ={
+                '__test__.response_dict': {
+                    'GET': {'status': '404 Not Found'}}})
+            status, headers, body_iter = req.call_application(app)
+            self.assertEqual('200 OK', status)
+            return body_iter
+
+        with mock.patch.object(shunt.SwiftSloRestore, 'start') as mock_start:
+            self.assertEqual([payload], list(_get('slo')))
+            # A restore in progress is not started again
+            self.assertEqual([payload], list(_get('slo')))
+            self.assertEqual(1, mock_start.call_count)
+            # Past the limit, the SLO is restored from the client's stream
+            self.assertIsInstance(_get('slo2'), utils.SwiftSloPutWrapper)
+            self.assertEqual(1, mock_start.call_count)
+            self.assertEqual([container_path + 'slo'],
+                             app.shunted_app._slo_restores.keys())
+
+    @mock.patch.object(sync_swift.SyncSwift, 'get_manifest')
+    def test_queue_restore(self, mock_get_manifest):
+        tempdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tempdir)
+        with tempfile.NamedTemporaryFile() as fp:
+            json.dump(self.conf, fp)
+            fp.flush()
+            app = shunt.filter_factory({
+                'conf_file': fp.name,
+                'restore_queue': os.path.join(tempdir, 'queue.db')})(
+                    self.swift)
+        queue = app.shunted_app.restore_queue
+        payload = 'a' * 15
+        mock_get_manifest.return_value = None
+        self.mock_shunt_swift.side_effect = lambda *args: (
+            '200 OK', [('Content-Length', len(payload)),
+                       (utils.SLO_HEADER, 'True'),
+                       ('etag', '"slo-etag"')], iter([payload]))
+
+        for _ in range(2):
+            req = swob.Request.blank(u'/v1/AUTH_a/sw\u00e9ft/slo', environ={
+                '__test__.response_dict': {
+                    'GET': {'status': '404 Not Found'}}})
+            status, headers, body_iter = req.call_application(app)
+            self.assertEqual('200 OK', status)
+            self.assertEqual(payload, ''.join(body_iter))
+        # The restore is left to the restorer daemon
+        self.assertEqual([], mock_get_manifest.mock_calls)
+        self.assertNotIn('PUT',
+                         [e['REQUEST_METHOD'] for e in self.swift.calls])
+        self.assertEqual(
+            [('AUTH_a', 'sw\xc3\xa9ft', 'slo', 0)], queue.get(10))
+
+        # The object is restored inline if it cannot be queued
+        self.swift.calls = []
+        with mock.patch.object(queue, 'put',
+                               side_effect=sqlite3.OperationalError('locked')):
+            status, headers, body_iter = req.call_application(app)
+            self.assertEqual(payload, ''.join(body_iter))
+        mock_get_manifest.assert_called_once_with(u'slo')
+        self.assertEqual(shunt.S3SyncShunt.RESTORE_QUEUE_LOCK_TIMEOUT,
+                         queue.lock_timeout)
+
+        # Including when the queue cannot be created at all
+        queue.close()
+        queue.queue_location = os.path.join(tempdir, 'file', 'queue.db')
+        open(os.path.join(tempdir, 'file'), 'w').close()
+        status, headers, body_iter = req.call_application(app)
+        self.assertEqual('200 OK', status)
+        self.assertEqual(payload, ''.join(body_iter))
+        self.assertEqual(2, mock_get_manifest.call_count)
+
     def test_list_container_no_shunt(self):
         req = swob.Request.blank(
             '/v1/AUTH_a/foo',
@@ -590,11 +809,12 @@ class TestShunt(unittest.TestCase):
                      '__test__.body': '[]',
                      'swift.trans_id': 'id'})
         status, headers, body_iter = req.call_application(self.app)
+        body = ''.join(body_iter)
         self.assertEqual(self.mock_shunt_swift.mock_calls, [])
         self.mock_list_s3.assert_has_calls([
             mock.call('', 10000, '', ''),
             mock.call('unicod\xc3\xa9', 10000, '', '')])
-        names = body_iter.split('\n')
+        names = body.split('\n')
         self.assertEqual(['abc', u'unicod\xe9'.encode('utf-8')], names)
 
     def test_list_container_shunt_s3_xml(self):
@@ -619,11 +839,12 @@ class TestShunt(unittest.TestCase):
                      '__test__.body': '[]',
                      'swift.trans_id': 'id'})
         status, headers, body_iter = req.call_application(self.app)
+        body = ''.join(body_iter)
         self.assertEqual(self.mock_shunt_swift.mock_calls, [])
         self.mock_list_s3.assert_has_calls([
             mock.call('', 10000, '', ''),
             mock.call(u'unicod\xc3\xa9'.encode('utf-8'), 10000, '', '')])
-        root = lxml.etree.fromstring(body_iter)
+        root = lxml.etree.fromstring(body)
         context = lxml.etree.iterwalk(root, events=("start", "end"))
         element_index = 0
         cur_elem_properties = {}
@@ -670,11 +891,12 @@ class TestShunt(unittest.TestCase):
                      'swift.trans_id': 'id'},
             headers={'Accept': 'application/xml'})
         status, headers, body_iter = req.call_application(self.app)
+        body = ''.join(body_iter)
         self.assertEqual(self.mock_shunt_swift.mock_calls, [])
         self.mock_list_s3.assert_has_calls([
             mock.call('', 10000, '', ''),
             mock.call(u'unicod\xc3\xa9'.encode('utf-8'), 10000, '', '')])
-        root = lxml.etree.fromstring(body_iter)
+        root = lxml.etree.fromstring(body)
         context = lxml.etree.iterwalk(root, events=("start", "end"))
         element_index = 0
         cur_elem_properties = {}
@@ -720,11 +942,12 @@ class TestShunt(unittest.TestCase):
                      '__test__.body': '[]',
                      'swift.trans_id': 'id'})
         status, headers, body_iter = req.call_application(self.app)
+        body = ''.join(body_iter)
         self.assertEqual(self.mock_shunt_swift.mock_calls, [])
         self.mock_list_s3.assert_has_calls([
             mock.call('', 10000, '', ''),
             mock.call(u'unicod\xc3\xa9'.encode('utf-8'), 10000, '', '')])
-        results = json.loads(body_iter)
+        results = json.loads(body)
         for i, entry in enumerate(results):
             for k in entry.keys():
                 if k == 'content_location':
@@ -756,11 +979,12 @@ class TestShunt(unittest.TestCase):
                      'swift.trans_id': 'id'},
             headers={'Accept': 'application/json'})
         status, headers, body_iter = req.call_application(self.app)
+        body = ''.join(body_iter)
         self.assertEqual(self.mock_shunt_swift.mock_calls, [])
         self.mock_list_s3.assert_has_calls([
             mock.call('', 10000, '', ''),
             mock.call(u'unicod\xc3\xa9'.encode('utf-8'), 10000, '', '')])
-        results = json.loads(body_iter)
+        results = json.loads(body)
         for i, entry in enumerate(results):
             for k in elements[i].keys():
                 if k == 'content_location':
@@ -768,7 +992,7 @@ class TestShunt(unittest.TestCase):
                 else:
                     self.assertEqual(elements[i][k], entry[k])
 
-    @mock.patch('s3_sync.shunt.create_provider')
+    @mock.patch('s3_sync.provider_factory.create_provider')
     def test_list_container_shunt_all_containers(self, create_mock):
         create_mock.return_value = mock.Mock()
         create_mock.return_value.list_objects.return_value = ProviderResponse(
@@ -786,7 +1010,9 @@ class TestShunt(unittest.TestCase):
             'propagate_delete': False,
             'aws_bucket': 'dest-bucket',
             'aws_identity': 'user',
-            'aws_secret': 'key'}, max_conns=1, per_account=True)
+            'aws_secret': 'key'}, 10, per_account=True,
+            logger=self.app.shunted_app.logger,
+            extra_headers=None)
 
         # Follow it up with another request to a *different* container to make
         # sure we didn't bleed state
@@ -804,7 +1030,106 @@ class TestShunt(unittest.TestCase):
             'propagate_delete': False,
             'aws_bucket': 'dest-bucket',
             'aws_identity': 'user',
-            'aws_secret': 'key'}, max_conns=1, per_account=True)
+            'aws_secret': 'key'}, 10, per_account=True,
+            logger=self.app.shunted_app.logger,
+            extra_headers=None)
+
+    @mock.patch('s3_sync.provider_factory.create_provider')
+    def test_provider_cached_across_requests(self, create_mock):
+        create_mock.return_value = mock.Mock()
+        create_mock.return_value.list_objects.return_value = ProviderResponse(
+            True, 200, {}, [])
+
+        def _list(path):
+            req = swob.Request.blank(
+                path,
+                environ={'__test__.status': '200 OK',
+                         '__test__.body': '[]',
+                         'swift.trans_id': 'id'})
+            req.call_application(self.app)
+
+        _list('/v1/AUTH_a/s3')
+        _list('/v1/AUTH_a/s3')
+        self.assertEqual(1, create_mock.call_count)
+        self.assertEqual(1, len(self.app.shunted_app.provider_cache))
+
+        # Different containers in an "all containers" profile are different
+        # providers
+        _list('/v1/AUTH_b/c1')
+        _list('/v1/AUTH_b/c2')
+        _list('/v1/AUTH_b/c1')
+        self.assertEqual(3, create_mock.call_count)
+        self.assertEqual(3, len(self.app.shunted_app.provider_cache))
+
+    @mock.patch('s3_sync.shunt.getmtime')
+    def test_provider_cache_reload(self, mock_getmtime):
+        cache = self.app.shunted_app.provider_cache
+        profile = self.app.shunted_app.sync_profiles[('AUTH_a', 's3')]
+        provider = cache.get_provider(profile)
+        self.assertIs(provider, cache.get_provider(profile))
+
+        # Unchanged config keeps the cache
+        mock_getmtime.return_value = self.app.shunted_app._mtime
+        self.app.shunted_app._reload()
+        self.assertEqual(1, len(cache))
+
+        # Changed config invalidates it
+        mock_getmtime.return_value = self.app.shunted_app._mtime + 1
+        self.app.shunted_app._reload()
+        self.assertEqual(0, len(cache))
+
+    def test_metrics_path(self):
+        # Disabled by default
+        req = swob.Request.blank('/cloud_sync_metrics', environ={
+            '__test__.status': '404 Not Found'})
+        status, _, _ = req.call_application(self.app)
+        self.assertEqual('404 Not Found', status)
+
+        with tempfile.NamedTemporaryFile() as fp:
+            json.dump(self.conf, fp)
+            fp.flush()
+            app = shunt.filter_factory({
+                'conf_file': fp.name,
+                'metrics_path': '/cloud_sync_metrics'})(self.swift)
+        profile = app.shunted_app.sync_profiles[('AUTH_a', 's3')]
+        app.shunted_app.provider_cache.get_provider(profile)
+
+        # Only served to the allowed (local, by default) clients
+        status, _, _ = req.call_application(app)
+        self.assertEqual('403 Forbidden', status)
+        req.environ['REMOTE_ADDR'] = '10.0.0.1'
+        status, _, _ = req.call_application(app)
+        self.assertEqual('403 Forbidden', status)
+
+        req.environ['REMOTE_ADDR'] = '127.0.0.1'
+        status, headers, body = req.call_application(app)
+        self.assertEqual('200 OK', status)
+        self.assertEqual('text/plain; version=0.0.4',
+                         dict(headers)['Content-Type'])
+        self.assertIn(
+            'cloud_sync_client_pool_size{provider="SyncS3",endpoint="s3:/",'
+            'bucket="dest-bucket"} 10', ''.join(body).splitlines())
+
+        req = swob.Request.blank('/cloud_sync_metrics', method='PUT',
+                                 environ={'REMOTE_ADDR': '::1'})
+        status, _, _ = req.call_application(app)
+        self.assertEqual('405 Method Not Allowed', status)
+
+        with tempfile.NamedTemporaryFile() as fp:
+            json.dump(self.conf, fp)
+            fp.flush()
+            app = shunt.filter_factory({
+                'conf_file': fp.name,
+                'metrics_path': '/cloud_sync_metrics',
+                'metrics_allowed_addresses': '10.0.0.1, 10.0.0.2'})(
+                    self.swift)
+        req = swob.Request.blank('/cloud_sync_metrics', environ={
+            'REMOTE_ADDR': '10.0.0.2'})
+        status, _, _ = req.call_application(app)
+        self.assertEqual('200 OK', status)
+        req.environ['REMOTE_ADDR'] = '127.0.0.1'
+        status, _, _ = req.call_application(app)
+        self.assertEqual('403 Forbidden', status)
 
     def test_list_container_shunt_swift(self):
         self.mock_list_swift.side_effect = [
@@ -829,13 +1154,114 @@ class TestShunt(unittest.TestCase):
                      '__test__.body': '[]',
                      'swift.trans_id': 'id'})
         status, headers, body_iter = req.call_application(self.app)
+        body = ''.join(body_iter)
         self.assertEqual(self.mock_shunt_swift.mock_calls, [])
         self.mock_list_swift.assert_has_calls([
             mock.call('', 10000, '', ''),
             mock.call(u'unicod\xe9'.encode('utf-8'), 10000, '', '')])
-        names = body_iter.split('\n')
+        names = body.split('\n')
         self.assertEqual(['abc', u'unicod\xe9'.encode('utf-8')], names)
 
+    def test_list_container_streams_to_limit(self):
+        self.mock_list_swift.side_effect = [
+            ProviderResponse(
+                True, 200, {},
+                [{'name': 'a', 'content_location': 'http://some-swift'},
+                 {'name': 'c', 'content_location': 'http://some-swift'}]),
+            ProviderResponse(True, 200, {}, [])]
+        local = json.dumps([{'name': 'b', 'hash': 'ffff', 'bytes': 1,
+                             'last_modified': 'date',
+                             'content_type': 'type'},
+                            {'name': 'd', 'hash': 'ffff', 'bytes': 1,
+                             'last_modified': 'date',
+                             'content_type': 'type'}])
+        req = swob.Request.blank(
+            '/v1/AUTH_a/sw\xc3\xa9ft?limit=2',
+            environ={'__test__.status': '200 OK',
+                     '__test__.body': local,
+                     'swift.trans_id': 'id'})
+        status, headers, body_iter = req.call_application(self.app)
+        self.assertEqual('200 OK', status)
+        # The length of the spliced listing is not known up front
+        self.assertNotIn('content-length',
+                         [header.lower() for header, _ in headers])
+        self.assertEqual(['a', 'b'], ''.join(body_iter).split('\n'))
+        # Only the first remote page was needed to satisfy the limit
+        self.mock_list_swift.assert_called_once_with('', 2, '', '')
+
+    def test_list_container_cache(self):
+        with tempfile.NamedTemporaryFile() as fp:
+            json.dump(self.conf, fp)
+            fp.flush()
+            app = shunt.filter_factory({
+                'conf_file': fp.name,
+                'listing_cache_ttl': '10'})(self.swift)
+        memcache = FakeMemcache()
+        self.mock_list_s3.side_effect = lambda *args: ProviderResponse(
+            True, 200, {},
+            [{'name': 'abc', 'hash': 'ffff', 'bytes': 42,
+              'last_modified': 'date', 'content_type': 'type',
+              'content_location': 'aws_endpoint'}] if not args[0] else [])
+
+        def _get(query=''):
+            req = swob.Request.blank(
+                '/v1/AUTH_a/s3' + query,
+                environ={'__test__.status': '200 OK',
+                         '__test__.body': '[]',
+                         'swift.trans_id': 'id',
+                         'swift.cache': memcache})
+            status, headers, body_iter = req.call_application(app)
+            self.assertEqual('200 OK', status)
+            return ''.join(body_iter)
+
+        self.assertEqual('abc', _get())
+        self.assertEqual(2, self.mock_list_s3.call_count)
+        # The cached pages are shared by all of the listing formats
+        self.assertEqual('abc', _get())
+        self.assertIn('"name": "abc"', _get('?format=json'))
+        self.assertIn('<name>abc</name>', _get('?format=xml'))
+        self.assertEqual(2, self.mock_list_s3.call_count)
+        # Different listing parameters are cached separately
+        self.assertEqual('abc', _get('?prefix=a'))
+        self.assertEqual(4, self.mock_list_s3.call_count)
+
+        # Changes to the container handled by the shunt invalidate the cache
+        for method in ('POST', 'DELETE'):
+            req = swob.Request.blank(
+                '/v1/AUTH_a/s3', method=method,
+                environ={'__test__.status': '204 No Content',
+                         'swift.cache': memcache})
+            status, _, _ = req.call_application(app)
+            self.assertEqual('204 No Content', status)
+            calls = self.mock_list_s3.call_count
+            self.assertEqual('abc', _get())
+            self.assertEqual(calls + 2, self.mock_list_s3.call_count)
+
+        # Failed listings are not cached
+        self.mock_list_s3.side_effect = None
+        self.mock_list_s3.return_value = ProviderResponse(
+            False, 503, {}, 'Service Unavailable')
+        memcache.store.clear()
+        req = swob.Request.blank(
+            '/v1/AUTH_a/s3',
+            environ={'__test__.status': '200 OK',
+                     '__test__.body': '[]',
+                     'swift.cache': memcache})
+        req.call_application(app)
+        self.assertEqual([], memcache.keys('cloud_sync/'))
+
+    def test_list_container_cache_disabled(self):
+        memcache = FakeMemcache()
+        self.mock_list_s3.return_value = ProviderResponse(True, 200, {}, [])
+        req = swob.Request.blank(
+            '/v1/AUTH_a/s3',
+            environ={'__test__.status': '200 OK',
+                     '__test__.body': '[]',
+                     'swift.cache': memcache})
+        status, _, _ = req.call_application(self.app)
+        self.assertEqual('200 OK', status)
+        self.assertEqual([], memcache.keys('cloud_sync/'))
+
     def test_list_container_shunt_with_duplicates(self):
         self.mock_list_swift.side_effect = [
             ProviderResponse(
@@ -876,9 +1302,10 @@ class TestShunt(unittest.TestCase):
                      '__test__.body': json.dumps(local_data),
                      'swift.trans_id': 'id'})
         status, headers, body_iter = req.call_application(self.app)
+        body = ''.join(body_iter)
         self.assertEqual(self.mock_shunt_swift.mock_calls, [])
         self.mock_list_swift.assert_called_once_with('', 4, '', '/')
-        names = body_iter.split('\n')
+        names = body.split('\n')
         self.assertEqual(names, [
             'a', 'a/', u'unicod\xe9'.encode('utf-8'), 'z/',
         ])
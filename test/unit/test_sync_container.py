@@ -14,12 +14,17 @@ See the License for the specific language governing permissions and
 limitations under the License.
 """
 
+import eventlet
 import json
 import mock
+import os
+import shutil
+import tempfile
 import time
 import unittest
 
 from container_crawler import RetryError
+from s3_sync import sync_container
 from s3_sync.sync_container import SyncContainer
 from s3_sync.sync_s3 import SyncS3
 from s3_sync.sync_swift import SyncSwift
@@ -27,38 +32,6 @@ from swift.common.utils import decode_timestamps, Timestamp
 
 
 class TestSyncContainer(unittest.TestCase):
-    class MockMetaConf(object):
-        def __init__(self, fake_status):
-            self.fake_status = fake_status
-            self.write_buf = ''
-
-        def read(self, size=-1):
-            if size != -1:
-                raise RuntimeError()
-            return json.dumps(self.fake_status)
-
-        def write(self, data):
-            # Only support write at the beginning
-            self.write_buf += data
-
-        def truncate(self, size=None):
-            if size:
-                raise RuntimeError('Not supported')
-            self.fake_status = json.loads(self.write_buf)
-            self.write_buf = ''
-
-        def __exit__(self, *args):
-            if self.write_buf:
-                self.fake_status = json.loads(self.write_buf)
-                self.write_buf = ''
-
-        def __enter__(self):
-            return self
-
-        def seek(self, offset, flags=None):
-            if offset != 0:
-                raise RuntimeError
-
     @mock.patch('s3_sync.sync_s3.boto3.session.Session')
     def setUp(self, mock_boto3):
         self.mock_boto3_session = mock.Mock()
@@ -68,7 +41,13 @@ class TestSyncContainer(unittest.TestCase):
         self.mock_boto3_session.client.return_value = self.mock_boto3_client
 
         self.aws_bucket = 'bucket'
-        self.scratch_space = 'scratch'
+        self.scratch_space = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.scratch_space)
+        for state in (sync_container._pending_status,
+                      sync_container._status_write_times):
+            patcher = mock.patch.dict(state, clear=True)
+            patcher.start()
+            self.addCleanup(patcher.stop)
         self.sync_container = SyncContainer(self.scratch_space,
                                             {'aws_bucket': self.aws_bucket,
                                              'aws_identity': 'identity',
@@ -76,227 +55,353 @@ class TestSyncContainer(unittest.TestCase):
                                              'account': 'account',
                                              'container': 'container'})
 
+    def test_upload_status(self):
+        self.assertEqual(
+            self.sync_container._status_file + '.uploads',
+            self.sync_container.provider.upload_status.status_location)
+
+    @mock.patch('s3_sync.sync_s3.boto3.session.Session')
+    def test_sync_index(self, mock_boto3):
+        # The index is off by default
+        self.assertIsNone(self.sync_container.provider.sync_index)
+
+        settings = {'aws_bucket': self.aws_bucket,
+                    'aws_identity': 'identity',
+                    'aws_secret': 'credential',
+                    'account': 'account',
+                    'container': 'container',
+                    'sync_index': True}
+        sync = SyncContainer(self.scratch_space, settings)
+        index = sync.provider.sync_index
+        self.assertEqual(sync._status_file + '.index', index.index_location)
+        self.assertEqual(json.dumps([None, self.aws_bucket]),
+                         index.destination)
+        self.assertFalse(index.verify)
+
+        settings['verify_sync_index'] = True
+        sync = SyncContainer(self.scratch_space, settings)
+        self.assertTrue(sync.provider.sync_index.verify)
+
+        # Turning the index off removes it
+        sync.provider.sync_index.set('key', 'etag', 'meta-hash')
+        sync.provider.sync_index.close()
+        self.assertTrue(os.path.exists(index.index_location))
+        settings['sync_index'] = False
+        sync = SyncContainer(self.scratch_space, settings)
+        self.assertIsNone(sync.provider.sync_index)
+        self.assertFalse(os.path.exists(index.index_location))
+        settings['sync_index'] = True
+        sync = SyncContainer(self.scratch_space, settings)
+        self.assertIsNone(sync.provider.sync_index.get('key'))
+
+    def test_handle_concurrent_deletes(self):
+        self.sync_container.provider = mock.Mock()
+        error = RuntimeError('failed')
+        self.sync_container.provider.delete_objects.side_effect = \
+            lambda names: [error if name == 'bar' else None
+                           for name in names]
+        rows = [{'name': name, 'deleted': 1}
+                for name in ('foo', 'bar', 'baz')]
+
+        def _handle(row):
+            try:
+                self.sync_container.handle(row, None)
+            except RuntimeError as e:
+                return e
+
+        # The rows handled at the same time are deleted in one batch
+        pool = eventlet.GreenPool()
+        self.assertEqual([None, error, None], list(pool.imap(_handle, rows)))
+        self.sync_container.provider.delete_objects.assert_called_once_with(
+            ['foo', 'bar', 'baz'])
+
+        # If the batch fails, the objects are deleted one at a time
+        self.sync_container.provider.delete_objects.side_effect = error
+
+        def delete_object(name):
+            if name == 'bar':
+                raise error
+        self.sync_container.provider.delete_object.side_effect = \
+            delete_object
+        self.assertEqual([None, error], list(pool.imap(_handle, rows[:2])))
+        self.assertEqual(
+            2, self.sync_container.provider.delete_objects.call_count)
+        self.sync_container.provider.delete_object.assert_has_calls(
+            [mock.call('foo'), mock.call('bar')], any_order=True)
+
+    def test_handle_batch(self):
+        self.sync_container.provider = mock.Mock()
+        delete_error = RuntimeError('delete failed')
+        self.sync_container.provider.delete_objects.return_value = [
+            None, delete_error]
+        upload_error = RuntimeError('upload failed')
+
+        def upload_object(name, policy, swift_client):
+            if name == 'upload-2':
+                raise upload_error
+        self.sync_container.provider.upload_object.side_effect = \
+            upload_object
+        created_at = Timestamp(time.time() - 3600).internal
+        rows = [{'ROWID': 1, 'name': 'upload-1', 'deleted': 0,
+                 'storage_policy_index': 0, 'created_at': created_at},
+                {'ROWID': 2, 'name': 'delete-1', 'deleted': 1},
+                {'ROWID': 3, 'name': 'upload-2', 'deleted': 0,
+                 'storage_policy_index': 0, 'created_at': created_at},
+                {'ROWID': 4, 'name': 'delete-2', 'deleted': 1}]
+        swift_client = mock.Mock()
+
+        results = self.sync_container.handle_batch(rows, swift_client)
+        self.assertEqual([None, None, upload_error, delete_error], results)
+        self.sync_container.provider.delete_objects.assert_called_once_with(
+            ['delete-1', 'delete-2'])
+        self.sync_container.provider.upload_object.assert_has_calls(
+            [mock.call('upload-1', 0, swift_client),
+             mock.call('upload-2', 0, swift_client)], any_order=True)
+
+        # The rows handled at the same time are handled in one batch, but
+        # each one raises its own error
+        self.sync_container.provider.reset_mock()
+
+        def _handle(row):
+            try:
+                self.sync_container.handle(row, swift_client)
+            except RuntimeError as e:
+                return e
+
+        pool = eventlet.GreenPool()
+        self.assertEqual(results, list(pool.imap(_handle, rows)))
+        self.sync_container.provider.delete_objects.assert_called_once_with(
+            ['delete-1', 'delete-2'])
+        self.assertEqual(
+            2, self.sync_container.provider.upload_object.call_count)
+
+        # The deletes are not propagated, if so configured
+        self.sync_container.provider.reset_mock()
+        self.sync_container.propagate_delete = False
+        self.assertEqual(
+            [None, None, upload_error, None],
+            self.sync_container.handle_batch(rows, swift_client))
+        self.assertEqual(
+            [], self.sync_container.provider.delete_objects.mock_calls)
+
+    def _write_status(self, status):
+        if not os.path.exists(self.sync_container._status_account_dir):
+            os.mkdir(self.sync_container._status_account_dir)
+        with open(self.sync_container._status_file, 'w') as f:
+            json.dump(status, f)
+
+    def _read_status(self):
+        with open(self.sync_container._status_file) as f:
+            return json.load(f)
+
     def test_load_non_existent_meta(self):
         ret = self.sync_container.get_last_row('db-id')
         self.assertEqual(0, ret)
 
-    @mock.patch('__builtin__.open')
-    @mock.patch('s3_sync.sync_container.os.path.exists')
-    def test_load_upgrade_status(self, mock_exists, mock_open):
-        mock_exists.return_value = True
-        fake_status = dict(last_row=42)
-        mock_open.return_value = self.MockMetaConf(fake_status)
+    def test_load_upgrade_status(self):
+        self._write_status(dict(last_row=42))
 
         status = self.sync_container.get_last_row('db-id')
-        self.assertEqual(fake_status['last_row'], status)
-
-        mock_exists.assert_called_with('%s/%s/%s' % (
+        self.assertEqual(42, status)
+        self.assertEqual('%s/%s/%s' % (
             self.scratch_space, self.sync_container._account,
-            self.sync_container._container))
+            self.sync_container._container),
+            self.sync_container._status_file)
+
+    def test_load_corrupt_status(self):
+        os.mkdir(self.sync_container._status_account_dir)
+        with open(self.sync_container._status_file, 'w') as f:
+            f.write('{"db-id": {"last_')
+
+        self.assertEqual(0, self.sync_container.get_last_row('db-id'))
+        self.sync_container.save_last_row(42, 'db-id')
+        self.assertEqual(42, self._read_status()['db-id']['last_row'])
 
-    @mock.patch('__builtin__.open')
-    @mock.patch('s3_sync.sync_container.os.path.exists')
-    def test_last_row_new_bucket(self, mock_exists, mock_open):
+    def test_last_row_new_bucket(self):
         db_id = 'db-id-test'
-        new_bucket = 'new-bucket'
         self.sync_container.aws_bucket = 'bucket'
-        fake_status = {db_id: dict(last_row=42, aws_bucket=new_bucket)}
-
-        mock_exists.return_value = True
-        mock_open.return_value = self.MockMetaConf(fake_status)
+        self._write_status(
+            {db_id: dict(last_row=42, aws_bucket='new-bucket')})
 
         status = self.sync_container.get_last_row(db_id)
         self.assertEqual(0, status)
 
-        mock_exists.assert_called_with('%s/%s/%s' % (
-            self.scratch_space, self.sync_container._account,
-            self.sync_container._container))
-
-    @mock.patch('__builtin__.open')
-    @mock.patch('s3_sync.sync_container.os.path.exists')
-    def test_last_row_new_db_id(self, mock_exists, mock_open):
+    def test_last_row_new_db_id(self):
         db_id = 'db-id-test'
         self.sync_container.aws_bucket = 'bucket'
-        fake_status = {db_id: dict(last_row=42, aws_bucket='bucket')}
-
-        mock_exists.return_value = True
-        mock_open.return_value = self.MockMetaConf(fake_status)
+        self._write_status({db_id: dict(last_row=42, aws_bucket='bucket')})
 
         status = self.sync_container.get_last_row('other-db-id')
         self.assertEqual(0, status)
 
-        mock_exists.assert_called_with('%s/%s/%s' % (
-            self.scratch_space, self.sync_container._account,
-            self.sync_container._container))
-
-    @mock.patch('__builtin__.open')
-    @mock.patch('s3_sync.sync_container.os.path.exists')
-    def test_last_row_new_policy(self, mock_exists, mock_open):
+    def test_last_row_new_policy(self):
         db_id = 'db-id-test'
         for field in SyncContainer.POLICY_FIELDS:
             if field != 'copy_after':
                 setattr(self.sync_container, field, False)
             else:
                 setattr(self.sync_container, field, 42)
-        fake_status = {db_id: dict(last_row=42,
-                                   aws_bucket='bucket',
-                                   policy=dict(retain_local=True,
-                                               propagate_delete=True,
-                                               copy_after=0))}
-
-        mock_exists.return_value = True
-        mock_open.return_value = self.MockMetaConf(fake_status)
+        self._write_status({db_id: dict(last_row=42,
+                                        aws_bucket='bucket',
+                                        policy=dict(retain_local=True,
+                                                    propagate_delete=True,
+                                                    copy_after=0))})
 
         status = self.sync_container.get_last_row(db_id)
         self.assertEqual(0, status)
 
-        mock_exists.assert_called_with('%s/%s/%s' % (
-            self.scratch_space, self.sync_container._account,
-            self.sync_container._container))
-
-    @mock.patch('__builtin__.open')
-    @mock.patch('s3_sync.sync_container.os.path.exists')
-    def test_last_row_old_policy(self, mock_exists, mock_open):
+    def test_last_row_old_policy(self):
         db_id = 'db-id-test'
-        fake_status = {db_id: dict(last_row=42,
-                                   aws_bucket='bucket',
-                                   policy=dict(retain_local=True,
-                                               propagate_delete=True,
-                                               copy_after=0))}
-
-        mock_exists.return_value = True
-        mock_open.return_value = self.MockMetaConf(fake_status)
+        self._write_status({db_id: dict(last_row=42,
+                                        aws_bucket='bucket',
+                                        policy=dict(retain_local=True,
+                                                    propagate_delete=True,
+                                                    copy_after=0))})
 
         status = self.sync_container.get_last_row(db_id)
         self.assertEqual(42, status)
 
-        mock_exists.assert_called_with('%s/%s/%s' % (
-            self.scratch_space, self.sync_container._account,
-            self.sync_container._container))
-
-    @mock.patch('__builtin__.open')
-    @mock.patch('s3_sync.sync_container.os.path.exists')
-    def test_last_row(self, mock_exists, mock_open):
-        db_entries = [{'id': 'db-id-1', 'aws_bucket': 'bucket', 'last_row': 5},
-                      {'id': 'db-id-2', 'aws_bucket': 'bucket', 'last_row': 7}]
-        for entry in db_entries:
-            self.sync_container.aws_bucket = entry['aws_bucket']
-            fake_status = {entry['id']: dict(last_row=entry['last_row'],
-                                             aws_bucket=entry['aws_bucket'])}
-
-            mock_exists.return_value = True
-            mock_open.return_value = self.MockMetaConf(fake_status)
-
-            status = self.sync_container.get_last_row(entry['id'])
-            self.assertEqual(entry['last_row'], status)
-
-            mock_exists.assert_called_with('%s/%s/%s' % (
-                self.scratch_space, self.sync_container._account,
-                self.sync_container._container))
-
-    @mock.patch('__builtin__.open')
-    def test_save_last_row(self, mock_open):
+    def test_last_row(self):
+        self._write_status(
+            {'db-id-1': {'aws_bucket': 'bucket', 'last_row': 5},
+             'db-id-2': {'aws_bucket': 'bucket', 'last_row': 7}})
+        self.assertEqual(5, self.sync_container.get_last_row('db-id-1'))
+        self.assertEqual(7, self.sync_container.get_last_row('db-id-2'))
+
+    def test_last_row_cached(self):
+        self._write_status(
+            {'db-id-1': {'aws_bucket': 'bucket', 'last_row': 5}})
+
+        with mock.patch('__builtin__.open', side_effect=open) as mock_open:
+            self.assertEqual(5, self.sync_container.get_last_row('db-id-1'))
+            self.assertEqual(5, self.sync_container.get_last_row('db-id-1'))
+            self.sync_container.save_last_row(42, 'db-id-1')
+            self.assertEqual(
+                42, self.sync_container.get_last_row('db-id-1'))
+        self.assertEqual(1, mock_open.call_count)
+
+        # Changes to the status file are picked up
+        status = self._read_status()
+        status['db-id-1']['last_row'] = 7
+        with open(self.sync_container._status_file + '.new', 'w') as f:
+            json.dump(status, f)
+        os.rename(self.sync_container._status_file + '.new',
+                  self.sync_container._status_file)
+        self.assertEqual(7, self.sync_container.get_last_row('db-id-1'))
+
+    def test_save_last_row(self):
         db_entries = {'db-id-1': {'aws_bucket': 'bucket', 'last_row': 5},
                       'db-id-2': {'aws_bucket': 'bucket', 'last_row': 7}}
         new_row = 42
+        self.sync_container.status_save_interval = 0
         for db_id, entry in db_entries.items():
+            self._write_status(db_entries)
             self.sync_container.aws_bucket = entry['aws_bucket']
-            fake_conf_file = self.MockMetaConf(db_entries)
-            mock_open.return_value = fake_conf_file
-
-            with mock.patch('s3_sync.sync_container.os.path.exists')\
-                    as mock_exists:
-                mock_exists.return_value = True
-
-                self.sync_container.save_last_row(new_row, db_id)
-                file_entries = fake_conf_file.fake_status
-                for file_db_id, status in file_entries.items():
-                    if file_db_id == db_id:
-                        self.assertEqual(new_row, status['last_row'])
-                    else:
-                        self.assertEqual(db_entries[file_db_id]['last_row'],
-                                         status['last_row'])
-                    if db_id != file_db_id:
-                        continue
-                    else:
-                        self.assertIn('policy', status)
+            self.sync_container.save_last_row(new_row, db_id)
+            file_entries = self._read_status()
+            self.assertEqual(sorted(db_entries), sorted(file_entries))
+            for file_db_id, status in file_entries.items():
+                if file_db_id == db_id:
+                    self.assertEqual(new_row, status['last_row'])
+                    self.assertIn('policy', status)
                     for field in SyncContainer.POLICY_FIELDS:
                         self.assertEqual(status['policy'][field],
                                          getattr(self.sync_container, field))
-
-                self.assertEqual(
-                    [mock.call('%s/%s' % (self.scratch_space,
-                                          self.sync_container._account)),
-                     mock.call('%s/%s/%s' % (self.scratch_space,
-                                             self.sync_container._account,
-                                             self.sync_container._container))],
-                    mock_exists.call_args_list)
-
-    @mock.patch('__builtin__.open')
-    @mock.patch('s3_sync.sync_container.os.path.exists')
-    def test_save_no_prior_status(self, mock_exists, mock_open):
-        def existence_check(path):
-            if path == '%s/%s' % (self.scratch_space,
-                                  self.sync_container._account):
-                return True
-            elif path == '%s/%s/%s' % (self.scratch_space,
-                                       self.sync_container._account,
-                                       self.sync_container._container):
-                return False
-            else:
-                raise RuntimeError('Invalid path')
-
+                else:
+                    self.assertEqual(db_entries[file_db_id], status)
+            self.assertEqual(new_row, self.sync_container.get_last_row(db_id))
+        # No temporary files are left behind
+        self.assertEqual([self.sync_container._container],
+                         os.listdir(self.sync_container._status_account_dir))
+
+    @mock.patch('s3_sync.sync_container.time')
+    def test_save_last_row_coalesced(self, mock_time):
+        mock_time.time.return_value = 1000
+        self.sync_container.save_last_row(1, 'db-id')
+        self.assertEqual(1, self._read_status()['db-id']['last_row'])
+
+        # The saves that follow are held in memory
+        with mock.patch('s3_sync.sync_container.dump_json_atomically') as \
+                mock_dump:
+            mock_time.time.return_value = 1005
+            self.sync_container.save_last_row(2, 'db-id')
+            self.sync_container.save_last_row(3, 'db-id')
+        self.assertEqual([], mock_dump.mock_calls)
+        self.assertEqual(1, self._read_status()['db-id']['last_row'])
+        self.assertEqual(3, self.sync_container.get_last_row('db-id'))
+        # Including for the other handlers of the container
+        with mock.patch('s3_sync.sync_s3.boto3.session.Session'):
+            other = SyncContainer(self.scratch_space,
+                                  {'aws_bucket': self.aws_bucket,
+                                   'aws_identity': 'identity',
+                                   'aws_secret': 'credential',
+                                   'account': 'account',
+                                   'container': 'container'})
+        self.assertEqual(3, other.get_last_row('db-id'))
+
+        # Until the interval passes
+        mock_time.time.return_value = 1010
+        self.sync_container.save_last_row(4, 'db-id')
+        self.assertEqual(4, self._read_status()['db-id']['last_row'])
+
+        # The pending status is written out on shutdown
+        self.sync_container.save_last_row(5, 'db-id')
+        self.assertEqual(4, self._read_status()['db-id']['last_row'])
+        sync_container.flush_status()
+        self.assertEqual(5, self._read_status()['db-id']['last_row'])
+        self.assertEqual({}, sync_container._pending_status)
+        self.assertEqual(5, other.get_last_row('db-id'))
+
+    def test_save_no_prior_status(self):
         self.sync_container.aws_bucket = 'bucket'
-        fake_conf_file = self.MockMetaConf({})
-        mock_exists.side_effect = existence_check
-        mock_open.return_value = fake_conf_file
 
         self.sync_container.save_last_row(42, 'db-id')
-        self.assertEqual(42, fake_conf_file.fake_status['db-id']['last_row'])
-        self.assertEqual('bucket',
-                         fake_conf_file.fake_status['db-id']['aws_bucket'])
+        status = self._read_status()
+        self.assertEqual(42, status['db-id']['last_row'])
+        self.assertEqual('bucket', status['db-id']['aws_bucket'])
 
-        self.assertEqual(
-            [mock.call('%s/%s' % (self.scratch_space,
-                                  self.sync_container._account)),
-             mock.call('%s/%s/%s' % (self.scratch_space,
-                                     self.sync_container._account,
-                                     self.sync_container._container))],
-            mock_exists.call_args_list)
-
-    @mock.patch('__builtin__.open')
-    @mock.patch('s3_sync.sync_container.os.path.exists')
-    def test_save_last_row_new_bucket(self, mock_exists, mock_open):
+    def test_save_upgrade_status(self):
+        self._write_status(dict(last_row=5))
+
+        self.sync_container.save_last_row(42, 'db-id')
+        status = self._read_status()
+        self.assertEqual(['db-id'], status.keys())
+        self.assertEqual(42, status['db-id']['last_row'])
+
+    @mock.patch('s3_sync.utils.os.rename')
+    def test_save_last_row_failure(self, mock_rename):
+        self._write_status(
+            {'db-id': {'aws_bucket': 'bucket', 'last_row': 5}})
+        mock_rename.side_effect = OSError('failed')
+
+        with self.assertRaises(OSError):
+            self.sync_container.save_last_row(42, 'db-id')
+        self.assertEqual(5, self.sync_container.get_last_row('db-id'))
+        self.assertEqual(5, self._read_status()['db-id']['last_row'])
+        self.assertEqual([self.sync_container._container],
+                         os.listdir(self.sync_container._status_account_dir))
+
+    def test_save_last_row_new_bucket(self):
         db_entries = {'db-id-1': {'aws_bucket': 'bucket', 'last_row': 5},
                       'db-id-2': {'aws_bucket': 'old-bucket', 'last_row': 7}}
         new_row = 42
+        self.sync_container.status_save_interval = 0
         for db_id, entry in db_entries.items():
+            self._write_status(db_entries)
             self.sync_container.aws_bucket = 'bucket'
-            fake_conf_file = self.MockMetaConf(db_entries)
-            mock_open.return_value = fake_conf_file
-
-            with mock.patch('s3_sync.sync_container.os.path.exists')\
-                    as mock_exists:
-                mock_exists.return_value = True
-                self.sync_container.save_last_row(new_row, db_id)
-                file_entries = fake_conf_file.fake_status
-                for file_db_id, status in file_entries.items():
-                    if file_db_id == db_id:
-                        self.assertEqual(new_row, status['last_row'])
-                        self.assertEqual('bucket', status['aws_bucket'])
-                    else:
-                        self.assertEqual(db_entries[file_db_id]['last_row'],
-                                         status['last_row'])
-                        self.assertEqual(db_entries[file_db_id]['aws_bucket'],
-                                         status['aws_bucket'])
-
-                self.assertEqual(
-                    [mock.call('%s/%s' % (self.scratch_space,
-                                          self.sync_container._account)),
-                     mock.call('%s/%s/%s' % (self.scratch_space,
-                                             self.sync_container._account,
-                                             self.sync_container._container))],
-                    mock_exists.call_args_list)
+            self.sync_container.save_last_row(new_row, db_id)
+            file_entries = self._read_status()
+            self.assertEqual(sorted(db_entries), sorted(file_entries))
+            for file_db_id, status in file_entries.items():
+                if file_db_id == db_id:
+                    self.assertEqual(new_row, status['last_row'])
+                    self.assertEqual('bucket', status['aws_bucket'])
+                else:
+                    # The entries of the other DBs are preserved
+                    self.assertEqual(db_entries[file_db_id]['last_row'],
+                                     status['last_row'])
+                    self.assertEqual(db_entries[file_db_id]['aws_bucket'],
+                                     status['aws_bucket'])
 
     def test_s3_provider(self):
         defaults = {'aws_bucket': self.aws_bucket,
@@ -421,9 +526,10 @@ class TestSyncContainer(unittest.TestCase):
 
         sync = SyncContainer(self.scratch_space, settings)
         sync.provider = mock.Mock()
+        sync.provider.delete_objects.return_value = [None]
         row = {'deleted': 1, 'name': 'tombstone'}
         sync.handle(row, None)
 
         # Make sure that we do not make any additional calls
-        self.assertEqual([mock.call.delete_object(row['name'])],
+        self.assertEqual([mock.call.delete_objects([row['name']])],
                          sync.provider.mock_calls)
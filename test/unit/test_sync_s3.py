@@ -25,9 +25,13 @@ import datetime
 import hashlib
 import json
 import mock
-from s3_sync.sync_s3 import SyncS3
+import os
+from s3_sync.sync_s3 import SyncIndex, SyncS3, UploadStatus
 from s3_sync import utils
+import shutil
 from swift.common import swob
+from swift.common.internal_client import UnexpectedResponse
+import tempfile
 import unittest
 from utils import FakeStream
 
@@ -273,7 +277,7 @@ class TestSyncS3(unittest.TestCase):
         self.sync_s3.check_slo = mock.Mock()
         self.sync_s3.check_slo.return_value = False
         mock_ic = mock.Mock()
-        mock_ic.get_object_metadata.return_value = {
+        wrapper.get_headers.return_value = {
             'content-type': 'test/blob'}
 
         self.sync_s3.upload_object(key, storage_policy, mock_ic)
@@ -311,7 +315,7 @@ class TestSyncS3(unittest.TestCase):
         self.sync_s3.check_slo = mock.Mock()
         self.sync_s3.check_slo.return_value = False
         mock_ic = mock.Mock()
-        mock_ic.get_object_metadata.return_value = {
+        wrapper.get_headers.return_value = {
             'content-type': 'test/blob'}
 
         self.sync_s3.upload_object(key, storage_policy, mock_ic)
@@ -348,7 +352,7 @@ class TestSyncS3(unittest.TestCase):
         self.sync_s3.check_slo = mock.Mock()
         self.sync_s3.check_slo.return_value = False
         mock_ic = mock.Mock()
-        mock_ic.get_object_metadata.return_value = {
+        wrapper.get_headers.return_value = {
             'content-type': 'test/blob'}
 
         self.sync_s3.upload_object(key, storage_policy, mock_ic)
@@ -393,7 +397,7 @@ class TestSyncS3(unittest.TestCase):
         self.sync_s3.check_slo = mock.Mock()
         self.sync_s3.check_slo.return_value = False
         mock_ic = mock.Mock()
-        mock_ic.get_object_metadata.return_value = {
+        wrapper.get_headers.return_value = {
             'content-type': 'test/blob'}
 
         self.sync_s3.upload_object(key, storage_policy, mock_ic)
@@ -421,7 +425,8 @@ class TestSyncS3(unittest.TestCase):
                              'etag': etag,
                              'content-type': 'test/blob'}
         mock_ic = mock.Mock()
-        mock_ic.get_object_metadata.return_value = swift_object_meta
+        mock_ic.get_object.return_value = (
+            200, swift_object_meta, FakeStream())
         self.mock_boto3_client.head_object.return_value = {
             'Metadata': {'old': 'old'},
             'ETag': '"%s"' % etag
@@ -448,7 +453,8 @@ class TestSyncS3(unittest.TestCase):
                              'etag': etag,
                              'content-type': 'test/blob'}
         mock_ic = mock.Mock()
-        mock_ic.get_object_metadata.return_value = swift_object_meta
+        mock_ic.get_object.return_value = (
+            200, swift_object_meta, FakeStream())
         self.mock_boto3_client.head_object.return_value = {
             'Metadata': {'old': 'old'},
             'ETag': '"%s"' % etag
@@ -475,7 +481,8 @@ class TestSyncS3(unittest.TestCase):
                              'etag': etag,
                              'content-type': 'test/blob'}
         mock_ic = mock.Mock()
-        mock_ic.get_object_metadata.return_value = swift_object_meta
+        mock_ic.get_object.return_value = (
+            200, swift_object_meta, FakeStream())
         self.mock_boto3_client.head_object.return_value = {
             'Metadata': {'old': 'old'},
             'ETag': '"%s"' % etag
@@ -505,7 +512,6 @@ class TestSyncS3(unittest.TestCase):
                              'etag': etag,
                              'content-type': 'test/blob'}
         mock_ic = mock.Mock()
-        mock_ic.get_object_metadata.return_value = swift_object_meta
         self.mock_boto3_client.head_object.return_value = {
             'Metadata': {'old': 'old'},
             'ETag': '"%s"' % etag,
@@ -516,6 +522,7 @@ class TestSyncS3(unittest.TestCase):
         wrapper = mock.Mock()
         wrapper.__len__ = lambda s: 0
         wrapper.get_s3_headers.return_value = {'new': 'new', 'old': 'updated'}
+        wrapper.get_headers.return_value = swift_object_meta
         mock_file_wrapper.return_value = wrapper
 
         self.sync_s3.upload_object(key, storage_policy, mock_ic)
@@ -543,7 +550,6 @@ class TestSyncS3(unittest.TestCase):
                              'etag': 2,
                              'content-type': 'test/blob'}
         mock_ic = mock.Mock()
-        mock_ic.get_object_metadata.return_value = swift_object_meta
         self.mock_boto3_client.head_object.return_value = {
             'Metadata': {'old': 'old'},
             'ETag': 1,
@@ -551,6 +557,7 @@ class TestSyncS3(unittest.TestCase):
         }
 
         wrapper = mock.Mock()
+        wrapper.get_headers.return_value = swift_object_meta
         wrapper.get_s3_headers.return_value = utils.convert_to_s3_headers(
             swift_object_meta)
         wrapper.__len__ = lambda s: 42
@@ -575,7 +582,8 @@ class TestSyncS3(unittest.TestCase):
                              'etag': etag,
                              'content-type': 'test/blob'}
         mock_ic = mock.Mock()
-        mock_ic.get_object_metadata.return_value = swift_object_meta
+        mock_ic.get_object.return_value = (
+            200, swift_object_meta, FakeStream())
         self.mock_boto3_client.head_object.return_value = {
             'Metadata': {'foo': 'foo'},
             'ETag': '"%s"' % etag,
@@ -587,6 +595,100 @@ class TestSyncS3(unittest.TestCase):
         self.mock_boto3_client.copy_object.assert_not_called()
         self.mock_boto3_client.put_object.assert_not_called()
 
+    def test_upload_synced_object_skips_head(self):
+        key = 'key'
+        storage_policy = 42
+        etag = '1234'
+        swift_object_meta = {'x-object-meta-foo': 'foo',
+                             'etag': etag,
+                             'content-type': 'test/blob'}
+        mock_ic = mock.Mock()
+        mock_ic.get_object.side_effect = lambda *args, **kwargs: (
+            200, swift_object_meta, FakeStream())
+        self.mock_boto3_client.copy_object.return_value = {}
+        self.mock_boto3_client.head_object.return_value = {
+            'Metadata': {'foo': 'foo'},
+            'ETag': '"%s"' % etag,
+            'ContentType': 'test/blob'
+        }
+
+        self.sync_s3.upload_object(key, storage_policy, mock_ic)
+        self.assertEqual(1, self.mock_boto3_client.head_object.call_count)
+
+        # The last synced state matches: the remote object is not examined
+        self.sync_s3.upload_object(key, storage_policy, mock_ic)
+        self.assertEqual(1, self.mock_boto3_client.head_object.call_count)
+        self.assertEqual(2, mock_ic.get_object.call_count)
+        mock_ic.get_object_metadata.assert_not_called()
+
+        # Changed metadata requires a HEAD and an update
+        swift_object_meta['x-object-meta-foo'] = 'bar'
+        self.sync_s3.upload_object(key, storage_policy, mock_ic)
+        self.assertEqual(2, self.mock_boto3_client.head_object.call_count)
+        self.assertEqual(1, self.mock_boto3_client.copy_object.call_count)
+        self.mock_boto3_client.put_object.assert_not_called()
+
+        # Deleting the object forgets its synced state
+        self.mock_boto3_client.delete_object.return_value = {}
+        self.sync_s3.delete_object(key)
+        self.assertEqual({}, self.sync_s3._synced)
+
+    def test_upload_synced_object_no_retain_local(self):
+        # The local copy is removed after the upload: the remote object is
+        # always checked, even if the last synced state matches
+        self.sync_s3.settings['retain_local'] = False
+        key = 'key'
+        etag = '1234'
+        swift_object_meta = {'x-object-meta-foo': 'foo',
+                             'etag': etag,
+                             'content-type': 'test/blob',
+                             'Content-Length': '4'}
+        mock_ic = mock.Mock()
+        mock_ic.get_object.side_effect = lambda *args, **kwargs: (
+            200, swift_object_meta, FakeStream())
+        self.mock_boto3_client.head_object.return_value = {
+            'Metadata': {'foo': 'foo'},
+            'ETag': '"%s"' % etag,
+            'ContentType': 'test/blob'
+        }
+        self.sync_s3.upload_object(key, 42, mock_ic)
+        self.sync_s3.upload_object(key, 42, mock_ic)
+        self.assertEqual(2, self.mock_boto3_client.head_object.call_count)
+        self.mock_boto3_client.put_object.assert_not_called()
+
+        # The object is uploaded again if it was removed from the remote store
+        self.mock_boto3_client.head_object.side_effect = ClientError(
+            {'Error': {'Code': 'NotFound'},
+             'ResponseMetadata': {'HTTPStatusCode': 404}}, 'HEAD')
+        self.sync_s3.upload_object(key, 42, mock_ic)
+        self.assertEqual(1, self.mock_boto3_client.put_object.call_count)
+
+    @mock.patch('s3_sync.sync_s3.FileWrapper')
+    def test_upload_missing_object(self, mock_file_wrapper):
+        mock_file_wrapper.side_effect = UnexpectedResponse(
+            'Unexpected response: 404 Not Found', None)
+        mock_ic = mock.Mock()
+
+        self.sync_s3.upload_object('key', 42, mock_ic)
+
+        self.mock_boto3_client.head_object.assert_not_called()
+        self.mock_boto3_client.put_object.assert_not_called()
+
+    def test_synced_cache_size(self):
+        self.sync_s3.SYNCED_CACHE_SIZE = 2
+        meta = {'etag': '1234', 'content-type': 'test/blob'}
+        for key in ['a', 'b', 'c']:
+            self.sync_s3._set_synced(key, meta)
+        self.assertEqual(['b', 'c'], self.sync_s3._synced.keys())
+
+        # Looking up an entry makes it the most recently used one
+        self.assertTrue(self.sync_s3._is_synced('b', meta))
+        self.sync_s3._set_synced('d', meta)
+        self.assertEqual(['b', 'd'], self.sync_s3._synced.keys())
+        self.assertFalse(self.sync_s3._is_synced(
+            'b', dict(meta, etag='5678')))
+        self.assertFalse(self.sync_s3._is_synced('c', meta))
+
     def test_delete_object(self):
         key = 'key'
         self.mock_boto3_client.delete_object.return_value = {
@@ -602,6 +704,57 @@ class TestSyncS3(unittest.TestCase):
                       Key=self.sync_s3.get_manifest_name(
                           self.sync_s3.get_s3_name(key)))])
 
+    def test_delete_objects(self):
+        keys = ['foo', 'bar', 'baz']
+        s3_keys = map(self.sync_s3.get_s3_name, keys)
+        self.mock_boto3_client.delete_objects.return_value = {
+            'Errors': [{'Key': s3_keys[1], 'Code': 'AccessDenied',
+                        'Message': 'Access Denied'},
+                       {'Key': self.sync_s3.get_manifest_name(s3_keys[2]),
+                        'Code': 'NoSuchKey', 'Message': 'Not found'}]}
+
+        results = self.sync_s3.delete_objects(keys)
+
+        self.assertEqual(None, results[0])
+        self.assertEqual(
+            'Failed to delete %s: AccessDenied Access Denied' % s3_keys[1],
+            results[1].message)
+        self.assertEqual(None, results[2])
+        expected_keys = []
+        for s3_key in s3_keys:
+            expected_keys += [{'Key': s3_key},
+                              {'Key': self.sync_s3.get_manifest_name(s3_key)}]
+        self.mock_boto3_client.delete_objects.assert_called_once_with(
+            Bucket=self.aws_bucket,
+            Delete={'Objects': expected_keys, 'Quiet': True})
+        self.mock_boto3_client.delete_object.assert_not_called()
+
+    def test_delete_objects_batches(self):
+        self.sync_s3.DELETE_BATCH_SIZE = 3
+        keys = ['foo', 'bar', 'baz']
+        error = ClientError(
+            {'Error': {'Code': 'InternalError'},
+             'ResponseMetadata': {'HTTPStatusCode': 500}}, 'DeleteObjects')
+        self.mock_boto3_client.delete_objects.side_effect = [
+            {}, error]
+
+        results = self.sync_s3.delete_objects(keys)
+
+        # The manifest of the second object is in the failed request
+        self.assertEqual([None, error, error], results)
+        self.assertEqual(
+            [3, 3], [len(kwargs['Delete']['Objects']) for _, kwargs in
+                     self.mock_boto3_client.delete_objects.call_args_list])
+
+    def test_delete_objects_google(self):
+        self.sync_s3._google = lambda: True
+        self.sync_s3.delete_object = mock.Mock()
+        self.assertEqual([None, None],
+                         self.sync_s3.delete_objects(['foo', 'bar']))
+        self.mock_boto3_client.delete_objects.assert_not_called()
+        self.sync_s3.delete_object.assert_has_calls(
+            [mock.call('foo'), mock.call('bar')])
+
     def test_delete_missing_object(self):
         key = 'key'
         error = ClientError(
@@ -674,7 +827,8 @@ class TestSyncS3(unittest.TestCase):
                     'account': 'account',
                     'container': 'container'})
             conf_mock.assert_called_once_with(signature_version='s3v4',
-                                              s3={'aws_chunked': True})
+                                              s3={'aws_chunked': True},
+                                              max_pool_connections=10)
 
         with mock.patch(config_class) as conf_mock:
             SyncS3({'aws_bucket': self.aws_bucket,
@@ -682,8 +836,9 @@ class TestSyncS3(unittest.TestCase):
                     'aws_secret': 'credential',
                     'account': 'account',
                     'container': 'container',
-                    'aws_endpoint': 'http://test.com'})
-            conf_mock.assert_called_once_with(s3={'addressing_style': 'path'})
+                    'aws_endpoint': 'http://test.com'}, max_conns=4)
+            conf_mock.assert_called_once_with(s3={'addressing_style': 'path'},
+                                              max_pool_connections=4)
 
     @mock.patch('s3_sync.sync_s3.boto3.session.Session')
     def test_session_token_plumbing(self, session_mock):
@@ -712,11 +867,6 @@ class TestSyncS3(unittest.TestCase):
             {'Error': {'Code': 'NotFound'},
              'ResponseMetadata': {'HTTPStatusCode': 404}}, 'HEAD')
 
-        def get_metadata(account, container, key, headers):
-            if key == slo_key:
-                return {utils.SLO_HEADER: 'True'}
-            raise RuntimeError('Unknown key')
-
         def get_object(account, container, key, headers):
             if key == slo_key:
                 return (200, {utils.SLO_HEADER: 'True'},
@@ -724,7 +874,6 @@ class TestSyncS3(unittest.TestCase):
             raise RuntimeError('Unknown key!')
 
         mock_ic = mock.Mock()
-        mock_ic.get_object_metadata.side_effect = get_metadata
         mock_ic.get_object.side_effect = get_object
         self.sync_s3._upload_slo = mock.Mock()
 
@@ -733,8 +882,7 @@ class TestSyncS3(unittest.TestCase):
         self.mock_boto3_client.head_object.assert_called_once_with(
             Bucket=self.aws_bucket,
             Key=self.sync_s3.get_s3_name(slo_key))
-        mock_ic.get_object_metadata.assert_called_once_with(
-            'account', 'container', slo_key, headers=swift_req_headers)
+        mock_ic.get_object_metadata.assert_not_called()
         mock_ic.get_object.assert_called_once_with(
             'account', 'container', slo_key, headers=swift_req_headers)
 
@@ -873,20 +1021,15 @@ class TestSyncS3(unittest.TestCase):
             {'Error': {'Code': 'NotFound'},
              'ResponseMetadata': {'HTTPStatusCode': 404}}, 'HEAD')
 
-        def get_metadata(account, container, key, headers):
-            if key == slo_key:
-                return {utils.SLO_HEADER: 'True'}
-            raise RuntimeError('Unknown key')
-
         def get_object(account, container, key, headers):
             if key == slo_key:
                 return (200, {'etag': 'swift-slo-etag',
+                              utils.SLO_HEADER: 'True',
                               'content-type': 'test/blob'},
                         FakeStream(content=json.dumps(manifest)))
             raise RuntimeError('Unknown key!')
 
         mock_ic = mock.Mock()
-        mock_ic.get_object_metadata.side_effect = get_metadata
         mock_ic.get_object.side_effect = get_object
 
         self.sync_s3.upload_object(slo_key, storage_policy, mock_ic)
@@ -901,7 +1044,8 @@ class TestSyncS3(unittest.TestCase):
         self.assertEqual(s3_name, kwargs['Key'])
         self.assertEqual(5 * SyncS3.MB + 200, kwargs['ContentLength'])
         self.assertEqual(
-            {utils.SLO_ETAG_FIELD: 'swift-slo-etag'},
+            {utils.SLO_ETAG_FIELD: 'swift-slo-etag',
+             utils.SLO_HEADER: 'True'},
             kwargs['Metadata'])
         self.assertEqual(utils.SLOFileWrapper, type(kwargs['Body']))
 
@@ -911,8 +1055,7 @@ class TestSyncS3(unittest.TestCase):
             self.sync_s3.get_manifest_name(s3_name), kwargs['Key'])
         self.assertEqual(manifest, json.loads(kwargs['Body']))
 
-        mock_ic.get_object_metadata.assert_called_once_with(
-            'account', 'container', slo_key, headers=swift_req_headers)
+        mock_ic.get_object_metadata.assert_not_called()
         mock_ic.get_object.assert_called_once_with(
             'account', 'container', slo_key, headers=swift_req_headers)
 
@@ -934,13 +1077,6 @@ class TestSyncS3(unittest.TestCase):
             'Metadata': {utils.SLO_ETAG_FIELD: 'swift-slo-etag'},
             'ContentType': 'test/blob'}
 
-        def get_metadata(account, container, key, headers):
-            if key == slo_key:
-                return {utils.SLO_HEADER: 'True',
-                        'x-object-meta-foo': 'bar',
-                        'content-type': 'test/blob'}
-            raise RuntimeError('Unknown key')
-
         def get_object(account, container, key, headers):
             if key == slo_key:
                 return (200, {'etag': 'swift-slo-etag',
@@ -951,7 +1087,6 @@ class TestSyncS3(unittest.TestCase):
             raise RuntimeError('Unknown key!')
 
         mock_ic = mock.Mock()
-        mock_ic.get_object_metadata.side_effect = get_metadata
         mock_ic.get_object.side_effect = get_object
 
         self.sync_s3.upload_object(slo_key, storage_policy, mock_ic)
@@ -974,12 +1109,13 @@ class TestSyncS3(unittest.TestCase):
         storage_policy = 42
         swift_req_headers = {'X-Backend-Storage-Policy-Index': storage_policy,
                              'X-Newest': True}
+        chunk_len = 5 * SyncS3.MB
         manifest = [{'name': '/segment_container/slo-object/part1',
                      'hash': 'deadbeef',
-                     'bytes': 100},
+                     'bytes': chunk_len},
                     {'name': '/segment_container/slo-object/part2',
                      'hash': 'beefdead',
-                     'bytes': 200}]
+                     'bytes': chunk_len}]
 
         self.mock_boto3_client.create_multipart_upload.return_value = {
             'UploadId': 'mpu-key-for-slo'}
@@ -994,7 +1130,6 @@ class TestSyncS3(unittest.TestCase):
 
         self.mock_boto3_client.upload_part.side_effect = upload_part
 
-        chunk_len = 5 * SyncS3.MB
         fake_app_iter = FakeStream(chunk_len)
         mock_ic = mock.Mock()
         mock_ic.get_object.return_value = (
@@ -1033,6 +1168,411 @@ class TestSyncS3(unittest.TestCase):
                 ]}
             )
 
+    def test_internal_slo_upload_stitched(self):
+        slo_key = 'slo-object'
+        slo_meta = {'x-object-meta-foo': 'bar', 'content-type': 'test/blob',
+                    'etag': 'manifest-etag'}
+        s3_key = self.sync_s3.get_s3_name(slo_key)
+        swift_req_headers = {'X-Backend-Storage-Policy-Index': 42,
+                             'X-Newest': True}
+        segment_len = 3 * SyncS3.MB
+        contents = dict(('part%d' % i, chr(ord('A') + i) * segment_len)
+                        for i in range(1, 6))
+        manifest = [{'name': '/segment_container/slo-object/part%d' % i,
+                     'hash': hashlib.md5(contents['part%d' % i]).hexdigest(),
+                     'bytes': segment_len}
+                    for i in range(1, 6)]
+        part_etags = [
+            hashlib.md5(contents['part1'] + contents['part2']).hexdigest(),
+            hashlib.md5(contents['part3'] + contents['part4']).hexdigest(),
+            hashlib.md5(contents['part5']).hexdigest()]
+
+        self.mock_boto3_client.create_multipart_upload.return_value = {
+            'UploadId': 'mpu-key-for-slo'}
+
+        def upload_part(**kwargs):
+            body = ''
+            while True:
+                data = kwargs['Body'].read(SyncS3.MB)
+                if not data:
+                    break
+                body += data
+            self.assertEqual(kwargs['ContentLength'], len(body))
+            return {'ETag': '"%s"' % hashlib.md5(body).hexdigest()}
+
+        self.mock_boto3_client.upload_part.side_effect = upload_part
+
+        def get_object(account, container, key, headers={}):
+            segment = key.split('/')[-1]
+            return (200, {'Content-Length': segment_len},
+                    FakeStream(content=contents[segment]))
+
+        mock_ic = mock.Mock()
+        mock_ic.get_object.side_effect = get_object
+        self.sync_s3._upload_slo(manifest, slo_meta, s3_key, swift_req_headers,
+                                 mock_ic)
+
+        self.mock_boto3_client.create_multipart_upload.assert_called_once_with(
+            Bucket=self.aws_bucket,
+            Key=s3_key,
+            Metadata={'foo': 'bar', utils.SLO_ETAG_FIELD: 'manifest-etag'},
+            ServerSideEncryption='AES256',
+            ContentType='test/blob')
+        self.assertEqual(
+            [(1, 2 * segment_len), (2, 2 * segment_len), (3, segment_len)],
+            sorted([(kwargs['PartNumber'], kwargs['ContentLength'])
+                    for _, _, kwargs in
+                    self.mock_boto3_client.upload_part.mock_calls]))
+        self.mock_boto3_client.complete_multipart_upload\
+            .assert_called_once_with(
+                Bucket=self.aws_bucket,
+                Key=s3_key,
+                UploadId='mpu-key-for-slo',
+                MultipartUpload={'Parts': [
+                    {'PartNumber': 1, 'ETag': part_etags[0]},
+                    {'PartNumber': 2, 'ETag': part_etags[1]},
+                    {'PartNumber': 3, 'ETag': part_etags[2]},
+                ]}
+            )
+
+    def _setup_resumable_slo(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tempdir)
+        status_path = os.path.join(self.tempdir, 'account', 'container')
+        self.sync_s3.upload_status = UploadStatus(status_path + '.uploads')
+        self.sync_s3.SLO_RETRY_BACKOFF = 0
+
+        segment_len = 5 * SyncS3.MB
+        contents = dict(('part%d' % i, chr(ord('A') + i) * segment_len)
+                        for i in range(1, 4))
+        manifest = [{'name': '/segment_container/slo-object/part%d' % i,
+                     'hash': hashlib.md5(contents['part%d' % i]).hexdigest(),
+                     'bytes': segment_len}
+                    for i in range(1, 4)]
+
+        def get_object(account, container, key, headers={}):
+            segment = key.split('/')[-1]
+            return (200, {'Content-Length': segment_len},
+                    FakeStream(content=contents[segment]))
+
+        mock_ic = mock.Mock()
+        mock_ic.get_object.side_effect = get_object
+        return manifest, mock_ic
+
+    def test_internal_slo_upload_resume(self):
+        manifest, mock_ic = self._setup_resumable_slo()
+        slo_meta = {'x-object-meta-foo': 'bar', 'content-type': 'test/blob'}
+        s3_key = self.sync_s3.get_s3_name('slo-object')
+        self.mock_boto3_client.create_multipart_upload.return_value = {
+            'UploadId': 'mpu-key-for-slo'}
+
+        def upload_part(**kwargs):
+            if kwargs['PartNumber'] == 2:
+                raise RuntimeError('oops')
+            return {'ETag': '"%s"' % manifest[kwargs['PartNumber'] - 1][
+                'hash']}
+
+        self.mock_boto3_client.upload_part.side_effect = upload_part
+        with self.assertRaises(RuntimeError):
+            self.sync_s3._upload_slo(manifest, slo_meta, s3_key, {}, mock_ic)
+        # Every failed part is retried
+        self.assertEqual(
+            SyncS3.SLO_PART_RETRIES + 3,
+            self.mock_boto3_client.upload_part.call_count)
+        self.assertEqual(
+            0, self.mock_boto3_client.abort_multipart_upload.call_count)
+        self.assertEqual(
+            0, self.mock_boto3_client.complete_multipart_upload.call_count)
+        entry = UploadStatus(
+            self.sync_s3.upload_status.status_location).get_upload(s3_key)
+        self.assertEqual('mpu-key-for-slo', entry['upload_id'])
+        self.assertEqual({'1': manifest[0]['hash'], '3': manifest[2]['hash']},
+                         entry['parts'])
+
+        # The next attempt only uploads the missing part
+        self.mock_boto3_client.reset_mock()
+        self.mock_boto3_client.upload_part.side_effect = None
+        self.mock_boto3_client.upload_part.return_value = {
+            'ETag': '"%s"' % manifest[1]['hash']}
+        self.mock_boto3_client.list_parts.return_value = {
+            'Parts': [{'PartNumber': 1, 'ETag': '"%s"' % manifest[0]['hash']},
+                      {'PartNumber': 3, 'ETag': '"%s"' % manifest[2]['hash']}],
+            'IsTruncated': False}
+        self.sync_s3._upload_slo(manifest, slo_meta, s3_key, {}, mock_ic)
+
+        self.assertEqual(
+            0, self.mock_boto3_client.create_multipart_upload.call_count)
+        self.mock_boto3_client.list_parts.assert_called_once_with(
+            Bucket=self.aws_bucket, Key=s3_key, UploadId='mpu-key-for-slo')
+        self.mock_boto3_client.upload_part.assert_called_once_with(
+            Bucket=self.aws_bucket, Key=s3_key, PartNumber=2,
+            ContentLength=5 * SyncS3.MB, Body=mock.ANY,
+            UploadId='mpu-key-for-slo')
+        self.mock_boto3_client.complete_multipart_upload\
+            .assert_called_once_with(
+                Bucket=self.aws_bucket, Key=s3_key,
+                UploadId='mpu-key-for-slo',
+                MultipartUpload={'Parts': [
+                    {'PartNumber': i, 'ETag': manifest[i - 1]['hash']}
+                    for i in range(1, 4)]})
+        self.assertIsNone(self.sync_s3.upload_status.get_upload(s3_key))
+
+    def test_internal_slo_upload_resume_changed(self):
+        manifest, mock_ic = self._setup_resumable_slo()
+        slo_meta = {'x-object-meta-foo': 'bar', 'content-type': 'test/blob'}
+        s3_key = self.sync_s3.get_s3_name('slo-object')
+        self.sync_s3.upload_status.start_upload(
+            s3_key, 'old-upload', 'old-fingerprint')
+        self.mock_boto3_client.create_multipart_upload.return_value = {
+            'UploadId': 'new-upload'}
+
+        def upload_part(**kwargs):
+            return {'ETag': '"%s"' % manifest[kwargs['PartNumber'] - 1][
+                'hash']}
+
+        self.mock_boto3_client.upload_part.side_effect = upload_part
+        self.sync_s3._upload_slo(manifest, slo_meta, s3_key, {}, mock_ic)
+
+        self.mock_boto3_client.abort_multipart_upload.assert_called_once_with(
+            Bucket=self.aws_bucket, Key=s3_key, UploadId='old-upload')
+        self.assertEqual(0, self.mock_boto3_client.list_parts.call_count)
+        self.assertEqual(3, self.mock_boto3_client.upload_part.call_count)
+        self.assertEqual(
+            'new-upload',
+            self.mock_boto3_client.complete_multipart_upload.call_args[1][
+                'UploadId'])
+
+    def test_internal_slo_upload_resume_expired(self):
+        manifest, mock_ic = self._setup_resumable_slo()
+        slo_meta = {'x-object-meta-foo': 'bar', 'content-type': 'test/blob'}
+        s3_key = self.sync_s3.get_s3_name('slo-object')
+        fingerprint = self.sync_s3._get_upload_fingerprint(manifest, slo_meta)
+        self.sync_s3.upload_status.start_upload(
+            s3_key, 'old-upload', fingerprint)
+        self.mock_boto3_client.list_parts.side_effect = ClientError(
+            dict(Error=dict(Code='NoSuchUpload', Message='no such upload'),
+                 ResponseMetadata=dict(HTTPStatusCode=404, HTTPHeaders={})),
+            'list_parts')
+        self.mock_boto3_client.create_multipart_upload.return_value = {
+            'UploadId': 'new-upload'}
+
+        def upload_part(**kwargs):
+            return {'ETag': '"%s"' % manifest[kwargs['PartNumber'] - 1][
+                'hash']}
+
+        self.mock_boto3_client.upload_part.side_effect = upload_part
+        self.sync_s3._upload_slo(manifest, slo_meta, s3_key, {}, mock_ic)
+
+        self.assertEqual(
+            1, self.mock_boto3_client.create_multipart_upload.call_count)
+        self.assertEqual(3, self.mock_boto3_client.upload_part.call_count)
+        self.assertIsNone(self.sync_s3.upload_status.get_upload(s3_key))
+
+    def test_resume_unrecorded_parts(self):
+        self._setup_resumable_slo()
+        s3_key = self.sync_s3.get_s3_name('slo-object')
+        self.sync_s3.upload_status.start_upload(
+            s3_key, 'upload-id', 'fingerprint')
+        self.sync_s3.upload_status.save_part(s3_key, 1, 'etag1')
+        slo_parts = [
+            [{'name': '/segments/1', 'hash': 'etag1', 'bytes': 5}],
+            [{'name': '/segments/2', 'hash': 'etag2', 'bytes': 5}],
+            [{'name': '/segments/3', 'hash': 'etag3', 'bytes': 2},
+             {'name': '/segments/4', 'hash': 'etag4', 'bytes': 3}],
+            [{'name': '/segments/5', 'hash': 'etag5', 'bytes': 5}],
+            [{'name': '/segments/6', 'hash': 'etag6', 'bytes': 2},
+             {'name': '/segments/7', 'hash': 'etag7', 'bytes': 3}]]
+        self.mock_boto3_client.list_parts.return_value = {
+            'Parts': [
+                {'PartNumber': 1, 'ETag': '"etag1"', 'Size': 5},
+                # Not recorded: checked against the segment's ETag
+                {'PartNumber': 2, 'ETag': '"etag2"', 'Size': 5},
+                # Not recorded: checked against the size of the segments
+                {'PartNumber': 3, 'ETag': '"stitched"', 'Size': 5},
+                {'PartNumber': 4, 'ETag': '"other-etag"', 'Size': 5},
+                {'PartNumber': 5, 'ETag': '"stitched"', 'Size': 4},
+                {'PartNumber': 6, 'ETag': '"etag1"', 'Size': 5}],
+            'IsTruncated': False}
+        self.assertEqual(
+            ('upload-id', {1: 'etag1', 2: 'etag2', 3: 'stitched'}),
+            self.sync_s3._resume_multipart_upload(
+                s3_key, 'fingerprint', slo_parts))
+
+    def test_stale_upload_aborted(self):
+        self._setup_resumable_slo()
+        s3_key = self.sync_s3.get_s3_name('slo-object')
+
+        # The object was deleted
+        self.sync_s3.upload_status.start_upload(
+            s3_key, 'upload-1', 'fingerprint')
+        self.mock_boto3_client.delete_object.return_value = {}
+        self.sync_s3.delete_object('slo-object')
+        self.mock_boto3_client.abort_multipart_upload.assert_called_once_with(
+            Bucket=self.aws_bucket, Key=s3_key, UploadId='upload-1')
+        self.assertIsNone(self.sync_s3.upload_status.get_upload(s3_key))
+
+        self.sync_s3.upload_status.start_upload(
+            s3_key, 'upload-2', 'fingerprint')
+        self.mock_boto3_client.delete_objects.return_value = {}
+        self.sync_s3.delete_objects(['slo-object'])
+        self.mock_boto3_client.abort_multipart_upload.assert_called_with(
+            Bucket=self.aws_bucket, Key=s3_key, UploadId='upload-2')
+
+        # The object is gone from the local cluster
+        self.sync_s3.upload_status.start_upload(
+            s3_key, 'upload-3', 'fingerprint')
+        mock_ic = mock.Mock()
+        mock_ic.get_object.side_effect = UnexpectedResponse(
+            'Unexpected response: 404 Not Found', None)
+        self.sync_s3.upload_object('slo-object', 0, mock_ic)
+        self.mock_boto3_client.abort_multipart_upload.assert_called_with(
+            Bucket=self.aws_bucket, Key=s3_key, UploadId='upload-3')
+
+        # The object was overwritten with one that is not an SLO
+        self.sync_s3.upload_status.start_upload(
+            s3_key, 'upload-4', 'fingerprint')
+        self.mock_boto3_client.abort_multipart_upload.side_effect = \
+            ClientError(
+                dict(Error=dict(Code='NoSuchUpload', Message='no upload'),
+                     ResponseMetadata=dict(HTTPStatusCode=404,
+                                           HTTPHeaders={})),
+                'abort_multipart_upload')
+        mock_ic.get_object.side_effect = lambda *args, **kwargs: (
+            200, {'etag': '1234', 'content-type': 'test/blob',
+                  'Content-Length': '4'}, FakeStream())
+        self.mock_boto3_client.head_object.return_value = {
+            'Metadata': {}, 'ETag': '"1234"', 'ContentType': 'test/blob'}
+        self.sync_s3.upload_object('slo-object', 0, mock_ic)
+        self.mock_boto3_client.abort_multipart_upload.assert_called_with(
+            Bucket=self.aws_bucket, Key=s3_key, UploadId='upload-4')
+        self.assertEqual(
+            4, self.mock_boto3_client.abort_multipart_upload.call_count)
+        self.assertEqual({}, json.load(
+            open(self.sync_s3.upload_status.status_location)))
+
+    def test_upload_status(self):
+        tempdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tempdir)
+        location = os.path.join(tempdir, 'account', 'container.uploads')
+        status = UploadStatus(location)
+        self.assertIsNone(status.get_upload(u'key\u062a'))
+        self.assertFalse(os.path.exists(location))
+
+        status.start_upload(u'key\u062a', 'upload-id', 'fingerprint')
+        status.save_part(u'key\u062a', 2, 'etag2')
+        status.save_part('other-key', 1, 'etag1')
+        # The parts are written out once in a while, or when flushed
+        self.assertEqual(
+            {'upload_id': 'upload-id', 'fingerprint': 'fingerprint',
+             'parts': {}},
+            UploadStatus(location).get_upload(u'key\u062a'))
+        status.flush()
+        self.assertEqual(
+            {'upload_id': 'upload-id', 'fingerprint': 'fingerprint',
+             'parts': {'2': 'etag2'}},
+            UploadStatus(location).get_upload(u'key\u062a'))
+        self.assertIsNone(UploadStatus(location).get_upload('other-key'))
+        with mock.patch('s3_sync.sync_s3.time') as mock_time:
+            mock_time.time.return_value = \
+                status._last_save + UploadStatus.PART_SAVE_INTERVAL
+            status.save_part(u'key\u062a', 3, 'etag3')
+        self.assertEqual(
+            {'2': 'etag2', '3': 'etag3'},
+            UploadStatus(location).get_upload(u'key\u062a')['parts'])
+
+        status.remove_upload(u'key\u062a')
+        self.assertEqual({}, json.load(open(location)))
+
+        # A corrupt status is ignored
+        with open(location, 'w') as fh:
+            fh.write('{"not json')
+        self.assertIsNone(UploadStatus(location).get_upload(u'key\u062a'))
+
+    def test_sync_index(self):
+        tempdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tempdir)
+        location = os.path.join(tempdir, 'account', 'container.index')
+        index = SyncIndex(location, 'dest')
+        self.assertIsNone(index.get('monkey-\xf0\x9f\x90\xb5'))
+        index.set('monkey-\xf0\x9f\x90\xb5', 'etag', 'meta-hash')
+        index.set('key', 'etag', 'meta-hash')
+        index.remove('key')
+        index.close()
+
+        index = SyncIndex(location, 'dest')
+        self.assertEqual(('etag', 'meta-hash'),
+                         index.get('monkey-\xf0\x9f\x90\xb5'))
+        self.assertIsNone(index.get('key'))
+        index.close()
+
+        # The entries are not used in the verification mode
+        index = SyncIndex(location, 'dest', verify=True)
+        self.assertIsNone(index.get('monkey-\xf0\x9f\x90\xb5'))
+        index.close()
+
+        # Changing the destination clears the index
+        index = SyncIndex(location, 'other-dest')
+        with mock.patch.object(index, 'clear',
+                               wraps=index.clear) as mock_clear:
+            self.assertIsNone(index.get('monkey-\xf0\x9f\x90\xb5'))
+        mock_clear.assert_called_once_with()
+        index.set('key', 'etag', 'meta-hash')
+        index.close()
+        index = SyncIndex(location, 'other-dest')
+        self.assertEqual(('etag', 'meta-hash'), index.get('key'))
+        index.clear()
+        self.assertIsNone(index.get('key'))
+        index.close()
+
+        # A damaged index is rebuilt
+        with open(location, 'w') as fh:
+            fh.write('not a database' * 100)
+        index = SyncIndex(location, 'dest')
+        self.assertIsNone(index.get('key'))
+        index.set('key', 'etag', 'meta-hash')
+        self.assertEqual(('etag', 'meta-hash'), index.get('key'))
+        index.close()
+
+    def test_upload_object_sync_index(self):
+        tempdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tempdir)
+        location = os.path.join(tempdir, 'account', 'container.index')
+        self.sync_s3.sync_index = SyncIndex(location, 'dest')
+
+        key = 'key'
+        etag = '1234'
+        swift_object_meta = {'x-object-meta-foo': 'foo',
+                             'etag': etag,
+                             'content-type': 'test/blob'}
+        mock_ic = mock.Mock()
+        mock_ic.get_object.side_effect = lambda *args, **kwargs: (
+            200, swift_object_meta, FakeStream())
+        self.mock_boto3_client.head_object.return_value = {
+            'Metadata': {'foo': 'foo'},
+            'ETag': '"%s"' % etag,
+            'ContentType': 'test/blob'
+        }
+        self.sync_s3.upload_object(key, 42, mock_ic)
+        self.assertEqual(1, self.mock_boto3_client.head_object.call_count)
+
+        # A new provider (e.g. after a restart) relies on the index
+        self.sync_s3._synced.clear()
+        self.sync_s3.upload_object(key, 42, mock_ic)
+        self.assertEqual(1, self.mock_boto3_client.head_object.call_count)
+
+        # The remote object is checked again in the verification mode
+        self.sync_s3._synced.clear()
+        self.sync_s3.sync_index.verify = True
+        self.sync_s3.upload_object(key, 42, mock_ic)
+        self.assertEqual(2, self.mock_boto3_client.head_object.call_count)
+        self.mock_boto3_client.put_object.assert_not_called()
+
+        self.sync_s3.sync_index.verify = False
+        self.mock_boto3_client.delete_object.return_value = {}
+        self.sync_s3.delete_object(key)
+        self.assertIsNone(self.sync_s3.sync_index.get(
+            self.sync_s3.get_s3_name(key)))
+
     def test_internal_slo_upload_encryption(self):
         slo_key = 'slo-object'
         slo_meta = {'x-object-meta-foo': 'bar', 'content-type': 'test/blob'}
@@ -1095,7 +1635,6 @@ class TestSyncS3(unittest.TestCase):
             'x-object-meta-new-key': 'foo'
         }
         mock_ic = mock.Mock()
-        mock_ic.get_object_metadata.return_value = slo_meta
         mock_ic.get_object.return_value = (
             200, slo_meta, FakeStream(content=json.dumps(manifest)))
 
@@ -1105,8 +1644,7 @@ class TestSyncS3(unittest.TestCase):
             slo_meta, manifest, self.sync_s3.get_s3_name(slo_key),
             swift_req_headers, mock_ic)
         self.assertEqual(0, self.sync_s3._upload_slo.call_count)
-        mock_ic.get_object_metadata.assert_called_once_with(
-            'account', 'container', slo_key, headers=swift_req_headers)
+        mock_ic.get_object_metadata.assert_not_called()
         mock_ic.get_object.assert_called_once_with(
             'account', 'container', slo_key, headers=swift_req_headers)
 
@@ -1135,7 +1673,6 @@ class TestSyncS3(unittest.TestCase):
             'x-object-meta-new-key': 'foo'
         }
         mock_ic = mock.Mock()
-        mock_ic.get_object_metadata.return_value = slo_meta
         mock_ic.get_object.return_value = (
             200, slo_meta, FakeStream(content=json.dumps(manifest)))
 
@@ -1145,8 +1682,7 @@ class TestSyncS3(unittest.TestCase):
         self.sync_s3._upload_slo.assert_called_once_with(
             manifest, slo_meta, self.sync_s3.get_s3_name(slo_key),
             swift_req_headers, mock_ic)
-        mock_ic.get_object_metadata.assert_called_once_with(
-            'account', 'container', slo_key, headers=swift_req_headers)
+        mock_ic.get_object_metadata.assert_not_called()
         mock_ic.get_object.assert_called_once_with(
             'account', 'container', slo_key, headers=swift_req_headers)
 
@@ -1173,7 +1709,6 @@ class TestSyncS3(unittest.TestCase):
         }
 
         mock_ic = mock.Mock()
-        mock_ic.get_object_metadata.return_value = slo_meta
         mock_ic.get_object.return_value = (
             200, slo_meta, FakeStream(content=json.dumps(manifest)))
 
@@ -1181,11 +1716,115 @@ class TestSyncS3(unittest.TestCase):
 
         self.assertEqual(0, self.sync_s3.update_slo_metadata.call_count)
         self.assertEqual(0, self.sync_s3._upload_slo.call_count)
-        mock_ic.get_object_metadata.assert_called_once_with(
-            'account', 'container', slo_key, headers=swift_req_headers)
+        mock_ic.get_object_metadata.assert_not_called()
         mock_ic.get_object.assert_called_once_with(
             'account', 'container', slo_key, headers=swift_req_headers)
 
+    def test_slo_stitched_no_changes(self):
+        slo_key = 'slo-object'
+        storage_policy = 42
+        manifest = [{'name': '/segment_container/slo-object/part1',
+                     'hash': 'deadbeef',
+                     'bytes': SyncS3.MB},
+                    {'name': '/segment_container/slo-object/part2',
+                     'hash': 'beefdead',
+                     'bytes': SyncS3.MB}]
+        slo_meta = {
+            utils.SLO_HEADER: 'True',
+            'x-object-meta-new-key': 'foo',
+            'content-type': 'test/blob',
+            'etag': 'manifest-etag',
+        }
+        s3_meta = {
+            'Metadata': {'new-key': 'foo',
+                         utils.SLO_HEADER: 'True',
+                         utils.SLO_ETAG_FIELD: 'manifest-etag'},
+            'ContentType': 'test/blob',
+            'ETag': '"stitched-etag-1"'}
+        self.mock_boto3_client.head_object.return_value = s3_meta
+        self.sync_s3.update_slo_metadata = mock.Mock()
+        self.sync_s3._upload_slo = mock.Mock()
+
+        mock_ic = mock.Mock()
+        mock_ic.get_object.return_value = (
+            200, slo_meta, FakeStream(content=json.dumps(manifest)))
+
+        self.sync_s3.upload_object(slo_key, storage_policy, mock_ic)
+        self.assertEqual(0, self.sync_s3.update_slo_metadata.call_count)
+        self.assertEqual(0, self.sync_s3._upload_slo.call_count)
+
+        # A changed manifest is uploaded again
+        slo_meta['etag'] = 'new-manifest-etag'
+        mock_ic.get_object.return_value = (
+            200, slo_meta, FakeStream(content=json.dumps(manifest)))
+        self.sync_s3.upload_object(slo_key, storage_policy, mock_ic)
+        self.assertEqual(0, self.sync_s3.update_slo_metadata.call_count)
+        self.sync_s3._upload_slo.assert_called_once_with(
+            manifest, slo_meta, self.sync_s3.get_s3_name(slo_key), mock.ANY,
+            mock_ic)
+
+    def test_slo_stitched_metadata_update(self):
+        slo_meta = {
+            utils.SLO_HEADER: 'True',
+            'x-object-meta-new-key': 'foo',
+            'content-type': 'test/blob',
+            'etag': 'manifest-etag',
+        }
+        manifest = [
+            {'name': '/segments/slo-object/part1',
+             'hash': 'abcdef',
+             'bytes': 3 * SyncS3.MB},
+            {'name': '/segments/slo-object/part2',
+             'hash': 'fedcba',
+             'bytes': 3 * SyncS3.MB},
+            {'name': '/segments/slo-object/part3',
+             'hash': 'badbad',
+             'bytes': 6 * SyncS3.MB}]
+        s3_key = self.sync_s3.get_s3_name('slo-object')
+
+        def get_object_metadata(account, container, key, headers={}):
+            return {'content-length': manifest[int(key[-1]) - 1]['bytes']}
+        mock_ic = mock.Mock()
+        mock_ic.get_object_metadata.side_effect = get_object_metadata
+
+        self.mock_boto3_client.create_multipart_upload.return_value = {
+            'UploadId': 'mpu-upload'}
+
+        def upload_part_copy(**kwargs):
+            if kwargs['PartNumber'] == 1:
+                return {'CopyPartResult': {'ETag': '"stitched"'}}
+            elif kwargs['PartNumber'] == 2:
+                return {'CopyPartResult': {'ETag': '"badbad"'}}
+            raise RuntimeError('Invalid part!')
+
+        self.mock_boto3_client.upload_part_copy.side_effect = upload_part_copy
+        self.sync_s3.update_slo_metadata(slo_meta, manifest, s3_key, {},
+                                         mock_ic)
+
+        self.mock_boto3_client.create_multipart_upload.assert_called_once_with(
+            Bucket=self.aws_bucket, Key=s3_key,
+            Metadata={'new-key': 'foo', utils.SLO_HEADER: 'True',
+                      utils.SLO_ETAG_FIELD: 'manifest-etag'},
+            ServerSideEncryption='AES256',
+            ContentType='test/blob')
+        self.mock_boto3_client.upload_part_copy.assert_has_calls([
+            mock.call(Bucket=self.aws_bucket,
+                      CopySource={'Bucket': self.aws_bucket, 'Key': s3_key},
+                      Key=s3_key, PartNumber=1, UploadId='mpu-upload',
+                      CopySourceRange='bytes=0-%d' % (6 * SyncS3.MB - 1)),
+            mock.call(Bucket=self.aws_bucket,
+                      CopySource={'Bucket': self.aws_bucket, 'Key': s3_key},
+                      Key=s3_key, PartNumber=2, UploadId='mpu-upload',
+                      CopySourceRange='bytes=%d-%d' % (
+                          6 * SyncS3.MB, 12 * SyncS3.MB - 1)),
+        ])
+        self.mock_boto3_client.complete_multipart_upload\
+            .assert_called_once_with(
+                Bucket=self.aws_bucket, Key=s3_key, UploadId='mpu-upload',
+                MultipartUpload={'Parts': [
+                    {'PartNumber': 1, 'ETag': 'stitched'},
+                    {'PartNumber': 2, 'ETag': 'badbad'}]})
+
     def test_slo_metadata_update(self):
         slo_meta = {
             utils.SLO_HEADER: 'True',
@@ -1195,9 +1834,11 @@ class TestSyncS3(unittest.TestCase):
         }
         manifest = [
             {'name': '/segments/slo-object/part1',
-             'hash': 'abcdef'},
+             'hash': 'abcdef',
+             'bytes': 12 * SyncS3.MB},
             {'name': '/segments/slo-object/part2',
-             'hash': 'fedcba'}]
+             'hash': 'fedcba',
+             'bytes': 14 * SyncS3.MB}]
         s3_key = self.sync_s3.get_s3_name('slo-object')
         segment_lengths = [12 * SyncS3.MB, 14 * SyncS3.MB]
         storage_policy = 42
@@ -1268,7 +1909,8 @@ class TestSyncS3(unittest.TestCase):
         }
         manifest = [
             {'name': '/segments/slo-object/part1',
-             'hash': 'abcdef'}]
+             'hash': 'abcdef',
+             'bytes': 12 * SyncS3.MB}]
         s3_key = self.sync_s3.get_s3_name('slo-object')
         segment_lengths = [12 * SyncS3.MB, 14 * SyncS3.MB]
 
@@ -1303,14 +1945,61 @@ class TestSyncS3(unittest.TestCase):
             False, self.sync_s3._validate_slo_manifest(segments))
 
     def test_validate_manifest_small_part(self):
+        # Small segments are stitched together
         segments = [{'name': '/segment/1',
+                     'hash': 'abcdef',
                      'bytes': 10 * SyncS3.MB},
                     {'name': '/segment/2',
+                     'hash': 'abcdef',
                      'bytes': 10},
                     {'name': '/segment/3',
+                     'hash': 'abcdef',
                      'bytes': '10'}]
+        self.assertEqual(
+            True, self.sync_s3._validate_slo_manifest(segments))
+
+    def test_validate_manifest_too_many_stitched_parts(self):
+        segments = [{'name': '/segment/%d' % i,
+                     'hash': 'abcdef',
+                     'bytes': SyncS3.MIN_PART_SIZE}
+                    for i in xrange(SyncS3.MAX_PARTS + 1)]
         self.assertEqual(
             False, self.sync_s3._validate_slo_manifest(segments))
+        segments = [{'name': '/segment/%d' % i,
+                     'hash': 'abcdef',
+                     'bytes': SyncS3.MB}
+                    for i in xrange(SyncS3.MAX_PARTS + 1)]
+        self.assertEqual(
+            True, self.sync_s3._validate_slo_manifest(segments))
+
+    def test_validate_manifest_stitched_part_too_large(self):
+        segments = [{'name': '/segment/1',
+                     'hash': 'abcdef',
+                     'bytes': SyncS3.MB},
+                    {'name': '/segment/2',
+                     'hash': 'abcdef',
+                     'bytes': SyncS3.MAX_PART_SIZE}]
+        self.assertEqual(
+            False, self.sync_s3._validate_slo_manifest(segments))
+
+    def test_get_slo_parts(self):
+        tests = [
+            ([6, 6, 6], [[6], [6], [6]]),
+            ([6, 6, 1], [[6], [6], [1]]),
+            ([1, 1, 1], [[1, 1, 1]]),
+            ([1, 2, 3, 4, 5, 1], [[1, 2, 3], [4, 5], [1]]),
+            ([6, 1, 4, 1], [[6], [1, 4], [1]]),
+            ([], []),
+        ]
+        for sizes, expected in tests:
+            manifest = [{'name': '/segments/%d' % i,
+                         'bytes': size * SyncS3.MB}
+                        for i, size in enumerate(sizes)]
+            parts = self.sync_s3._get_slo_parts(manifest)
+            self.assertEqual(
+                expected, [[segment['bytes'] / SyncS3.MB for segment in part]
+                           for part in parts])
+            self.assertEqual(manifest, sum(parts, []))
 
     def test_validate_manifest_large_part(self):
         segments = [{'name': '/segment/1',
@@ -1637,3 +2326,84 @@ class TestSyncS3(unittest.TestCase):
             MaxKeys=10)
         self.assertEqual(500, resp.status)
         self.assertIn('failed to list', resp.body)
+
+    def test_get_object_parallel(self):
+        body = ''.join(chr(ord('a') + i % 26) for i in range(25))
+        s3_key = self.sync_s3.get_s3_name('key')
+
+        def get_object(**kwargs):
+            start, end = map(int, kwargs['Range'][len('bytes='):].split('-'))
+            end = min(end, len(body) - 1)
+            return {
+                'Body': StringIO(body[start:end + 1]),
+                'ResponseMetadata': {
+                    'HTTPStatusCode': 206,
+                    'HTTPHeaders': {
+                        'content-length': str(end - start + 1),
+                        'content-range': 'bytes %d-%d/%d' % (
+                            start, end, len(body)),
+                        'etag': '"deadbeef"',
+                        'x-amz-meta-foo': 'bar',
+                    }
+                }
+            }
+
+        self.mock_boto3_client.get_object.side_effect = get_object
+        resp = self.sync_s3.get_object_parallel('key', 10, 2)
+        self.assertEqual(200, resp.status)
+        self.assertEqual('25', resp.headers['Content-Length'])
+        self.assertEqual('deadbeef', resp.headers['etag'])
+        self.assertEqual('bar', resp.headers['x-object-meta-foo'])
+        self.assertNotIn('content-range', resp.headers)
+        self.assertEqual(body, ''.join(resp.body))
+        self.assertEqual([
+            mock.call(Bucket=self.aws_bucket, Key=s3_key, Range='bytes=0-9'),
+            mock.call(Bucket=self.aws_bucket, Key=s3_key, Range='bytes=10-19',
+                      IfMatch='"deadbeef"'),
+            mock.call(Bucket=self.aws_bucket, Key=s3_key, Range='bytes=20-24',
+                      IfMatch='"deadbeef"'),
+        ], self.mock_boto3_client.get_object.mock_calls)
+        self.assertEqual(
+            self.max_conns, self.sync_s3.client_pool.free_count())
+
+        # Objects that fit in a single part only require one request
+        self.mock_boto3_client.get_object.reset_mock()
+        resp = self.sync_s3.get_object_parallel('key', 100, 2)
+        self.assertEqual(200, resp.status)
+        self.assertEqual('25', resp.headers['Content-Length'])
+        self.assertEqual(body, ''.join(resp.body))
+        self.assertEqual(1, self.mock_boto3_client.get_object.call_count)
+        self.assertEqual(
+            self.max_conns, self.sync_s3.client_pool.free_count())
+
+    def test_get_object_parallel_changed(self):
+        body = 'a' * 25
+
+        def get_object(**kwargs):
+            if 'IfMatch' in kwargs:
+                raise ClientError(
+                    dict(Error=dict(Code='PreconditionFailed',
+                                    Message='precondition failed'),
+                         ResponseMetadata=dict(HTTPStatusCode=412,
+                                               HTTPHeaders={})),
+                    'get_object')
+            return {
+                'Body': StringIO(body[:10]),
+                'ResponseMetadata': {
+                    'HTTPStatusCode': 206,
+                    'HTTPHeaders': {
+                        'content-length': '10',
+                        'content-range': 'bytes 0-9/25',
+                        'etag': '"deadbeef"',
+                    }
+                }
+            }
+
+        self.mock_boto3_client.get_object.side_effect = get_object
+        resp = self.sync_s3.get_object_parallel('key', 10, 2)
+        self.assertEqual(200, resp.status)
+        with self.assertRaises(utils.RemoteHTTPError) as cm:
+            ''.join(resp.body)
+        self.assertEqual(412, cm.exception.resp.status)
+        self.assertEqual(
+            self.max_conns, self.sync_s3.client_pool.free_count())
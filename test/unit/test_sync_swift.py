@@ -14,14 +14,16 @@ See the License for the specific language governing permissions and
 limitations under the License.
 """
 
+import eventlet
 import json
 import mock
-from s3_sync.sync_swift import SyncSwift
+from s3_sync.sync_swift import AuthTokenCache, SyncSwift, get_auth_v1
 from s3_sync import utils
 import swiftclient
 from swiftclient.exceptions import ClientException
 from swift.common import swob
 from swift.common.internal_client import UnexpectedResponse
+import time
 import unittest
 from utils import FakeStream
 
@@ -181,6 +183,8 @@ class TestSyncSwift(unittest.TestCase):
             headers={'Content-Type': 'application/testing'},
             etag='deadbeef',
             content_length=0)
+        # The object is known not to be an SLO when it is deleted
+        self.assertEqual({key: False}, self.sync_swift._manifests)
 
     @mock.patch('s3_sync.sync_swift.swiftclient.client.Connection')
     @mock.patch('s3_sync.sync_swift.check_slo')
@@ -407,6 +411,7 @@ class TestSyncSwift(unittest.TestCase):
                       headers=swift_req_headers),
             mock.call('account', 'segment_container', 'slo-object/part2',
                       headers=swift_req_headers)])
+        self.assertEqual({slo_key: True}, self.sync_swift._manifests)
 
     @mock.patch('s3_sync.sync_swift.swiftclient.client.Connection')
     def test_upload_slo_extra_headers(self, mock_swift):
@@ -604,6 +609,126 @@ class TestSyncSwift(unittest.TestCase):
         swift_client.head_object.assert_called_once_with(
             self.aws_bucket, slo_key, headers={})
 
+    @mock.patch('s3_sync.sync_swift.swiftclient.client.Connection')
+    def test_delete_objects_bulk(self, mock_swift):
+        swift_client = mock_swift.return_value
+        swift_client.get_capabilities.return_value = {
+            'bulk_delete': {'max_deletes_per_request': 2}}
+        # The objects were uploaded by this provider and are not SLOs
+        for key in ['foo', 'b\xc3\xa4r', 'baz']:
+            self.sync_swift._set_manifest(key, False)
+        swift_client.post_account.side_effect = [
+            ({}, json.dumps({'Number Deleted': 1,
+                             'Number Not Found': 0,
+                             'Response Status': '400 Bad Request',
+                             'Errors': [['/bucket/b%C3%A4r',
+                                         '409 Conflict']]})),
+            ({}, json.dumps({'Number Deleted': 0,
+                             'Number Not Found': 1,
+                             'Response Status': '200 OK',
+                             'Errors': []}))]
+
+        results = self.sync_swift.delete_objects(
+            ['foo', 'b\xc3\xa4r', 'baz'])
+
+        self.assertEqual(None, results[0])
+        self.assertEqual('Failed to delete /bucket/b\xc3\xa4r: 409 Conflict',
+                         results[1].message)
+        self.assertEqual(None, results[2])
+        swift_client.head_container.assert_not_called()
+        swift_client.head_object.assert_not_called()
+        swift_client.delete_object.assert_not_called()
+        self.assertEqual(2, swift_client.post_account.call_count)
+        _, kwargs = swift_client.post_account.call_args_list[0]
+        self.assertEqual('bulk-delete', kwargs['query_string'])
+        self.assertEqual(
+            set(['/bucket/foo', '/bucket/b%C3%A4r']),
+            set(kwargs['data'].split('\n')))
+        self.assertEqual('application/json', kwargs['headers']['Accept'])
+        _, kwargs = swift_client.post_account.call_args_list[1]
+        self.assertEqual('/bucket/baz', kwargs['data'])
+
+        # The limit is only discovered once
+        self.sync_swift._set_manifest('foo', False)
+        self.sync_swift.delete_objects(['foo'])
+        swift_client.get_capabilities.assert_called_once_with()
+
+    @mock.patch('s3_sync.sync_swift.swiftclient.client.Connection')
+    def test_delete_objects_bulk_slo(self, mock_swift):
+        swift_client = mock_swift.return_value
+        self.sync_swift.bulk_delete_limit = 100
+        # Known objects are not examined
+        self.sync_swift._set_manifest('known-slo', True)
+        self.sync_swift._set_manifest('known', False)
+
+        def head_object(container, key, headers):
+            if key == 'slo':
+                return {'x-static-large-object': 'True'}
+            if key == 'missing':
+                raise swiftclient.exceptions.ClientException(
+                    'not found', http_status=404)
+            return {}
+        swift_client.head_object.side_effect = head_object
+        swift_client.delete_object.return_value = None
+        swift_client.post_account.return_value = (
+            {}, json.dumps({'Number Deleted': 2, 'Number Not Found': 0,
+                            'Response Status': '200 OK', 'Errors': []}))
+
+        self.assertEqual(
+            [None, None, None, None, None],
+            self.sync_swift.delete_objects(
+                ['foo', 'slo', 'missing', 'known-slo', 'known']))
+
+        swift_client.head_container.assert_not_called()
+        self.assertEqual(
+            [mock.call(self.aws_bucket, key, headers={})
+             for key in ['foo', 'slo', 'missing']],
+            swift_client.head_object.mock_calls)
+        self.assertEqual(
+            [mock.call(self.aws_bucket, key,
+                       query_string='multipart-manifest=delete', headers={})
+             for key in ['slo', 'known-slo']],
+            swift_client.delete_object.mock_calls)
+        swift_client.post_account.assert_called_once_with(
+            headers=mock.ANY, query_string='bulk-delete', data=mock.ANY)
+        self.assertEqual(
+            set(['/bucket/foo', '/bucket/known']),
+            set(swift_client.post_account.call_args[1]['data'].split('\n')))
+        # The deleted objects are forgotten
+        self.assertEqual({}, self.sync_swift._manifests)
+
+    @mock.patch('s3_sync.sync_swift.swiftclient.client.Connection')
+    def test_delete_objects_bulk_aborted(self, mock_swift):
+        swift_client = mock_swift.return_value
+        self.sync_swift.bulk_delete_limit = 100
+        swift_client.head_object.return_value = {}
+        swift_client.post_account.return_value = (
+            {}, json.dumps({'Number Deleted': 1, 'Number Not Found': 0,
+                            'Response Status': '502 Bad Gateway',
+                            'Response Body': 'Max delete failures exceeded',
+                            'Errors': []}))
+
+        results = self.sync_swift.delete_objects(['foo', 'bar'])
+        self.assertEqual(
+            ['Bulk delete failed: 502 Bad Gateway '
+             'Max delete failures exceeded'] * 2,
+            [error.message for error in results])
+
+    @mock.patch('s3_sync.sync_swift.swiftclient.client.Connection')
+    def test_delete_objects_no_bulk(self, mock_swift):
+        swift_client = mock_swift.return_value
+        swift_client.get_capabilities.return_value = {'swift': {}}
+        swift_client.head_object.return_value = {}
+        swift_client.delete_object.return_value = None
+
+        self.assertEqual([None, None],
+                         self.sync_swift.delete_objects(['foo', 'bar']))
+        self.assertEqual(0, self.sync_swift.bulk_delete_limit)
+        swift_client.post_account.assert_not_called()
+        swift_client.delete_object.assert_has_calls(
+            [mock.call(self.aws_bucket, 'foo', headers={}),
+             mock.call(self.aws_bucket, 'bar', headers={})])
+
     @mock.patch('s3_sync.sync_swift.swiftclient.client.Connection')
     def test_shunt_object(self, mock_swift):
         key = 'key'
@@ -870,3 +995,170 @@ class TestSyncSwift(unittest.TestCase):
         self.assertEqual(200, resp.status)
         self.assertEqual({'x-account-meta-header': 'value'}, resp.headers)
         self.assertEqual(containers, resp.body)
+
+    @mock.patch('s3_sync.sync_swift.swiftclient.client.Connection')
+    def test_get_object_parallel(self, mock_swift):
+        body = ''.join(chr(ord('a') + i % 26) for i in range(25))
+        swift_client = mock_swift.return_value
+
+        def get_object(container, key, headers, resp_chunk_size):
+            start, end = map(
+                int, headers['Range'][len('bytes='):].split('-'))
+            end = min(end, len(body) - 1)
+            return ({'content-length': str(end - start + 1),
+                     'content-range': 'bytes %d-%d/%d' % (
+                         start, end, len(body)),
+                     'etag': 'deadbeef'},
+                    FakeBody(body[start:end + 1], chunk=5))
+
+        swift_client.get_object.side_effect = get_object
+        resp = self.sync_swift.get_object_parallel('key', 10, 2)
+        self.assertEqual(200, resp.status)
+        self.assertEqual('25', resp.headers['Content-Length'])
+        self.assertNotIn('content-range', resp.headers)
+        self.assertEqual(body, ''.join(resp.body))
+        self.assertEqual([
+            mock.call(self.aws_bucket, 'key',
+                      headers={'Range': 'bytes=0-9'}, resp_chunk_size=65536),
+            mock.call(self.aws_bucket, 'key',
+                      headers={'Range': 'bytes=10-19', 'If-Match': 'deadbeef'},
+                      resp_chunk_size=65536),
+            mock.call(self.aws_bucket, 'key',
+                      headers={'Range': 'bytes=20-24', 'If-Match': 'deadbeef'},
+                      resp_chunk_size=65536),
+        ], swift_client.get_object.mock_calls)
+        self.assertEqual(
+            self.max_conns, self.sync_swift.client_pool.free_count())
+
+
+class TestAuthTokenCache(unittest.TestCase):
+    def test_get_auth(self):
+        cache = AuthTokenCache(ttl=60)
+        auth_func = mock.Mock(side_effect=[('url', 'token-1'),
+                                           ('url', 'token-2'),
+                                           ('url', 'token-3')])
+
+        self.assertEqual(('url', 'token-1'), cache.get_auth('key', auth_func))
+        self.assertEqual(('url', 'token-1'), cache.get_auth('key', auth_func))
+        self.assertEqual(1, auth_func.call_count)
+
+        # A rejected token is refreshed
+        self.assertEqual(('url', 'token-2'), cache.get_auth(
+            'key', auth_func, invalid_token='token-1'))
+        # ... but only once, if it was refreshed already
+        self.assertEqual(('url', 'token-2'), cache.get_auth(
+            'key', auth_func, invalid_token='token-1'))
+        self.assertEqual(2, auth_func.call_count)
+
+        # Tokens are refreshed before they expire
+        with mock.patch('s3_sync.sync_swift.time.time',
+                        return_value=time.time() + 31):
+            self.assertEqual(('url', 'token-3'),
+                             cache.get_auth('key', auth_func))
+        self.assertEqual(3, auth_func.call_count)
+
+    def test_get_auth_expiry(self):
+        cache = AuthTokenCache()
+        auth_func = mock.Mock(side_effect=[('url', 'token-1', 600),
+                                           ('url', 'token-2', None)])
+        now = time.time()
+        with mock.patch('s3_sync.sync_swift.time.time', return_value=now):
+            self.assertEqual(('url', 'token-1'),
+                             cache.get_auth('key', auth_func))
+        # The reported expiry is used instead of the TTL
+        with mock.patch('s3_sync.sync_swift.time.time',
+                        return_value=now + 539):
+            self.assertEqual(('url', 'token-1'),
+                             cache.get_auth('key', auth_func))
+        with mock.patch('s3_sync.sync_swift.time.time',
+                        return_value=now + 540):
+            self.assertEqual(('url', 'token-2'),
+                             cache.get_auth('key', auth_func))
+        # Otherwise, the token is used for the TTL
+        with mock.patch('s3_sync.sync_swift.time.time',
+                        return_value=now + 540 + 3539):
+            self.assertEqual(('url', 'token-2'),
+                             cache.get_auth('key', auth_func))
+        self.assertEqual(2, auth_func.call_count)
+
+    @mock.patch('s3_sync.sync_swift.swiftclient.client.http_connection')
+    def test_get_auth_v1(self, mock_http_connection):
+        http_conn = mock.Mock()
+        mock_http_connection.return_value = (
+            mock.Mock(path='/auth/v1.0'), http_conn)
+        resp = http_conn.getresponse.return_value
+        resp.status = 200
+        resp.read.return_value = ''
+        headers = {'x-storage-url': 'http://swift/v1/AUTH_test',
+                   'x-auth-token': 'token',
+                   'x-auth-token-expires': '86399'}
+        resp.getheader.side_effect = \
+            lambda name, default=None: headers.get(name, default)
+        conn = swiftclient.client.Connection(
+            authurl='http://swift/auth/v1.0', user='user', key='key')
+
+        self.assertEqual(('http://swift/v1/AUTH_test', 'token', 86399),
+                         get_auth_v1(conn))
+        http_conn.request.assert_called_once_with(
+            'GET', '/auth/v1.0', '',
+            {'X-Auth-User': 'user', 'X-Auth-Key': 'key'})
+
+        # The expiry is optional and the storage URL may be overridden
+        del headers['x-auth-token-expires']
+        conn.os_options['object_storage_url'] = 'http://swift/v1/AUTH_other'
+        self.assertEqual(('http://swift/v1/AUTH_other', 'token', None),
+                         get_auth_v1(conn))
+
+        resp.status = 401
+        resp.request.url = 'http://swift/auth/v1.0'
+        with self.assertRaises(swiftclient.exceptions.ClientException):
+            get_auth_v1(conn)
+
+    def test_single_refresh(self):
+        cache = AuthTokenCache()
+
+        def auth_func():
+            eventlet.sleep(0.01)
+            return ('url', 'token')
+        auth_func = mock.Mock(side_effect=auth_func)
+
+        pool = eventlet.GreenPool()
+        results = list(pool.imap(
+            lambda _: cache.get_auth('key', auth_func), range(5)))
+        self.assertEqual([('url', 'token')] * 5, results)
+        self.assertEqual(1, auth_func.call_count)
+
+    @mock.patch('s3_sync.sync_swift.get_auth_v1')
+    def test_shared_connections(self, mock_get_auth):
+        mock_get_auth.side_effect = [('url', 'token-1', None),
+                                     ('url', 'token-2', None)]
+        mapping = {
+            'aws_bucket': 'bucket',
+            'aws_identity': 'identity',
+            'aws_secret': 'credential',
+            'account': 'account',
+            'container': 'container',
+            'aws_endpoint': 'http://swift.url/auth/v1.0',
+        }
+        with mock.patch('s3_sync.sync_swift.AUTH_TOKEN_CACHE',
+                        AuthTokenCache()):
+            factory = SyncSwift(mapping)._get_client_factory()
+            conn1 = factory()
+            conn2 = factory()
+            self.assertEqual(('url', 'token-1'), conn1.get_auth())
+            self.assertEqual(('url', 'token-1'), conn2.get_auth())
+            self.assertEqual('token-1', conn2.token)
+            self.assertEqual(1, mock_get_auth.call_count)
+
+            # A rejected token is refreshed once for all connections
+            conn1.url = conn1.token = None
+            self.assertEqual(('url', 'token-2'), conn1.get_auth())
+            conn2.url = conn2.token = None
+            self.assertEqual(('url', 'token-2'), conn2.get_auth())
+            self.assertEqual(2, mock_get_auth.call_count)
+
+            # Different credentials do not share the token
+            mock_get_auth.side_effect = [('url', 'other-token', None)]
+            mapping['aws_secret'] = 'other-credential'
+            conn3 = SyncSwift(mapping)._get_client_factory()()
+            self.assertEqual(('url', 'other-token'), conn3.get_auth())
@@ -16,10 +16,15 @@ See the License for the specific language governing permissions and
 limitations under the License.
 """
 
+import eventlet
+import hashlib
 from itertools import repeat
+import json
 import mock
 import os
+import shutil
 import StringIO
+import tempfile
 import unittest
 
 from utils import FakeStream
@@ -205,6 +210,170 @@ class TestUtilsFunctions(unittest.TestCase):
             'x-object-transient-sysmeta-' + utils.MIGRATOR_HEADER,
             utils.get_sys_migrator_header('object'))
 
+    def test_dump_json_atomically(self):
+        tempdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tempdir)
+        path = os.path.join(tempdir, 'status')
+
+        utils.dump_json_atomically({'foo': 1}, path)
+        utils.dump_json_atomically({'foo': 2}, path)
+        with open(path) as fh:
+            self.assertEqual({'foo': 2}, json.load(fh))
+
+        # A failed write leaves the previous contents in place
+        with self.assertRaises(TypeError):
+            utils.dump_json_atomically({'foo': object()}, path)
+        with open(path) as fh:
+            self.assertEqual({'foo': 2}, json.load(fh))
+        self.assertEqual(['status'], os.listdir(tempdir))
+
+    def test_iter_json_array(self):
+        listing = [{'name': u'\u062a' * 10, 'bytes': 12345},
+                   {'subdir': 'foo/'}, 42]
+        data = json.dumps(listing)
+        for chunk_size in (1, 3, 7, len(data)):
+            chunks = [data[i:i + chunk_size]
+                      for i in range(0, len(data), chunk_size)]
+            self.assertEqual(listing, list(utils.iter_json_array(chunks)))
+        self.assertEqual([], list(utils.iter_json_array([' [', '] '])))
+
+        # Entries are yielded before the whole array is read
+        chunks = iter(['[{"name": "a"}, ', '{"name": "b"}', ']'])
+        entries = utils.iter_json_array(chunks)
+        self.assertEqual({'name': 'a'}, next(entries))
+        self.assertEqual(['{"name": "b"}', ']'], list(chunks))
+
+        for bad in (['{}'], ['[1, 2'], ['[{"name": "a"'], ['[{]']):
+            with self.assertRaises(ValueError):
+                list(utils.iter_json_array(bad))
+
+    def test_iter_listing_pages_prefetch(self):
+        pages = [[{'name': 'a'}], [{'name': 'b'}], [{'name': 'c'}],
+                 [{'name': 'd'}], []]
+        requested = []
+
+        def next_page(entries):
+            requested.append(entries[-1]['name'])
+            return base_sync.ProviderResponse(
+                True, 200, {}, pages[len(requested)])
+
+        first = base_sync.ProviderResponse(True, 200, {}, pages[0])
+        page_iter = utils.iter_listing_pages(first, next_page, prefetch=2)
+        self.assertIs(first, next(page_iter))
+        # The following pages are requested in the background, but no more
+        # than the prefetch limit
+        eventlet.sleep(0)
+        self.assertEqual(['a', 'b'], requested)
+        self.assertEqual(pages[1], next(page_iter).body)
+        eventlet.sleep(0)
+        self.assertEqual(['a', 'b', 'c'], requested)
+
+        # Closing the iterator stops the prefetching
+        page_iter.close()
+        eventlet.sleep(0)
+        self.assertEqual(['a', 'b', 'c'], requested)
+
+        requested[:] = []
+        self.assertEqual(pages, [
+            page.body for page in utils.iter_listing_pages(
+                first, next_page, prefetch=1)])
+        self.assertEqual(['a', 'b', 'c', 'd'], requested)
+        requested[:] = []
+        self.assertEqual(pages, [
+            page.body for page in utils.iter_listing_pages(first, next_page)])
+
+    def test_iter_listing_pages_prefetch_error(self):
+        first = base_sync.ProviderResponse(True, 200, {}, [{'name': 'a'}])
+        page_iter = utils.iter_listing_pages(
+            first, mock.Mock(side_effect=RuntimeError('oops')), prefetch=1)
+        self.assertIs(first, next(page_iter))
+        with self.assertRaises(RuntimeError):
+            next(page_iter)
+
+    def test_iter_listing_prefetch(self):
+        list_func = mock.Mock(side_effect=[
+            base_sync.ProviderResponse(
+                True, 200, {}, [{'name': u'\u062a', 'content_location': 'x'}]),
+            base_sync.ProviderResponse(
+                True, 200, {}, [{'subdir': 'b/', 'content_location': 'x'}]),
+            base_sync.ProviderResponse(True, 200, {}, [])])
+        resp, entries = utils.iter_listing(
+            list_func, mock.Mock(), '', 10, 'p', '/', prefetch=1)
+        self.assertEqual(200, resp.status)
+        self.assertEqual(
+            [u'\u062a', 'b/', None], [key for _, key in entries])
+        list_func.assert_has_calls([
+            mock.call('', 10, 'p', '/'),
+            mock.call('\xd8\xaa', 10, 'p', '/'),
+            mock.call('b/', 10, 'p', '/')])
+        with self.assertRaises(TypeError):
+            utils.iter_listing(list_func, None, '', 10, 'p', foo=1)
+
+    def test_iter_splice_listing_stops_at_limit(self):
+        pages = [
+            [{'name': 'b', 'content_location': 'remote'},
+             {'name': 'd', 'content_location': 'remote'}],
+            [{'name': 'e', 'content_location': 'remote'}],
+            []]
+        list_func = mock.Mock(side_effect=[
+            base_sync.ProviderResponse(True, 200, {}, page)
+            for page in pages])
+        _, remote_iter = utils.iter_listing(
+            list_func, mock.Mock(), '', 3, '')
+        local = [{'name': 'a'}, {'name': 'c'}, {'name': 'f'}]
+
+        spliced = utils.iter_splice_listing(iter(local), remote_iter, 3)
+        self.assertEqual({'name': 'a'}, next(spliced))
+        self.assertEqual(
+            ['b', 'c'], [entry['name'] for entry in spliced])
+        # The second page is never requested
+        list_func.assert_called_once_with('', 3, '')
+
+        _, remote_iter = utils.iter_listing(
+            mock.Mock(side_effect=[
+                base_sync.ProviderResponse(True, 200, {}, page)
+                for page in pages]), mock.Mock(), '', 10, '')
+        self.assertEqual(
+            ['a', 'b', 'c', 'd', 'e', 'f'],
+            [entry['name'] for entry in utils.splice_listing(
+                local, remote_iter, 10)])
+
+    def test_iter_listing_response(self):
+        listing = [
+            {'name': u'caf\xe9 & <bar>', 'hash': 'etag', 'bytes': 10,
+             'last_modified': 'date', 'content_type': 'text/plain',
+             'content_location': ['remote']},
+            {'subdir': 'foo/'}]
+        for list_format in ('application/json', 'application/xml',
+                            'text/plain'):
+            chunks = list(utils.iter_listing_response(
+                iter(listing), list_format, u'cont\xe9'))
+            self.assertGreater(len(chunks), 1)
+            self.assertEqual(
+                utils.format_listing_response(
+                    listing, list_format, u'cont\xe9'),
+                ''.join(chunks))
+            self.assertTrue(all(isinstance(chunk, str) for chunk in chunks))
+
+        self.assertEqual(listing, json.loads(''.join(
+            utils.iter_listing_response(listing, 'application/json', 'c'))))
+        self.assertEqual('[]', utils.format_listing_response(
+            [], 'application/json', 'c'))
+        self.assertEqual(
+            '<?xml version="1.0" encoding="UTF-8"?>\n'
+            '<container name="c"/>',
+            utils.format_listing_response([], 'application/xml', 'c'))
+        self.assertEqual(
+            'caf\xc3\xa9 & <bar>\nfoo/',
+            utils.format_listing_response(listing, 'text/plain', 'c'))
+        xml = utils.format_container_listing_response(
+            [{'name': 'c1', 'count': 1, 'bytes': 2}], 'application/xml',
+            'acct')
+        self.assertEqual(
+            '<?xml version="1.0" encoding="UTF-8"?>\n'
+            '<account name="acct"><container><name>c1</name>'
+            '<count>1</count><bytes>2</bytes></container></account>', xml)
+
 
 class FakeSwift(object):
     def __init__(self, status=200, size=1024, content_length='UNSPECIFIED',
@@ -390,6 +559,37 @@ class TestSeekableFileLikeIter(unittest.TestCase):
         # final read delivers EOF
         self.assertEqual('', self.seeker.read(1))
 
+    def test_partial_reads_copy_once(self):
+        chunks = ['a' * 8 + 'b' * 8, 'c' * 16]
+        self.seeker = utils.SeekableFileLikeIter(chunks, length=30)
+        # Reading whole chunks returns them as-is
+        self.assertIs(chunks[0], self.seeker.read(16))
+        self.assertEqual('c' * 4, self.seeker.read(4))
+        # The chunk is kept whole, along with the offset of the unread data
+        self.assertIs(chunks[1], self.seeker._buf)
+        self.assertEqual(4, self.seeker._buf_offset)
+        self.assertEqual('c' * 12, self.seeker.buf)
+        self.assertEqual('c' * 8, self.seeker.read(8))
+        # Truncated to the length
+        self.assertEqual('c' * 2, self.seeker.read(8))
+        self.assertEqual(30, self.seeker.tell())
+        self.assertIsNone(self.seeker.buf)
+        self.assertEqual('', self.seeker.read(8))
+
+    def test_readline_after_partial_read(self):
+        self.seeker = utils.SeekableFileLikeIter(['ab\ncd\nef', 'g\n'])
+        self.assertEqual('a', self.seeker.read(1))
+        self.assertEqual('b\n', self.seeker.readline())
+        self.assertEqual(['cd\n', 'efg\n'], self.seeker.readlines())
+
+    def test_seek_zero_drops_buffer(self):
+        self.seeker = utils.SeekableFileLikeIter(
+            ['abcd'], seek_zero_cb=lambda: iter(['wxyz']))
+        self.assertEqual('ab', self.seeker.read(2))
+        self.seeker.seek(0)
+        self.assertEqual(0, self.seeker.tell())
+        self.assertEqual('wxyz', self.seeker.read(8))
+
 
 class TestFileWrapper(unittest.TestCase):
     def setUp(self):
@@ -619,6 +819,63 @@ class TestSLOFileWrapper(unittest.TestCase):
         self.assertEqual(True, part1_content.closed)
         self.assertEqual(True, part2_content.closed)
 
+    def test_iterate_and_md5(self):
+        contents = {'part1': 'A' * 500, 'part2': 'B' * 1000}
+
+        def get_object(account, container, key, headers={}):
+            return (200, {'Content-Length': len(contents[key])},
+                    FakeStream(content=contents[key]))
+
+        self.swift.get_object.side_effect = get_object
+        segments = utils.SegmentsFileWrapper(
+            self.swift, 'account', self.manifest)
+        self.assertEqual('A' * 500 + 'B' * 1000, ''.join(segments))
+        self.assertEqual(1500, segments.tell())
+        self.assertEqual(hashlib.md5('A' * 500 + 'B' * 1000).hexdigest(),
+                         segments.get_md5())
+
+        # Re-reading the data starts the checksum over
+        segments.seek(0)
+        self.assertEqual(0, segments.tell())
+        self.assertEqual('A' * 500 + 'B' * 1000, ''.join(segments))
+        self.assertEqual(hashlib.md5('A' * 500 + 'B' * 1000).hexdigest(),
+                         segments.get_md5())
+        segments.close()
+
+
+class TestBlobstorePutWrapper(unittest.TestCase):
+    def _make_wrapper(self, chunks, chunk_size=8):
+        queue = eventlet.queue.Queue()
+        for chunk in chunks:
+            queue.put(chunk)
+        return utils.BlobstorePutWrapper(chunk_size, queue)
+
+    def test_read_across_chunks(self):
+        wrapper = self._make_wrapper(['abc', 'defgh', 'ij', ''])
+        self.assertEqual('ab', wrapper.read(2))
+        self.assertEqual('cdefghij', wrapper.read(100))
+        self.assertEqual('', wrapper.read(4))
+        self.assertTrue(wrapper.closed)
+
+    def test_read_whole_chunks(self):
+        chunks = ['a' * 8, 'b' * 8, '']
+        wrapper = self._make_wrapper(chunks)
+        # Reads of whole chunks return the queued strings themselves
+        self.assertIs(chunks[0], wrapper.read())
+        self.assertIs(chunks[1], wrapper.read(8))
+        self.assertEqual('', wrapper.read())
+
+    def test_read_negative(self):
+        wrapper = self._make_wrapper(['abc'])
+        with self.assertRaises(RuntimeError):
+            wrapper.read(-2)
+
+    def test_close(self):
+        wrapper = self._make_wrapper(['abc'])
+        self.assertEqual('a', wrapper.read(1))
+        wrapper.close()
+        self.assertEqual('', wrapper.read(1))
+
 
 class TestClosingResourceIterable(unittest.TestCase):
     def test_resource_close_afted_read(self):
@@ -685,3 +942,165 @@ class TestClosingResourceIterable(unittest.TestCase):
         self.assertEqual(1, resource.semaphore.balance)
         closing_iter.close()
         self.assertEqual(1, resource.semaphore.balance)
+
+
+class TestParallelRangeIterable(unittest.TestCase):
+    def setUp(self):
+        self.data = ''.join(chr(ord('a') + i % 26) for i in range(35))
+        self.ranges = []
+
+        def get_range(start, end):
+            self.ranges.append((start, end))
+            return self.data[start:end + 1]
+        self.get_range = get_range
+
+    def test_reassembles_parts(self):
+        first_body = mock.MagicMock()
+        first_body.__iter__.return_value = iter(
+            [self.data[:5], self.data[5:10]])
+        range_iter = utils.ParallelRangeIterable(
+            first_body, self.get_range, len(self.data), 10, 2)
+        self.assertEqual(self.data, ''.join(range_iter))
+        self.assertEqual([(10, 19), (20, 29), (30, 34)], self.ranges)
+        self.assertTrue(range_iter.closed)
+        first_body.close.assert_called_once_with()
+
+    def test_bounded_concurrency(self):
+        range_iter = utils.ParallelRangeIterable(
+            iter([self.data[:5]]), self.get_range, len(self.data), 5, 2)
+        self.assertEqual(self.data[:5], next(range_iter))
+        self.assertEqual(2, len(range_iter.pending))
+        self.assertEqual(self.data[5:10], next(range_iter))
+        self.assertEqual(2, len(range_iter.pending))
+        self.assertEqual(self.data, self.data[:10] + ''.join(range_iter))
+        self.assertEqual(0, len(range_iter.pending))
+
+    def test_close_before_read(self):
+        first_body = mock.Mock()
+        range_iter = utils.ParallelRangeIterable(
+            first_body, self.get_range, len(self.data), 10, 2)
+        range_iter.close()
+        self.assertEqual([], self.ranges)
+        first_body.close.assert_called_once_with()
+        with self.assertRaises(ValueError):
+            next(range_iter)
+
+    def test_part_error(self):
+        def get_range(start, end):
+            raise RuntimeError('oops')
+
+        first_body = mock.MagicMock()
+        first_body.__iter__.return_value = iter([self.data[:10]])
+        range_iter = utils.ParallelRangeIterable(
+            first_body, get_range, len(self.data), 10, 2)
+        self.assertEqual(self.data[:10], next(range_iter))
+        with self.assertRaises(RuntimeError):
+            next(range_iter)
+        self.assertTrue(range_iter.closed)
+        self.assertEqual([], range_iter.pending)
+        first_body.close.assert_called_once_with()
+
+
+class FakeLocalSwift(object):
+    def __init__(self, failures=()):
+        self.failures = failures
+        self.calls = []
+        self.envs = []
+
+    def __call__(self, env, start_response):
+        self.envs.append(env)
+        self.calls.append((env['REQUEST_METHOD'], env['PATH_INFO'],
+                           env['wsgi.input'].read(), env.get('HTTP_ETAG')))
+        if env['PATH_INFO'] in self.failures:
+            start_response('503 Service Unavailable', [])
+        else:
+            start_response('201 Created', [])
+        return ['']
+
+
+class TestSwiftSloRestore(unittest.TestCase):
+    def setUp(self):
+        self.data = 'a' * 10 + 'b' * 10 + 'c' * 5
+        self.manifest = [
+            {'name': '/segments/part%d' % i,
+             'hash': hashlib.md5(data).hexdigest(),
+             'bytes': len(data)}
+            for i, data in enumerate(
+                [self.data[:10], self.data[10:20], self.data[20:]])]
+        self.ranges = []
+
+        def get_range(start, end):
+            self.ranges.append((start, end))
+            return iter([self.data[start:end + 1]])
+        self.get_range = get_range
+
+    def test_restore(self):
+        app = FakeLocalSwift()
+        restore = utils.SwiftSloRestore(
+            self.get_range, {'Content-Length': '25', utils.SLO_HEADER: 'True'},
+            '/v1/AUTH_a/c/slo', app, self.manifest, 2, None)
+        self.assertTrue(restore.start().wait())
+        self.assertEqual([(0, 9), (10, 19), (20, 24)], sorted(self.ranges))
+        self.assertEqual(('PUT', '/v1/AUTH_a/segments', '', None),
+                         app.calls[0])
+        self.assertEqual(
+            [('PUT', '/v1/AUTH_a/segments/part%d' % i, data, etag)
+             for i, (data, etag) in enumerate([
+                 (self.data[:10], self.manifest[0]['hash']),
+                 (self.data[10:20], self.manifest[1]['hash']),
+                 (self.data[20:], self.manifest[2]['hash'])])],
+            sorted(app.calls[1:-1]))
+        method, path, body, _ = app.calls[-1]
+        self.assertEqual(('PUT', '/v1/AUTH_a/c/slo'), (method, path))
+        self.assertEqual(
+            ['/segments/part0', '/segments/part1', '/segments/part2'],
+            [entry['path'] for entry in json.loads(body)])
+
+    def test_restore_internal_manifest(self):
+        # Without the SLO middleware, the manifest is stored as is
+        app = FakeLocalSwift()
+        headers = {'Content-Length': '25', utils.SLO_HEADER: 'True',
+                   'Content-Type': 'application/octet-stream'}
+        restore = utils.SwiftSloRestore(
+            self.get_range, headers, '/v1/AUTH_a/c/slo', app, self.manifest,
+            2, None, internal_manifest=True)
+        self.assertTrue(restore.run())
+        env = app.envs[-1]
+        self.assertEqual('/v1/AUTH_a/c/slo', env['PATH_INFO'])
+        self.assertNotIn('multipart-manifest', env.get('QUERY_STRING', ''))
+        body = app.calls[-1][2]
+        self.assertEqual(self.manifest, json.loads(body))
+        self.assertEqual('True', env['HTTP_X_STATIC_LARGE_OBJECT'])
+        self.assertEqual(hashlib.md5(body).hexdigest(), env['HTTP_ETAG'])
+        self.assertEqual(str(len(body)), env['CONTENT_LENGTH'])
+
+    def test_segment_failure(self):
+        app = FakeLocalSwift(failures=('/v1/AUTH_a/segments/part1',))
+        logger = mock.Mock()
+        restore = utils.SwiftSloRestore(
+            self.get_range, {'Content-Length': '25'}, '/v1/AUTH_a/c/slo',
+            app, self.manifest, 2, logger)
+        self.assertFalse(restore.run())
+        # The other segments are still restored, but not the manifest
+        self.assertEqual(
+            ['/v1/AUTH_a/segments', '/v1/AUTH_a/segments/part0',
+             '/v1/AUTH_a/segments/part1', '/v1/AUTH_a/segments/part2'],
+            sorted(call[1] for call in app.calls))
+        logger.warning.assert_called_once_with(
+            'Failed to restore segment /segments/part1: '
+            '503 Service Unavailable')
+
+    def test_fetch_failure(self):
+        def get_range(start, end):
+            raise RuntimeError('oops')
+
+        app = FakeLocalSwift()
+        logger = mock.Mock()
+        restore = utils.SwiftSloRestore(
+            get_range, {'Content-Length': '25'}, '/v1/AUTH_a/c/slo', app,
+            self.manifest[:1], 2, logger)
+        self.assertFalse(restore.run())
+        self.assertEqual(['/v1/AUTH_a/segments'],
+                         [call[1] for call in app.calls])
+        logger.warning.assert_called_once_with(
+            'Failed to fetch segment /segments/part0: oops')